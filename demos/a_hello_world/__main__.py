@@ -6,6 +6,8 @@ import os
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from ..utils.cache_utils import with_response_cache
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -14,8 +16,9 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("Please set the OPENAI_API_KEY environment variable.")
 
-# Initialize OpenAI client
-openai_service = OpenAI(api_key=OPENAI_API_KEY)
+# Initialize OpenAI client, identical requests are served from the response
+# cache when OPENAI_RESPONSE_CACHE is set
+openai_service = with_response_cache(OpenAI(api_key=OPENAI_API_KEY))
 
 # Example usage: Generate a haiku about recursion in programming
 completion = openai_service.chat.completions.create(
@@ -2,10 +2,15 @@
 # python -m demos.b_import_service
 
 # import an instantiate OpenAI client object
+from ..utils.cache_utils import with_response_cache
 from ..utils.openai_utils import openai_service
 
+# serve identical requests from the response cache when
+# OPENAI_RESPONSE_CACHE is set
+cached_openai_service = with_response_cache(openai_service)
+
 # Example usage: Generate a haiku about recursion in programming
-completion = openai_service.chat.completions.create(
+completion = cached_openai_service.chat.completions.create(
     model="gpt-4o-mini",
     messages=[
         {"role": "system", "content": "You are a helpful assistant."},
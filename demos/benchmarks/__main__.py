@@ -0,0 +1,84 @@
+# To run this script, use the command from the root folder of the repo:
+# python -m demos.benchmarks [scenario ...] [--json results.json]
+#     [--baseline baseline.json] [--first-token SECONDS] [--per-token SECONDS]
+#
+# Times the flows of the demos against a mock of the OpenAI API, so no
+# requests are paid for. With the default zero latency the numbers are the
+# overhead of our own code. Each scenario runs in a fresh process to keep
+# its peak memory apart. With --baseline the run fails when a scenario's
+# p95 latency or throughput is worse than the baseline by more than the
+# tolerance, so regressions show up in CI. A scenario that cannot run here,
+# e.g. without pdftoppm, is skipped with its reason on stderr.
+
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from multiprocessing import get_context
+from pathlib import Path
+
+from .mock_openai import MockLatency
+from .runner import DEFAULT_TOLERANCE, find_regressions, run_scenario
+from .scenarios import SCENARIOS, ScenarioUnavailableError
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m demos.benchmarks")
+    parser.add_argument(
+        "scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument("--iterations", type=int)
+    parser.add_argument("--first-token", type=float, default=0.0)
+    parser.add_argument("--per-token", type=float, default=0.0)
+    parser.add_argument("--json", type=Path, help="save the results")
+    parser.add_argument("--baseline", type=Path, help="compare the results")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    latency = MockLatency(args.first_token, args.per_token)
+    results = []
+    print(
+        f"{'scenario':<20} {'p50':>9} {'p95':>9} {'p99':>9} "
+        f"{'ops/s':>8} {'requests':>9} {'peak RSS':>9}"
+    )
+    for name in args.scenarios or list(SCENARIOS):
+        iterations = args.iterations or SCENARIOS[name].iterations
+        # a fresh process per scenario, so its peak RSS is its own
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            future = pool.submit(run_scenario, name, iterations, latency)
+            try:
+                result = future.result()
+            except ScenarioUnavailableError as e:
+                print(f"{name:<20} skipped: {e}", file=sys.stderr)
+                continue
+        results.append(result)
+
+        print(
+            f"{name:<20} {result.p50 * 1000:>7.2f}ms "
+            f"{result.p95 * 1000:>7.2f}ms {result.p99 * 1000:>7.2f}ms "
+            f"{result.throughput:>8.1f} {result.requests:>9} "
+            f"{result.peak_rss_mb:>7.1f}MB"
+        )
+
+    if args.json:
+        args.json.write_text(
+            json.dumps(
+                {result.scenario: asdict(result) for result in results},
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit("Regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
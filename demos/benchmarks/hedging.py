@@ -0,0 +1,245 @@
+# To run this script, use the command from the root folder of the repo:
+# python -m demos.benchmarks.hedging [--requests N] [--outlier-rate RATE]
+#
+# Sends chat completions, plain and streamed, from threads and from asyncio
+# tasks to a mock that answers in 50 ms except for a few outliers that take
+# a second longer, once as they are and once through the hedging transport.
+# Each run first sends untimed requests so the policy knows the p95, as it
+# would in a process that has been serving for a while.
+# Cancelled counts the losing asyncio requests the mock saw cancelled, the
+# threads cannot interrupt a request and close the loser when it answers.
+# Exits with an error if a request fails, the hedges pass the rate cap or a
+# hedged run does not have a lower p99 than the same run without hedging.
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import openai
+
+from ..utils.hedging_utils import (
+    HEDGE_BURST,
+    MIN_LATENCY_SAMPLES,
+    HedgePolicy,
+)
+from .mock_openai import (
+    MockLatency,
+    MockOpenAI,
+    mock_async_client,
+    mock_client,
+)
+
+MAX_HEDGE_RATE = 0.05
+WORKERS = 8
+
+
+@dataclass
+class HedgingRun:
+    name: str
+    latencies: list[float]
+    failed: int
+    mock_requests: int
+    outliers: int
+    cancelled: int
+    policy: HedgePolicy | None
+
+    def percentile(self, percent: int) -> float:
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[
+            percent - 1
+        ]
+
+
+def _latency(outlier_rate: float) -> MockLatency:
+    return MockLatency(
+        first_token=0.05,
+        per_token=0.0005,
+        outlier_rate=outlier_rate,
+        outlier_delay=1.0,
+        seed=7,
+    )
+
+
+def _request(client: openai.OpenAI, index: int, stream: bool) -> float:
+    start = time.perf_counter()
+    messages: list[openai.types.chat.ChatCompletionMessageParam] = [
+        {"role": "user", "content": f"Question {index}"}
+    ]
+    if stream:
+        for _ in client.chat.completions.create(
+            model="gpt-4o-mini", messages=messages, stream=True
+        ):
+            pass
+    else:
+        client.chat.completions.create(model="gpt-4o-mini", messages=messages)
+    return time.perf_counter() - start
+
+
+def run_threads(
+    name: str, requests: int, outlier_rate: float, stream: bool, hedged: bool
+) -> HedgingRun:
+    mock = MockOpenAI(latency=_latency(outlier_rate))
+    policy = HedgePolicy(MAX_HEDGE_RATE) if hedged else None
+    client = mock_client(mock, max_retries=0, hedge_policy=policy)
+    latencies: list[float] = []
+    failed = 0
+
+    def request(index: int) -> None:
+        nonlocal failed
+        try:
+            latencies.append(_request(client, index, stream))
+        except openai.OpenAIError:
+            failed += 1
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for index in range(MIN_LATENCY_SAMPLES):
+            _request(client, index, stream)
+        list(executor.map(request, range(requests)))
+    return HedgingRun(
+        name,
+        latencies,
+        failed,
+        mock.requests,
+        mock.outliers,
+        mock.cancelled,
+        policy,
+    )
+
+
+async def _request_async(
+    client: openai.AsyncOpenAI, index: int, stream: bool
+) -> float:
+    start = time.perf_counter()
+    messages: list[openai.types.chat.ChatCompletionMessageParam] = [
+        {"role": "user", "content": f"Question {index}"}
+    ]
+    if stream:
+        chunks = await client.chat.completions.create(
+            model="gpt-4o-mini", messages=messages, stream=True
+        )
+        async for _ in chunks:
+            pass
+    else:
+        await client.chat.completions.create(
+            model="gpt-4o-mini", messages=messages
+        )
+    return time.perf_counter() - start
+
+
+async def run_tasks(
+    name: str, requests: int, outlier_rate: float, stream: bool, hedged: bool
+) -> HedgingRun:
+    mock = MockOpenAI(latency=_latency(outlier_rate))
+    policy = HedgePolicy(MAX_HEDGE_RATE) if hedged else None
+    client = mock_async_client(mock, max_retries=0, hedge_policy=policy)
+    semaphore = asyncio.Semaphore(WORKERS)
+    latencies: list[float] = []
+    failed = 0
+
+    async def request(index: int) -> None:
+        nonlocal failed
+        async with semaphore:
+            try:
+                latencies.append(await _request_async(client, index, stream))
+            except openai.OpenAIError:
+                failed += 1
+
+    for index in range(MIN_LATENCY_SAMPLES):
+        await _request_async(client, index, stream)
+    await asyncio.gather(*[request(index) for index in range(requests)])
+    return HedgingRun(
+        name,
+        latencies,
+        failed,
+        mock.requests,
+        mock.outliers,
+        mock.cancelled,
+        policy,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m demos.benchmarks.hedging")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--outlier-rate",
+        type=float,
+        default=0.03,
+        help="share of slow requests, below 5%% or they set the p95",
+    )
+    args = parser.parse_args()
+
+    runs = []
+    for stream in (False, True):
+        kind = "streams" if stream else "completions"
+        for hedged in (False, True):
+            label = "hedged" if hedged else "plain"
+            runs.append(
+                run_threads(
+                    f"threads, {kind}, {label}",
+                    args.requests,
+                    args.outlier_rate,
+                    stream,
+                    hedged,
+                )
+            )
+            runs.append(
+                asyncio.run(
+                    run_tasks(
+                        f"asyncio, {kind}, {label}",
+                        args.requests,
+                        args.outlier_rate,
+                        stream,
+                        hedged,
+                    )
+                )
+            )
+    runs.sort(key=lambda run: run.name)
+
+    print(
+        f"{'run':<30} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} "
+        f"{'sent':>5} {'slow':>5} {'hedged':>7} {'won':>4} {'cancelled':>10} "
+        f"{'failed':>7}"
+    )
+    for run in runs:
+        hedges = run.policy.hedges if run.policy else 0
+        wins = run.policy.hedge_wins if run.policy else 0
+        print(
+            f"{run.name:<30} {run.percentile(50) * 1000:>5.0f}ms "
+            f"{run.percentile(95) * 1000:>5.0f}ms "
+            f"{run.percentile(99) * 1000:>5.0f}ms "
+            f"{max(run.latencies) * 1000:>5.0f}ms {run.mock_requests:>5} "
+            f"{run.outliers:>5} {hedges:>7} {wins:>4} {run.cancelled:>10} "
+            f"{run.failed:>7}"
+        )
+
+    # the policy also counts the untimed requests
+    max_hedges = (
+        MAX_HEDGE_RATE * (args.requests + MIN_LATENCY_SAMPLES) + HEDGE_BURST
+    )
+    over_cap = [
+        run for run in runs if run.policy and run.policy.hedges > max_hedges
+    ]
+    plain_p99 = {
+        run.name: run.percentile(99) for run in runs if run.policy is None
+    }
+    not_faster = [
+        run.name
+        for run in runs
+        if run.policy
+        and run.percentile(99)
+        >= plain_p99[run.name.replace("hedged", "plain")]
+    ]
+    if any(run.failed for run in runs) or over_cap:
+        sys.exit("Requests failed or the hedges passed the rate cap.")
+    if not_faster:
+        sys.exit(
+            "Hedging did not lower the p99 of " + ", ".join(not_faster) + "."
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,609 @@
+import asyncio
+import email.policy
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from email.message import EmailMessage
+from email.parser import BytesParser
+from typing import Any, AsyncIterator, Iterator
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from ..utils.hedging_utils import (
+    AsyncHedgingTransport,
+    HedgePolicy,
+    HedgingTransport,
+)
+from ..utils.ratelimit_utils import (
+    AsyncRateLimitedTransport,
+    RateLimitedTransport,
+    RateLimitScheduler,
+)
+
+MOCK_BASE_URL = "http://mock-openai.local/v1"
+MOCK_REPLY = "Bonjour ! Paris is lovely in the spring."
+BATCH_FILE_PATH = re.compile(r"/v1/files/([\w-]+)/content")
+BATCH_PATH = re.compile(r"/v1/batches/([\w-]+)")
+
+
+@dataclass
+class MockRateLimit:
+    """
+    The limits the mock enforces. Like the API, each limit refills
+    continuously, at `requests` and `tokens` per `window` seconds.
+
+    Attributes:
+        requests (int): Requests allowed per window.
+        tokens (int): Prompt and completion tokens allowed per window.
+        window (float): Length of a window in seconds.
+        retry_after (bool): Whether 429 responses carry `retry-after-ms`.
+    """
+
+    requests: int
+    tokens: int
+    window: float = 60.0
+    retry_after: bool = True
+
+
+@dataclass
+class MockLatency:
+    """
+    How slowly the mock answers.
+
+    Attributes:
+        first_token (float): Seconds before the first token, or before the
+            whole response when it is not streamed.
+        per_token (float): Seconds per completion token after the first.
+        outlier_rate (float): Share of requests that are outliers.
+        outlier_delay (float): Extra seconds before the first token of an
+            outlier, like a request stuck behind a slow upstream.
+        seed (int): Seeds the choice of outliers, so runs compare.
+    """
+
+    first_token: float = 0.0
+    per_token: float = 0.0
+    outlier_rate: float = 0.0
+    outlier_delay: float = 0.0
+    seed: int = 0
+
+
+class MockOpenAI:
+    """
+    Answers chat completion requests like the OpenAI API, without the
+    network, so the demos can be exercised offline. Replies stream when the
+    request asks for it, call the first tool when tools are offered and
+    follow the response format when one is given.
+
+    Batches are supported too: uploaded batch files are kept in memory and
+    a batch completes after `batch_polls` status checks, with its results
+    in an output file and an error file like the Batch API.
+    """
+
+    def __init__(
+        self,
+        reply: str = MOCK_REPLY,
+        json_reply: str | None = None,
+        tool_arguments: dict[str, Any] | None = None,
+        latency: MockLatency | None = None,
+        rate_limit: MockRateLimit | None = None,
+        batch_polls: int = 1,
+    ) -> None:
+        self.reply = reply
+        self.json_reply = json_reply
+        self.tool_arguments = tool_arguments
+        self.latency = latency or MockLatency()
+        self.rate_limit = rate_limit
+        self.batch_polls = batch_polls
+        self.requests = 0
+        self.rate_limited = 0
+        self.outliers = 0
+        # asyncio requests cancelled by the client before they answered
+        self.cancelled = 0
+
+        self._lock = threading.Lock()
+        self._random = random.Random(self.latency.seed)
+        self._updated = time.monotonic()
+        self._remaining_requests = float(
+            rate_limit.requests if rate_limit else 0
+        )
+        self._remaining_tokens = float(rate_limit.tokens if rate_limit else 0)
+        self._files: dict[str, bytes] = {}
+        self._batches: dict[str, dict[str, Any]] = {}
+        self._batch_checks: dict[str, int] = {}
+
+    def _request_tokens(self, body: dict[str, Any]) -> int:
+        # about four characters per token is close enough for the limits
+        prompt = json.dumps(body.get("messages", []))
+        max_tokens = body.get("max_completion_tokens", body.get("max_tokens"))
+        return len(prompt) // 4 + (max_tokens or 0)
+
+    def _admit(self, tokens: int) -> tuple[bool, dict[str, str]]:
+        if self.rate_limit is None:
+            return True, {}
+
+        limit = self.rate_limit
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._remaining_requests = min(
+                limit.requests,
+                self._remaining_requests
+                + elapsed * limit.requests / limit.window,
+            )
+            self._remaining_tokens = min(
+                limit.tokens,
+                self._remaining_tokens + elapsed * limit.tokens / limit.window,
+            )
+
+            admitted = (
+                self._remaining_requests >= 1
+                and self._remaining_tokens >= tokens
+            )
+            if admitted:
+                self._remaining_requests -= 1
+                self._remaining_tokens -= tokens
+            else:
+                self.rate_limited += 1
+
+            # seconds until each limit is full again, and until the request
+            # that was turned away would fit
+            reset_requests = (
+                (limit.requests - self._remaining_requests)
+                * limit.window
+                / limit.requests
+            )
+            reset_tokens = (
+                (limit.tokens - self._remaining_tokens)
+                * limit.window
+                / limit.tokens
+            )
+            retry_after = max(
+                (1 - self._remaining_requests) * limit.window / limit.requests,
+                (tokens - self._remaining_tokens)
+                * limit.window
+                / limit.tokens,
+                0.0,
+            )
+            headers = {
+                "x-ratelimit-limit-requests": str(limit.requests),
+                "x-ratelimit-limit-tokens": str(limit.tokens),
+                "x-ratelimit-remaining-requests": str(
+                    int(self._remaining_requests)
+                ),
+                "x-ratelimit-remaining-tokens": str(
+                    int(self._remaining_tokens)
+                ),
+                "x-ratelimit-reset-requests": f"{reset_requests * 1000:.0f}ms",
+                "x-ratelimit-reset-tokens": f"{reset_tokens * 1000:.0f}ms",
+            }
+
+        if not admitted and limit.retry_after:
+            headers["retry-after-ms"] = f"{retry_after * 1000:.0f}"
+        return admitted, headers
+
+    def _message(self, body: dict[str, Any]) -> dict[str, Any]:
+        messages = body.get("messages", [])
+        tools = body.get("tools")
+        answered = bool(messages) and messages[-1].get("role") == "tool"
+        if (
+            tools
+            and self.tool_arguments is not None
+            and body.get("tool_choice") != "none"
+            and not answered
+        ):
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:24]}",
+                        "type": "function",
+                        "function": {
+                            "name": tools[0]["function"]["name"],
+                            "arguments": json.dumps(self.tool_arguments),
+                        },
+                    }
+                ],
+            }
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema" and self.json_reply:
+            return {"role": "assistant", "content": self.json_reply}
+        return {"role": "assistant", "content": self.reply}
+
+    def _usage(
+        self, body: dict[str, Any], message: dict[str, Any]
+    ) -> dict[str, int]:
+        prompt_tokens = len(json.dumps(body.get("messages", []))) // 4
+        completion_tokens = len(json.dumps(message)) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+
+    def completion(self, body: dict[str, Any]) -> dict[str, Any]:
+        """
+        Build a chat completion for a request body.
+
+        Args:
+            body (dict[str, Any]): The body of the request.
+
+        Returns:
+            dict[str, Any]: The chat completion as the API returns it.
+        """
+        message = self._message(body)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": (
+                        "tool_calls" if message.get("tool_calls") else "stop"
+                    ),
+                    "logprobs": None,
+                }
+            ],
+            "usage": self._usage(body, message),
+        }
+
+    def chunks(self, body: dict[str, Any]) -> list[dict[str, Any]]:
+        """
+        Build the chunks of a streamed chat completion, one per word.
+
+        Args:
+            body (dict[str, Any]): The body of the request.
+
+        Returns:
+            list[dict[str, Any]]: The chunks in the order they are sent.
+        """
+        completion = self.completion(body)
+        message = completion["choices"][0]["message"]
+
+        def chunk(
+            delta: dict[str, Any], finish_reason: str | None = None
+        ) -> dict[str, Any]:
+            return {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": delta,
+                        "finish_reason": finish_reason,
+                        "logprobs": None,
+                    }
+                ],
+            }
+
+        chunks = [chunk({"role": "assistant", "content": ""})]
+        if message.get("tool_calls"):
+            tool_calls = [
+                {"index": index, **tool_call}
+                for index, tool_call in enumerate(message["tool_calls"])
+            ]
+            chunks.append(chunk({"tool_calls": tool_calls}))
+        else:
+            chunks.extend(
+                chunk({"content": word})
+                for word in re.findall(r"\s*\S+", message["content"])
+            )
+        chunks.append(chunk({}, completion["choices"][0]["finish_reason"]))
+
+        stream_options = body.get("stream_options") or {}
+        if stream_options.get("include_usage"):
+            chunks.append(
+                {
+                    **chunk({}),
+                    "choices": [],
+                    "usage": completion["usage"],
+                }
+            )
+        return chunks
+
+    def _upload_file(self, request: httpx.Request) -> httpx.Response:
+        # the file is the part named "file" of the multipart form
+        header = f"content-type: {request.headers['content-type']}\r\n\r\n"
+        form = BytesParser(
+            EmailMessage, policy=email.policy.default
+        ).parsebytes(header.encode() + request.content)
+        for part in form.iter_parts():
+            if part.get_param("name", header="content-disposition") == "file":
+                content = part.get_payload(decode=True)
+                assert isinstance(content, bytes)
+                file_id = f"file-{uuid.uuid4().hex[:24]}"
+                with self._lock:
+                    self._files[file_id] = content
+                return httpx.Response(
+                    200,
+                    json={
+                        "id": file_id,
+                        "object": "file",
+                        "bytes": len(content),
+                        "created_at": int(time.time()),
+                        "filename": part.get_filename() or "upload.jsonl",
+                        "purpose": "batch",
+                        "status": "processed",
+                    },
+                )
+        return httpx.Response(
+            400, json={"error": {"message": "No file was uploaded."}}
+        )
+
+    def _create_batch(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        with self._lock:
+            known_file = body.get("input_file_id") in self._files
+        if not known_file:
+            return httpx.Response(
+                404, json={"error": {"message": "No such input file."}}
+            )
+
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": body["endpoint"],
+            "input_file_id": body["input_file_id"],
+            "completion_window": body["completion_window"],
+            "status": "validating",
+            "created_at": int(time.time()),
+            "request_counts": {"completed": 0, "failed": 0, "total": 0},
+        }
+        with self._lock:
+            self._batches[batch_id] = batch
+            self._batch_checks[batch_id] = 0
+        return httpx.Response(200, json=batch)
+
+    def _run_batch(self, batch: dict[str, Any]) -> None:
+        outputs = []
+        errors = []
+        for line in self._files[batch["input_file_id"]].splitlines():
+            request = json.loads(line)
+            result: dict[str, Any] = {
+                "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+                "custom_id": request["custom_id"],
+                "response": None,
+                "error": None,
+            }
+            if request["url"] != batch["endpoint"]:
+                result["error"] = {
+                    "code": "invalid_url",
+                    "message": f"The url must be {batch['endpoint']}.",
+                }
+                errors.append(result)
+                continue
+            result["response"] = {
+                "status_code": 200,
+                "request_id": uuid.uuid4().hex,
+                "body": self.completion(request["body"]),
+            }
+            outputs.append(result)
+
+        # like the Batch API, the results are not in the order of the
+        # requests, they are joined back by custom_id
+        for name, results in (("output", outputs), ("error", errors)):
+            if results:
+                file_id = f"file-{uuid.uuid4().hex[:24]}"
+                self._files[file_id] = b"".join(
+                    json.dumps(result).encode() + b"\n"
+                    for result in reversed(results)
+                )
+                batch[f"{name}_file_id"] = file_id
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"] = {
+            "completed": len(outputs),
+            "failed": len(errors),
+            "total": len(outputs) + len(errors),
+        }
+
+    def _retrieve_batch(self, batch_id: str) -> httpx.Response:
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return httpx.Response(
+                    404, json={"error": {"message": "No such batch."}}
+                )
+            self._batch_checks[batch_id] += 1
+            if batch["status"] != "completed":
+                if self._batch_checks[batch_id] >= self.batch_polls:
+                    self._run_batch(batch)
+                else:
+                    batch["status"] = "in_progress"
+            return httpx.Response(200, json=batch)
+
+    def _batch_api(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "POST" and path == "/v1/files":
+            return self._upload_file(request)
+        if request.method == "POST" and path == "/v1/batches":
+            return self._create_batch(request)
+
+        match = BATCH_FILE_PATH.fullmatch(path)
+        if request.method == "GET" and match:
+            with self._lock:
+                content = self._files.get(match[1])
+            if content is not None:
+                return httpx.Response(
+                    200,
+                    headers={"content-type": "application/octet-stream"},
+                    content=content,
+                )
+        match = BATCH_PATH.fullmatch(path)
+        if request.method == "GET" and match:
+            return self._retrieve_batch(match[1])
+        return httpx.Response(404, json={"error": {"message": "Not found"}})
+
+    def _route(
+        self, request: httpx.Request
+    ) -> httpx.Response | tuple[dict[str, Any], dict[str, str]]:
+        with self._lock:
+            self.requests += 1
+
+        if not request.url.path.endswith("/chat/completions"):
+            return self._batch_api(request)
+
+        body = json.loads(request.content)
+        admitted, headers = self._admit(self._request_tokens(body))
+        if not admitted:
+            return httpx.Response(
+                429,
+                headers=headers,
+                json={
+                    "error": {
+                        "message": "Rate limit reached.",
+                        "type": "requests",
+                        "code": "rate_limit_exceeded",
+                    }
+                },
+            )
+        return body, headers
+
+    def _first_token_delay(self) -> float:
+        latency = self.latency
+        with self._lock:
+            if not latency.outlier_rate or (
+                self._random.random() >= latency.outlier_rate
+            ):
+                return latency.first_token
+            self.outliers += 1
+        return latency.first_token + latency.outlier_delay
+
+    def _completion_delay(self, completion: dict[str, Any]) -> float:
+        tokens = completion["usage"]["completion_tokens"]
+        return self._first_token_delay() + self.latency.per_token * tokens
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        routed = self._route(request)
+        if isinstance(routed, httpx.Response):
+            return routed
+        body, headers = routed
+
+        if not body.get("stream"):
+            completion = self.completion(body)
+            time.sleep(self._completion_delay(completion))
+            return httpx.Response(200, headers=headers, json=completion)
+
+        def events() -> Iterator[bytes]:
+            time.sleep(self._first_token_delay())
+            for index, chunk in enumerate(self.chunks(body)):
+                if index > 1:
+                    time.sleep(self.latency.per_token)
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(
+            200,
+            headers={**headers, "content-type": "text/event-stream"},
+            content=events(),
+        )
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        routed = self._route(request)
+        if isinstance(routed, httpx.Response):
+            return routed
+        body, headers = routed
+
+        if not body.get("stream"):
+            completion = self.completion(body)
+            try:
+                await asyncio.sleep(self._completion_delay(completion))
+            except asyncio.CancelledError:
+                with self._lock:
+                    self.cancelled += 1
+                raise
+            return httpx.Response(200, headers=headers, json=completion)
+
+        async def events() -> AsyncIterator[bytes]:
+            try:
+                await asyncio.sleep(self._first_token_delay())
+            except asyncio.CancelledError:
+                with self._lock:
+                    self.cancelled += 1
+                raise
+            for index, chunk in enumerate(self.chunks(body)):
+                if index > 1:
+                    await asyncio.sleep(self.latency.per_token)
+                yield f"data: {json.dumps(chunk)}\n\n".encode()
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(
+            200,
+            headers={**headers, "content-type": "text/event-stream"},
+            content=events(),
+        )
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def async_transport(self) -> httpx.MockTransport:
+        # waits with asyncio.sleep so concurrent requests overlap
+        return httpx.MockTransport(self.handle_async)
+
+
+def mock_client(
+    mock: MockOpenAI,
+    scheduler: RateLimitScheduler | None = None,
+    max_retries: int = 2,
+    hedge_policy: HedgePolicy | None = None,
+) -> OpenAI:
+    """
+    Build an OpenAI client that talks to the mock.
+
+    Args:
+        mock (MockOpenAI): The mock to send requests to.
+        scheduler (RateLimitScheduler | None): Paces the requests like the
+            clients of `openai_utils` when given.
+        max_retries (int): Retries of the OpenAI client without scheduler.
+        hedge_policy (HedgePolicy | None): Hedges slow requests like the
+            clients of `openai_utils` when given.
+
+    Returns:
+        OpenAI: The client.
+    """
+    transport: httpx.BaseTransport = mock.transport()
+    if hedge_policy is not None:
+        transport = HedgingTransport(hedge_policy, transport, scheduler)
+    if scheduler is not None:
+        transport = RateLimitedTransport(scheduler, transport)
+        max_retries = 0
+    return OpenAI(
+        api_key="sk-mock",
+        base_url=MOCK_BASE_URL,
+        max_retries=max_retries,
+        http_client=httpx.Client(transport=transport),
+    )
+
+
+def mock_async_client(
+    mock: MockOpenAI,
+    scheduler: RateLimitScheduler | None = None,
+    max_retries: int = 2,
+    hedge_policy: HedgePolicy | None = None,
+) -> AsyncOpenAI:
+    """The asyncio version of `mock_client`."""
+    transport: httpx.AsyncBaseTransport = mock.async_transport()
+    if hedge_policy is not None:
+        transport = AsyncHedgingTransport(hedge_policy, transport, scheduler)
+    if scheduler is not None:
+        transport = AsyncRateLimitedTransport(scheduler, transport)
+        max_retries = 0
+    return AsyncOpenAI(
+        api_key="sk-mock",
+        base_url=MOCK_BASE_URL,
+        max_retries=max_retries,
+        http_client=httpx.AsyncClient(transport=transport),
+    )
@@ -0,0 +1,130 @@
+# To run this script, use the command from the root folder of the repo:
+# python -m demos.benchmarks.ratelimit [--requests N]
+#
+# Sends a burst of chat completions from threads and from asyncio tasks to
+# a mock that allows 10 requests per second and answers the rest with
+# 429s, once with the default retries of the OpenAI client and once through
+# the rate limit scheduler. Exits with an error if a scheduled request fails.
+
+import argparse
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import openai
+
+from ..utils.ratelimit_utils import RateLimitScheduler
+from .mock_openai import (
+    MockOpenAI,
+    MockRateLimit,
+    mock_async_client,
+    mock_client,
+)
+
+MOCK_RATE_LIMIT = MockRateLimit(requests=10, tokens=4000, window=1.0)
+WORKERS = 16
+
+
+@dataclass
+class RateLimitRun:
+    name: str
+    succeeded: int
+    failed: int
+    rate_limited: int
+    elapsed: float
+
+
+def _request(client: openai.OpenAI, index: int) -> bool:
+    try:
+        client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": f"Question {index}"}],
+            max_tokens=100,
+        )
+        return True
+    except openai.RateLimitError:
+        return False
+
+
+def run_threads(
+    name: str, requests: int, scheduler: RateLimitScheduler | None
+) -> RateLimitRun:
+    mock = MockOpenAI(rate_limit=MOCK_RATE_LIMIT)
+    client = mock_client(mock, scheduler)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        results = list(
+            executor.map(lambda i: _request(client, i), range(requests))
+        )
+    return RateLimitRun(
+        name,
+        succeeded=sum(results),
+        failed=results.count(False),
+        rate_limited=mock.rate_limited,
+        elapsed=time.perf_counter() - start,
+    )
+
+
+async def _request_async(client: openai.AsyncOpenAI, index: int) -> bool:
+    try:
+        await client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": f"Question {index}"}],
+            max_tokens=100,
+        )
+        return True
+    except openai.RateLimitError:
+        return False
+
+
+async def run_tasks(
+    name: str, requests: int, scheduler: RateLimitScheduler | None
+) -> RateLimitRun:
+    mock = MockOpenAI(rate_limit=MOCK_RATE_LIMIT)
+    client = mock_async_client(mock, scheduler)
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[_request_async(client, i) for i in range(requests)]
+    )
+    return RateLimitRun(
+        name,
+        succeeded=sum(results),
+        failed=results.count(False),
+        rate_limited=mock.rate_limited,
+        elapsed=time.perf_counter() - start,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m demos.benchmarks.ratelimit"
+    )
+    parser.add_argument("--requests", type=int, default=40)
+    args = parser.parse_args()
+
+    runs = [
+        run_threads("threads, client retries", args.requests, None),
+        run_threads("threads, scheduler", args.requests, RateLimitScheduler()),
+        asyncio.run(run_tasks("asyncio, client retries", args.requests, None)),
+        asyncio.run(
+            run_tasks(
+                "asyncio, scheduler", args.requests, RateLimitScheduler()
+            )
+        ),
+    ]
+
+    print(f"{'run':<26} {'ok':>5} {'failed':>7} {'429s':>6} {'elapsed':>8}")
+    for run in runs:
+        print(
+            f"{run.name:<26} {run.succeeded:>5} {run.failed:>7} "
+            f"{run.rate_limited:>6} {run.elapsed:>7.2f}s"
+        )
+
+    if any(run.failed for run in runs if "scheduler" in run.name):
+        sys.exit("Scheduled requests failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import io
+import resource
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+
+from .mock_openai import MockLatency, mock_client
+from .scenarios import SCENARIOS
+
+DEFAULT_TOLERANCE = 0.2
+
+
+@dataclass
+class BenchmarkResult:
+    scenario: str
+    iterations: int
+    p50: float
+    p95: float
+    p99: float
+    # iterations per second
+    throughput: float
+    peak_rss_mb: float
+    requests: int
+
+
+def _peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    if sys.platform == "darwin":
+        return peak_rss / 1024 / 1024
+    return peak_rss / 1024
+
+
+def run_scenario(
+    name: str, iterations: int, latency: MockLatency
+) -> BenchmarkResult:
+    """
+    Run a scenario against a fresh mock and time each iteration.
+
+    Args:
+        name (str): The name of the scenario.
+        iterations (int): How many timed iterations to run.
+        latency (MockLatency): How slowly the mock answers.
+
+    Returns:
+        BenchmarkResult: The latency percentiles, throughput and peak RSS.
+    """
+    scenario = SCENARIOS[name]
+    mock = scenario.mock(latency)
+    client = mock_client(mock)
+
+    # the demos print their replies, keep them out of the report
+    with redirect_stdout(io.StringIO()), scenario.setup(client) as iteration:
+        # one untimed run to import and warm up what the flow uses
+        iteration()
+
+        latencies = []
+        start = time.perf_counter()
+        for _ in range(iterations):
+            iteration_start = time.perf_counter()
+            iteration()
+            latencies.append(time.perf_counter() - iteration_start)
+        elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return BenchmarkResult(
+        scenario=name,
+        iterations=iterations,
+        p50=percentiles[49],
+        p95=percentiles[94],
+        p99=percentiles[98],
+        throughput=iterations / elapsed,
+        peak_rss_mb=_peak_rss_mb(),
+        requests=mock.requests,
+    )
+
+
+def find_regressions(
+    results: list[BenchmarkResult],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+) -> list[str]:
+    """
+    Compare results with a baseline saved by an earlier --json run.
+
+    Args:
+        results (list[BenchmarkResult]): The results of this run.
+        baseline (dict[str, dict[str, float]]): The earlier results by
+            scenario.
+        tolerance (float): The fraction a metric may get worse by.
+
+    Returns:
+        list[str]: A description of each regression.
+    """
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.scenario)
+        if previous is None:
+            continue
+        if result.p95 > previous["p95"] * (1 + tolerance):
+            regressions.append(
+                f"{result.scenario}: p95 {result.p95 * 1000:.1f}ms, "
+                f"baseline {previous['p95'] * 1000:.1f}ms"
+            )
+        if result.throughput < previous["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{result.scenario}: {result.throughput:.1f}/s, "
+                f"baseline {previous['throughput']:.1f}/s"
+            )
+    return regressions
@@ -0,0 +1,380 @@
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Iterator
+from unittest.mock import patch
+
+from openai import OpenAI
+
+from ..e_guardrails_chat.prompts import GUARDRAIL_PROMPT, SYSTEM_PROMPT
+from ..h_call_functions.weather_tools import tools as weather_tools
+from ..j_structured_output.math_reasoning import (
+    MATH_MODEL,
+    MATH_TUTOR_PROMPT,
+    MathReasoning,
+    Step,
+)
+from ..l_image_data.bill_details import (
+    BillDetails,
+    BillLine,
+    ExpenseCategory,
+)
+from ..l_image_data.bills import get_bill_details, get_bill_index
+from ..l_image_data.config import BILL_INDEX_PATH_ENV
+from ..n_batch_mode.prepare import prepare_math
+from ..utils.batch_utils import (
+    download_batch_results,
+    read_batch_results,
+    submit_batch,
+    wait_for_batch,
+    write_batch_requests,
+)
+from ..utils.history_utils import ConversationHistory
+from ..utils.openweather_utils import format_weather_data
+from ..utils.semantic_cache_utils import SemanticCache, prompt_version
+from ..utils.streaming_utils import stream_chat_completion
+from ..utils.tool_utils import complete_with_tools
+from .mock_openai import MockLatency, MockOpenAI
+
+SAMPLE_DATA_FOLDER = Path(__file__).parent.parent / "sample_data"
+
+# what OpenWeatherMap returns for a city, so the tool loop runs offline
+SAMPLE_WEATHER = {
+    "name": "Paris",
+    "sys": {"country": "FR"},
+    "main": {"temp": 18.5, "humidity": 64},
+    "weather": [{"description": "scattered clouds"}],
+}
+SAMPLE_BILL = BillDetails(
+    vendor="Sample Supplies",
+    currency="USD",
+    bill_date="2024-03-01",
+    due_date="2024-03-31",
+    bill_number="INV-1024",
+    po_so_number=None,
+    notes=None,
+    lines=[
+        BillLine(
+            item=None,
+            expense_category=ExpenseCategory("Office Supplies"),
+            description="Printer paper",
+            quantity=4,
+            price=32.10,
+            tax=None,
+            amount=128.40,
+        )
+    ],
+    subtotal=128.40,
+    total=128.40,
+    total_paid=128.40,
+    amount_due=0.0,
+)
+# questions learners keep asking, in different words
+TUTOR_QUESTIONS = [
+    "What is Bastille Day?",
+    "Who painted the Mona Lisa?",
+    "what is bastille day",
+    "Tell me about Bastille Day.",
+    "Why was the Eiffel Tower built?",
+    "Who painted the Mona Lisa",
+    "When was the Eiffel Tower built?",
+    "Why was the Eiffel Tower built ?",
+]
+# problems of a batch, answered by the mock in reverse order
+BATCH_PROBLEMS = [
+    "Derive x^2 + 3x + 5.",
+    "Solve 2x + 3 = 11.",
+    "Integrate 6x^2.",
+    "Factor x^2 - 9.",
+]
+SAMPLE_MATH = MathReasoning(
+    steps=[
+        Step(
+            explanation="Differentiate x^2 with the power rule.", output="2x"
+        ),
+        Step(explanation="The derivative of 3x is 3.", output="3"),
+        Step(explanation="The derivative of 5 is 0.", output="0"),
+    ],
+    final_answer="2x + 3",
+)
+
+
+class ScenarioUnavailableError(Exception):
+    """Raised by the setup of a scenario that cannot run here."""
+
+
+@dataclass
+class Scenario:
+    """
+    A flow of the demos to time against the mock.
+
+    Attributes:
+        name (str): The name used on the command line and in reports.
+        iterations (int): How many times the flow runs by default.
+        mock (Callable[[MockLatency], MockOpenAI]): Builds the mock the
+            flow talks to.
+        setup (Callable[[OpenAI], ContextManager[Callable[[], Any]]]):
+            Prepares the flow for a client and yields one iteration of it,
+            cleaning up what it prepared on exit.
+    """
+
+    name: str
+    iterations: int
+    mock: Callable[[MockLatency], MockOpenAI]
+    setup: Callable[[OpenAI], ContextManager[Callable[[], Any]]]
+
+
+@contextmanager
+def chat_turns(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the stateful chat of d-g, one streamed turn per iteration with the
+    # history trimmed and summarized between turns
+    history = ConversationHistory(
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": GUARDRAIL_PROMPT},
+        ],
+        model="gpt-4o-mini",
+        client=client,
+    )
+
+    def turn() -> None:
+        history.append(
+            {"role": "user", "content": "Tell me about the Louvre."}
+        )
+        completion = stream_chat_completion(
+            "gpt-4o-mini", history.to_messages(), client=client
+        )
+        history.append({"role": "assistant", "content": completion.content})
+        history.compact()
+
+    yield turn
+
+
+@contextmanager
+def tool_loop(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the loop of h_call_functions, with the weather served locally
+    def call_function(name: str, args: dict) -> str:
+        return format_weather_data(SAMPLE_WEATHER)
+
+    def ask() -> None:
+        complete_with_tools(
+            client,
+            "gpt-4o-mini",
+            [
+                {
+                    "role": "system",
+                    "content": "You are a French weather expert.",
+                },
+                {"role": "user", "content": "What should I wear in Paris?"},
+            ],
+            weather_tools,
+            call_function,
+        )
+
+    yield ask
+
+
+@contextmanager
+def structured_output(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the parse call of j_structured_output
+    def parse() -> None:
+        completion = client.beta.chat.completions.parse(
+            model=MATH_MODEL,
+            messages=[
+                {"role": "system", "content": MATH_TUTOR_PROMPT},
+                {
+                    "role": "user",
+                    "content": "Derive x^2 + 3x + 5.",
+                },
+            ],
+            response_format=MathReasoning,
+        )
+        if completion.choices[0].message.parsed is None:
+            raise ValueError("The math reasoning was not parsed.")
+
+    yield parse
+
+
+@contextmanager
+def tutor_questions(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the questions of e_guardrails_chat, answered from the semantic cache
+    # when they were asked before
+    answer_cache = SemanticCache()
+    version = prompt_version(SYSTEM_PROMPT, GUARDRAIL_PROMPT, "gpt-4o-mini")
+    questions = iter(TUTOR_QUESTIONS * 100)
+
+    def ask() -> None:
+        question = next(questions)
+        if answer_cache.get(version, question) is not None:
+            return
+        start = time.perf_counter()
+        completion = stream_chat_completion(
+            "gpt-4o-mini",
+            [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": question},
+            ],
+            client=client,
+        )
+        answer_cache.put(
+            version, question, completion.content, time.perf_counter() - start
+        )
+
+    yield ask
+
+
+@contextmanager
+def _sample_upload_folder() -> Iterator[Path]:
+    with tempfile.TemporaryDirectory(prefix="bill-benchmark-") as folder:
+        upload_folder = Path(folder)
+        shutil.copy(
+            SAMPLE_DATA_FOLDER / "Invoice-Sample.pdf",
+            upload_folder / "invoice.pdf",
+        )
+        shutil.copy(
+            SAMPLE_DATA_FOLDER / "Receipt-Sample.pdf",
+            upload_folder / "receipt.pdf",
+        )
+        yield upload_folder
+
+
+@contextmanager
+def bill_extraction(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the upload handler of l_image_data, rendering the sample PDFs
+    if shutil.which("pdftoppm") is None:
+        # without it the bills are sent without their pages, which is not
+        # the time an extraction takes
+        raise ScenarioUnavailableError("pdftoppm was not found")
+    with _sample_upload_folder() as upload_folder:
+
+        def extract() -> None:
+            get_bill_details(upload_folder, client=client, use_index=False)
+
+        yield extract
+
+
+@contextmanager
+def bill_reupload(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the same bill uploaded again, answered from a fresh bill index after
+    # the first extraction
+    with (
+        _sample_upload_folder() as upload_folder,
+        patch.dict(
+            os.environ,
+            {BILL_INDEX_PATH_ENV: str(upload_folder / "index.sqlite3")},
+        ),
+    ):
+        # the index is opened again at the fresh path, and forgotten after
+        get_bill_index.cache_clear()
+
+        def extract() -> None:
+            get_bill_details(upload_folder, client=client)
+
+        try:
+            yield extract
+        finally:
+            get_bill_index.cache_clear()
+
+
+@contextmanager
+def batch_cycle(client: OpenAI) -> Iterator[Callable[[], Any]]:
+    # the prepare-math, submit, wait and results commands of n_batch_mode,
+    # with each result checked against the problem it was asked for
+    with tempfile.TemporaryDirectory(prefix="batch-benchmark-") as folder:
+        batch_folder = Path(folder)
+        problems_path = batch_folder / "problems.txt"
+        problems_path.write_text("\n".join(BATCH_PROBLEMS), encoding="utf-8")
+
+        def run_batch() -> None:
+            requests = prepare_math(problems_path)
+            write_batch_requests(batch_folder, requests)
+            submit_batch(client, batch_folder)
+            batch = wait_for_batch(
+                client, batch_folder, poll_interval=0.0, timeout=10.0
+            )
+            if batch.status != "completed":
+                raise ValueError(f"The batch is {batch.status}.")
+            download_batch_results(client, batch_folder, batch)
+
+            # the mock answers in reverse order, the results must still
+            # come back joined to the problem of each request
+            results = read_batch_results(batch_folder)
+            if len(results) != len(requests):
+                raise ValueError("Some problems have no result.")
+            for request, result in zip(requests, results):
+                if (result.custom_id, result.input) != (
+                    request.custom_id,
+                    request.input,
+                ):
+                    raise ValueError(f"{request.input} got another result.")
+                if result.error or result.content is None:
+                    raise ValueError(f"{result.input}: {result.error}")
+                MathReasoning.model_validate_json(result.content)
+
+        yield run_batch
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in [
+        Scenario(
+            "chat_turns",
+            iterations=50,
+            mock=lambda latency: MockOpenAI(latency=latency),
+            setup=chat_turns,
+        ),
+        Scenario(
+            "tool_loop",
+            iterations=50,
+            mock=lambda latency: MockOpenAI(
+                tool_arguments={"location": "Paris, France"},
+                latency=latency,
+            ),
+            setup=tool_loop,
+        ),
+        Scenario(
+            "structured_output",
+            iterations=50,
+            mock=lambda latency: MockOpenAI(
+                json_reply=SAMPLE_MATH.model_dump_json(), latency=latency
+            ),
+            setup=structured_output,
+        ),
+        Scenario(
+            "bill_extraction",
+            iterations=10,
+            mock=lambda latency: MockOpenAI(
+                json_reply=SAMPLE_BILL.model_dump_json(), latency=latency
+            ),
+            setup=bill_extraction,
+        ),
+        Scenario(
+            "bill_reupload",
+            iterations=50,
+            mock=lambda latency: MockOpenAI(
+                json_reply=SAMPLE_BILL.model_dump_json(), latency=latency
+            ),
+            setup=bill_reupload,
+        ),
+        Scenario(
+            "tutor_questions",
+            iterations=40,
+            mock=lambda latency: MockOpenAI(latency=latency),
+            setup=tutor_questions,
+        ),
+        Scenario(
+            "batch_cycle",
+            iterations=20,
+            mock=lambda latency: MockOpenAI(
+                json_reply=SAMPLE_MATH.model_dump_json(),
+                latency=latency,
+                batch_polls=3,
+            ),
+            setup=batch_cycle,
+        ),
+    ]
+}
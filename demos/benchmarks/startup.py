@@ -0,0 +1,135 @@
+# To run this script, use the command from the root folder of the repo:
+# python -m demos.benchmarks.startup [--runs N] [entry point ...]
+#
+# Runs every `python -m demos.*` entry point with `python -X importtime`
+# and reports how long its imports take, i.e. the cold-start cost paid
+# before the demo can do any work. The demos run with stdin closed, dummy
+# API keys and an unreachable API, so they stop at their first prompt or
+# request without touching the network.
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+
+DEMOS_FOLDER = Path(__file__).parent.parent
+REPO_FOLDER = DEMOS_FOLDER.parent
+ENTRY_POINTS = sorted(
+    f"demos.{path.parent.name}" for path in DEMOS_FOLDER.glob("*/__main__.py")
+)
+# seconds before a demo that serves or retries forever is stopped, its
+# imports are long done by then
+RUN_TIMEOUT = 5.0
+TOP_IMPORTS = 3
+
+# import time:   self [us] | cumulative | imported package
+IMPORT_TIME_LINE = re.compile(
+    r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$", re.MULTILINE
+)
+BENCHMARK_ENV = {
+    "OPENAI_API_KEY": "sk-startup-benchmark",
+    "OPEN_WEATHER_API_KEY": "startup-benchmark",
+    # nothing listens on the discard port, requests fail right away
+    "OPENAI_BASE_URL": "http://127.0.0.1:9/v1",
+}
+
+
+@dataclass
+class StartupResult:
+    entry_point: str
+    import_times: list[float] = field(default_factory=list)
+    # cumulative seconds of the heaviest top-level imports of the last run
+    top_imports: list[tuple[str, float]] = field(default_factory=list)
+
+    @property
+    def median(self) -> float:
+        return statistics.median(self.import_times)
+
+    @property
+    def best(self) -> float:
+        return min(self.import_times)
+
+
+def parse_import_times(stderr: str) -> dict[str, float]:
+    """
+    Read the cumulative import time of each top-level import from the
+    `-X importtime` output of a run.
+
+    Args:
+        stderr (str): The stderr of the run.
+
+    Returns:
+        dict[str, float]: Seconds per module imported at the top level.
+    """
+    top_level: dict[str, float] = {}
+    for match in IMPORT_TIME_LINE.finditer(stderr):
+        _, cumulative, indent, module = match.groups()
+        # nested imports are indented by two spaces per level
+        if len(indent) == 1:
+            top_level[module] = int(cumulative) / 1_000_000
+    return top_level
+
+
+def measure_startup(entry_point: str, runs: int) -> StartupResult:
+    """
+    Run an entry point several times and collect its total import time.
+
+    Args:
+        entry_point (str): The module to run, e.g. "demos.c_console_chat".
+        runs (int): How many times to run it.
+
+    Returns:
+        StartupResult: The import time of each run.
+    """
+    result = StartupResult(entry_point)
+    env = {**os.environ, **BENCHMARK_ENV}
+    for _ in range(runs):
+        try:
+            process = subprocess.run(
+                [sys.executable, "-X", "importtime", "-m", entry_point],
+                cwd=REPO_FOLDER,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                text=True,
+                timeout=RUN_TIMEOUT,
+            )
+            stderr = process.stderr
+        except subprocess.TimeoutExpired as e:
+            output = e.stderr or ""
+            stderr = output.decode() if isinstance(output, bytes) else output
+
+        import_times = parse_import_times(stderr)
+        result.import_times.append(sum(import_times.values()))
+        result.top_imports = sorted(
+            import_times.items(), key=lambda item: item[1], reverse=True
+        )[:TOP_IMPORTS]
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m demos.benchmarks.startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("entry_points", nargs="*", default=ENTRY_POINTS)
+    args = parser.parse_args()
+
+    print(f"{'entry point':<28} {'median':>8} {'best':>8}  heaviest imports")
+    for entry_point in args.entry_points:
+        result = measure_startup(entry_point, args.runs)
+        top_imports = ", ".join(
+            f"{module} {seconds * 1000:.0f}ms"
+            for module, seconds in result.top_imports
+        )
+        print(
+            f"{entry_point:<28} {result.median * 1000:>6.0f}ms "
+            f"{result.best * 1000:>6.0f}ms  {top_imports}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,10 @@
 # Import necessary modules and classes
 from openai.types.chat import ChatCompletionMessageParam
 
-from ..utils.openai_utils import openai_service
+from ..utils.streaming_utils import (
+    format_stream_stats,
+    stream_chat_completion,
+)
 
 # Define the model to be used
 model = "gpt-4o-mini"
@@ -32,8 +35,9 @@ while True:
         print("Goodbye!")
         break
 
-    # Create a completion request to the OpenAI service
-    completion = openai_service.chat.completions.create(
+    # Stream a completion from the OpenAI service, the response is printed
+    # as it arrives
+    completion = stream_chat_completion(
         model=model,
         messages=[
             *messages,
@@ -44,7 +48,7 @@ while True:
         ],
     )
 
-    # Print the response from the OpenAI service
-    print(f"\n{completion.choices[0].message.content}")
+    # Print the time to first token and the tokens per second
+    print(f"\n{format_stream_stats(completion)}")
 
     # Observe the response is NOT added to the messages list
@@ -1,20 +1,51 @@
 # To run this script, use the command from the root folder of the repo:
 # python -m demos.d_stateful_chat
+# To continue an earlier conversation, add its session id:
+# python -m demos.d_stateful_chat <session id>
 
 
+import sys
+import time
+import uuid
+from pathlib import Path
+
 from openai.types.chat import ChatCompletionMessageParam
 
-from ..utils.openai_utils import openai_service
+from ..utils.history_utils import ConversationHistory
+from ..utils.session_utils import SessionStore
+from ..utils.streaming_utils import (
+    format_stream_stats,
+    stream_chat_completion,
+)
 
 model = "gpt-4o-mini"
-messages: list[ChatCompletionMessageParam] = [
+system_messages: list[ChatCompletionMessageParam] = [
     {
         "role": "system",
         "content": ("You are a helpful tutor on French culture."),
     },
 ]
 
+session_id = sys.argv[1] if len(sys.argv) > 1 else uuid.uuid4().hex[:12]
+store = SessionStore(Path(__file__).parent / "sessions")
+
+start = time.perf_counter()
+history = ConversationHistory(
+    system_messages, model=model, store=store, session_id=session_id
+)
+resume_seconds = time.perf_counter() - start
+
 print("\n\n\nWelcome to the French Culture Tutor!\n")
+if history.resumed_turns:
+    print(
+        f"Resumed session {session_id} with {history.resumed_turns} recent "
+        f"turns{' and a summary' if history.summary else ''} "
+        f"in {resume_seconds * 1000:.1f} ms."
+    )
+print(
+    f"Session {session_id}, continue it later with "
+    f"`python -m demos.d_stateful_chat {session_id}`."
+)
 
 while True:
     next_user_message = input(
@@ -25,25 +56,27 @@ while True:
         print("Goodbye!")
         break
 
-    messages.append(
+    history.append(
         {
             "role": "user",
             "content": next_user_message,
         }
     )
 
-    completion = openai_service.chat.completions.create(
+    completion = stream_chat_completion(
         model=model,
-        messages=messages,
+        messages=history.to_messages(),
     )
 
-    next_assistant_message = str(completion.choices[0].message.content)
+    next_assistant_message = completion.content
 
-    print(f"\n{next_assistant_message}")
+    print(f"\n{format_stream_stats(completion)}")
 
-    messages.append(
+    history.append(
         {
             "role": "assistant",
             "content": next_assistant_message,
         }
     )
+
+    history.compact()
@@ -1,78 +1,112 @@
 # To run this script, use the command from the root folder of the repo:
 # python -m demos.e_guardrails_chat
+#
+# The guardrail checks each question while the answer is already being
+# generated. When it blocks the question the answer is cancelled, so an
+# off-topic question only costs the tokens generated until then.
+# Questions asked again are answered from a semantic cache of the answers
+# given so far.
 
+import asyncio
+import time
 
 from openai.types.chat import ChatCompletionMessageParam
 
-from ..utils.openai_utils import openai_service
+from ..utils.guardrail_utils import Guardrail, guarded_chat_completion
+from ..utils.history_utils import ConversationHistory
+from ..utils.semantic_cache_utils import SemanticCache, prompt_version
+from ..utils.streaming_utils import format_stream_stats, print_delta
+from .prompts import GUARDRAIL_PROMPT, SYSTEM_PROMPT
 
 model = "gpt-4o-mini"
-messages: list[ChatCompletionMessageParam] = [
+system_messages: list[ChatCompletionMessageParam] = [
     {
         "role": "system",
-        "content": (
-            "You are a helpful tutor on French culture. All questions should "
-            "be answered with respect to French culture and history. It is "
-            "important to provide accurate and detailed information. When "
-            "appropriate, include references to famous French cultural "
-            "figures, use French words/phrases, and discuss the significance "
-            "of events in French history. Your goal is to help the user "
-            "learn about French culture in an engaging and informative way. "
-            "If the user asks about a specific topic, provide a brief "
-            "overview and suggest further reading or resources. If the user "
-            "asks for a summary of a specific event, provide a concise "
-            "summary and highlight its importance in French culture. If the "
-            "user asks for a comparison between French culture and another "
-            "culture, provide a thoughtful analysis that respects both "
-            "cultures. The bulk of any answer should be in the language of "
-            "the user which defaults to English."
-        ),
+        "content": SYSTEM_PROMPT,
     },
 ]
 
-print("\n\n\nWelcome to the French Culture Tutor!\n")
+history = ConversationHistory(system_messages, model=model)
+guardrail = Guardrail(GUARDRAIL_PROMPT)
+answer_cache = SemanticCache()
+# cached answers are only reused while the prompts and model are the same
+answer_cache_version = prompt_version(SYSTEM_PROMPT, GUARDRAIL_PROMPT, model)
 
-while True:
-    next_user_message = input(
-        "\nWhat can I help you with? (type `q` to exit)\n\n"
-    )
 
-    if next_user_message.lower() in ["exit", "quit", "q"]:
-        print("Goodbye!")
-        break
+async def main() -> None:
+    print("\n\n\nWelcome to the French Culture Tutor!\n")
 
-    messages.append(
-        {
-            "role": "user",
-            "content": next_user_message,
-        }
-    )
+    while True:
+        next_user_message = input(
+            "\nWhat can I help you with? (type `q` to exit)\n\n"
+        )
 
-    completion = openai_service.chat.completions.create(
-        model=model,
-        messages=[
-            *messages,
+        if next_user_message.lower() in ["exit", "quit", "q"]:
+            print(guardrail.stats)
+            print(answer_cache.stats)
+            print("Goodbye!")
+            break
+
+        history.append(
             {
-                "role": "system",
-                "content": (
-                    "Only answer questions relevant to French culture and "
-                    "history. It's ok to discuss controversial topics, but "
-                    "keep it respectful of all cultures involved. Assume "
-                    "the user is a high school student around the age of 16 "
-                    "and keep answers simple and easy to understand and "
-                    "appropriate."
-                ),
-            },
-        ],
-    )
-
-    next_assistant_message = str(completion.choices[0].message.content)
-
-    print(f"\n{next_assistant_message}")
-
-    messages.append(
-        {
-            "role": "assistant",
-            "content": next_assistant_message,
-        }
-    )
+                "role": "user",
+                "content": next_user_message,
+            }
+        )
+
+        print()
+        cached = answer_cache.get(answer_cache_version, next_user_message)
+        if cached is not None:
+            print(cached.answer)
+            print(
+                f"\n(cached answer to {cached.question!r}, similarity "
+                f"{cached.similarity:.2f}, about {cached.seconds:.1f}s saved)"
+            )
+            history.append({"role": "assistant", "content": cached.answer})
+            history.compact()
+            continue
+
+        start = time.perf_counter()
+        completion = await guarded_chat_completion(
+            guardrail,
+            next_user_message,
+            model=model,
+            messages=[
+                *history.to_messages(),
+                {
+                    "role": "system",
+                    "content": GUARDRAIL_PROMPT,
+                },
+            ],
+            on_delta=print_delta,
+        )
+
+        if completion.answer is not None:
+            print(f"\n\n{format_stream_stats(completion.answer)}")
+            print(f"(guardrail check {completion.verdict.seconds:.2f}s)")
+            answer_cache.put(
+                answer_cache_version,
+                next_user_message,
+                completion.content,
+                time.perf_counter() - start,
+            )
+        else:
+            print(completion.content)
+            print(
+                f"\n(blocked, {completion.verdict.reason}: about "
+                f"{completion.tokens_saved} completion tokens saved, "
+                f"{completion.tokens_generated} generated)"
+            )
+
+        history.append(
+            {
+                "role": "assistant",
+                "content": completion.content,
+            }
+        )
+
+        # fold older turns into a running summary in the background
+        history.compact()
+
+
+asyncio.run(main())
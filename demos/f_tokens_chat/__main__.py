@@ -4,10 +4,13 @@
 
 from openai.types.chat import ChatCompletionMessageParam
 
-from ..utils.openai_utils import openai_service
+from ..utils.guardrail_utils import Guardrail, run_guarded_chat_completion
+from ..utils.history_utils import ConversationHistory
+from ..utils.streaming_utils import format_stream_stats, print_delta
+from ..utils.token_utils import token_counter
 
 model = "gpt-4o-mini"
-messages: list[ChatCompletionMessageParam] = [
+system_messages: list[ChatCompletionMessageParam] = [
     {
         "role": "system",
         "content": (
@@ -30,6 +33,20 @@ messages: list[ChatCompletionMessageParam] = [
     },
 ]
 
+guardrail_prompt = (
+    "Only answer questions relevant to French culture and "
+    "history. It's ok to discuss controversial topics, but "
+    "keep it respectful of all cultures involved. Assume "
+    "the user is a high school student around the age of 16 "
+    "and keep answers simple and easy to understand and "
+    "appropriate."
+)
+
+history = ConversationHistory(system_messages, model=model)
+# checks each question while the answer is generated, and cancels the
+# answer to an off-topic question
+guardrail = Guardrail(guardrail_prompt)
+
 
 show_tokens = False
 completion_tokens = 0
@@ -53,39 +70,57 @@ while True:
         continue
 
     if next_user_message.lower() in ["exit", "quit", "q"]:
+        print(guardrail.stats)
         print("Goodbye!")
         break
 
-    messages.append(
+    history.append(
         {
             "role": "user",
             "content": next_user_message,
         }
     )
 
-    completion = openai_service.chat.completions.create(
+    request_messages: list[ChatCompletionMessageParam] = [
+        *history.to_messages(),
+        {
+            "role": "system",
+            "content": guardrail_prompt,
+        },
+    ]
+    estimated_prompt_tokens = token_counter.count(model, request_messages)
+    if estimated_prompt_tokens > history.token_budget:
+        print(
+            f"\nWarning: about {estimated_prompt_tokens} prompt tokens, "
+            "older turns will be summarized after this answer."
+        )
+    if show_tokens:
+        print(f"\nEstimated Prompt Tokens: {estimated_prompt_tokens}")
+
+    print()
+    completion = run_guarded_chat_completion(
+        guardrail,
+        next_user_message,
         model=model,
-        messages=[
-            *messages,
-            {
-                "role": "system",
-                "content": (
-                    "Only answer questions relevant to French culture and "
-                    "history. It's ok to discuss controversial topics, but "
-                    "keep it respectful of all cultures involved. Assume "
-                    "the user is a high school student around the age of 16 "
-                    "and keep answers simple and easy to understand and "
-                    "appropriate."
-                ),
-            },
-        ],
+        messages=request_messages,
+        on_delta=print_delta,
     )
 
-    next_assistant_message = str(completion.choices[0].message.content)
+    next_assistant_message = completion.content
 
-    print(f"\n{next_assistant_message}")
+    if completion.answer is not None:
+        print(f"\n\n{format_stream_stats(completion.answer)}")
+    else:
+        print(completion.content)
+        print(
+            f"\n(blocked, {completion.verdict.reason}: about "
+            f"{completion.tokens_saved} completion tokens saved)"
+        )
 
     if completion.usage:
+        token_counter.calibrate(
+            model, request_messages, completion.usage.prompt_tokens
+        )
         completion_tokens += completion.usage.completion_tokens
         prompt_tokens += completion.usage.prompt_tokens
         total_tokens += completion.usage.total_tokens
@@ -96,13 +131,17 @@ while True:
                 f"\n\nCompletion Tokens: {completion.usage.completion_tokens}"
                 f"\nPrompt Tokens: {completion.usage.prompt_tokens}"
                 f"\nTotal Tokens: {completion.usage.total_tokens}"
+                f"\nPrompt Tokens Saved by Summary: {history.tokens_saved}"
             )
         else:
             print("No usage information available.")
 
-    messages.append(
+    history.append(
         {
             "role": "assistant",
             "content": next_assistant_message,
         }
     )
+
+    # fold older turns into a running summary in the background
+    history.compact()
@@ -1,40 +1,23 @@
 # This module implements a command-line French Culture Tutor using OpenAI's chat API.
 # It allows the user to select a model and interact using a conversational interface.
-
-from typing import TypedDict
+# The automatic option picks a model per question and reports what it saved.
 
 from openai.types.chat import ChatCompletionMessageParam
 
-from ..utils.openai_utils import openai_service
-
-
-# Define a TypedDict to store model information: id, name, and per-token pricing.
-class Model(TypedDict):
-    id: str
-    name: str
-    input: float
-    output: float
-
-
-# List of available models with their associated pricing per input/output token.
-models: list[Model] = [
-    {
-        "id": "gpt-4o-mini",
-        "name": "GPT-4o Mini",
-        "input": 0.15 / 1000000,
-        "output": 0.60 / 1000000,
-    },
-    {
-        "id": "gpt-4o",
-        "name": "GPT-4o",
-        "input": 2.50 / 1000000,
-        "output": 10.00 / 1000000,
-    },
-]
-
+from ..utils.guardrail_utils import Guardrail, run_guarded_chat_completion
+from ..utils.history_utils import ConversationHistory
+from ..utils.pricing_utils import get_price, models
+from ..utils.router_utils import ModelRouter, session_budget_from_env
+from ..utils.streaming_utils import (
+    StreamedCompletion,
+    format_stream_stats,
+    print_delta,
+    stream_chat_completion,
+)
+from ..utils.token_utils import token_counter
 
 # Pre-configured conversation starting with system instructions to ensure responses are centered on French culture.
-messages: list[ChatCompletionMessageParam] = [
+system_messages: list[ChatCompletionMessageParam] = [
     {
         "role": "system",
         "content": (
@@ -58,23 +41,17 @@ messages: list[ChatCompletionMessageParam] = [
 ]
 
 
-# Function to compute the total price based on prompt and completion token usage.
-def get_price(
-    model_id: str,
-    prompt_tokens: int,
-    completion_tokens: int,
-) -> float:
-    # Loop through available models to find matching pricing details.
-    for model_info in models:
-        if model_info["id"] == model_id:
-            input_price = model_info["input"]
-            output_price = model_info["output"]
-            break
-    else:
-        raise ValueError("Model not found")
-
-    # Calculate and return the total cost.
-    return (input_price * prompt_tokens) + (output_price * completion_tokens)
+# The rule the answers follow, also checked by the guardrail while the
+# answer is generated so the answer to an off-topic question is cancelled.
+guardrail_prompt = (
+    "Only answer questions relevant to French culture and "
+    "history. It's ok to discuss controversial topics, but "
+    "keep it respectful of all cultures involved. Assume "
+    "the user is a high school student around the age of 16 "
+    "and keep answers simple and easy to understand and "
+    "appropriate."
+)
+guardrail = Guardrail(guardrail_prompt)
 
 
 # Initialize token tracking and a flag to control token usage display.
@@ -82,6 +59,30 @@ show_tokens = False
 completion_tokens = 0
 prompt_tokens = 0
 total_tokens = 0
+total_cost = 0.0
+
+
+def record_usage(
+    model_id: str,
+    request_messages: list[ChatCompletionMessageParam],
+    completion: StreamedCompletion,
+) -> None:
+    # Add the usage of a completion to the session totals.
+    global completion_tokens, prompt_tokens, total_tokens, total_cost
+    if not completion.usage:
+        return
+    token_counter.calibrate(
+        model_id, request_messages, completion.usage.prompt_tokens
+    )
+    completion_tokens += completion.usage.completion_tokens
+    prompt_tokens += completion.usage.prompt_tokens
+    total_tokens += completion.usage.total_tokens
+    total_cost += get_price(
+        model_id,
+        completion.usage.prompt_tokens,
+        completion.usage.completion_tokens,
+    )
+
 
 print("\n\n\nWelcome to the French Culture Tutor!\n")
 
@@ -89,13 +90,25 @@ print("\n\n\nWelcome to the French Culture Tutor!\n")
 print("Available models:")
 for model_index, model_info in enumerate(models):
     print(f"{model_index + 1} {model_info['name']} ({model_info['id']})")
+print(f"{len(models) + 1} Automatic (picks a model for each question)")
 
 model_number = int(input("\nWhich model would you like to use? "))
 model_index = model_number - 1
-if model_index > len(models) - 1 or model_index < 0:
+if model_index > len(models) or model_index < 0:
     raise ValueError("Invalid model number.")
 
-model_id = models[model_index]["id"]
+# The router starts each question on the small model and escalates to the
+# large one when needed, the history is kept within the smaller budget of
+# the large model so either can answer.
+router = (
+    ModelRouter(session_budget=session_budget_from_env())
+    if model_index == len(models)
+    else None
+)
+model_id = router.large_model if router else models[model_index]["id"]
+
+# Keep the conversation history within the token budget of the model.
+history = ConversationHistory(system_messages, model=model_id)
 
 # Main interactive loop for processing user input and generating OpenAI responses.
 while True:
@@ -113,52 +126,109 @@ while True:
     if next_user_message.lower() in ["token count"]:
         # Display the current token usage and corresponding cost.
         print(
-            f"Model: {model_id}\n"
-            f"Total Tokens: {total_tokens} "
-            f"(${get_price(model_id, prompt_tokens, completion_tokens):.8f})"
+            f"Model: {'automatic' if router else model_id}\n"
+            f"Total Tokens: {total_tokens} (${total_cost:.8f})"
         )
+        if router:
+            print(router.report())
         continue
 
     if next_user_message.lower() in ["exit", "quit", "q"]:
+        if router:
+            print(router.report())
+        print(guardrail.stats)
         print("Goodbye!")
         break
 
     # Add the user's message to the conversation history.
-    messages.append(
+    history.append(
         {
             "role": "user",
             "content": next_user_message,
         }
     )
 
-    # Call the OpenAI service to generate a completion based on the current conversation.
-    completion = openai_service.chat.completions.create(
+    # Build the request and estimate its prompt tokens and cost offline.
+    request_messages: list[ChatCompletionMessageParam] = [
+        *history.to_messages(),
+        {
+            "role": "system",
+            "content": guardrail_prompt,
+        },
+    ]
+    if router:
+        decision = router.route(request_messages, next_user_message)
+        model_id = decision.model
+        print(f"\n[{model_id}: {decision.reason}]")
+    estimated_prompt_tokens = token_counter.count(model_id, request_messages)
+    if estimated_prompt_tokens > history.token_budget:
+        print(
+            f"\nWarning: about {estimated_prompt_tokens} prompt tokens, "
+            "older turns will be summarized after this answer."
+        )
+    if show_tokens:
+        estimated_price = get_price(model_id, estimated_prompt_tokens, 0)
+        print(
+            f"\nEstimated Prompt Tokens: {estimated_prompt_tokens} "
+            f"(${estimated_price:.8f})"
+        )
+
+    # Stream a completion from the OpenAI service based on the current conversation,
+    # while the guardrail checks the question.
+    print()
+    guarded = run_guarded_chat_completion(
+        guardrail,
+        next_user_message,
         model=model_id,
-        messages=[
-            *messages,
-            {
-                "role": "system",
-                "content": (
-                    "Only answer questions relevant to French culture and "
-                    "history. It's ok to discuss controversial topics, but "
-                    "keep it respectful of all cultures involved. Assume "
-                    "the user is a high school student around the age of 16 "
-                    "and keep answers simple and easy to understand and "
-                    "appropriate."
-                ),
-            },
-        ],
+        messages=request_messages,
+        on_delta=print_delta,
     )
+    if guarded.answer is None:
+        # The question was blocked and its answer cancelled.
+        print(guarded.content)
+        print(
+            f"\n(blocked, {guarded.verdict.reason}: about "
+            f"{guarded.tokens_saved} completion tokens saved)"
+        )
+        history.append({"role": "assistant", "content": guarded.content})
+        history.compact()
+        continue
 
-    # Store and print the assistant's response.
-    next_assistant_message = str(completion.choices[0].message.content)
-    print(f"\n{next_assistant_message}")
+    completion = guarded.answer
+    print(f"\n\n{format_stream_stats(completion)}")
+    record_usage(model_id, request_messages, completion)
+
+    if router:
+        # Retry on the large model when the answer looks cut off or empty.
+        answer_ok = router.check_answer(
+            decision, completion.content, completion.finish_reason
+        )
+        router.record(
+            decision,
+            completion.usage,
+            completion.elapsed,
+            completion.time_to_first_token,
+            retried=not answer_ok,
+        )
+        if not answer_ok:
+            decision = router.escalate(decision)
+            model_id = decision.model
+            print(f"\n[Retrying on {model_id}: {decision.reason}]")
+            completion = stream_chat_completion(
+                model=model_id,
+                messages=request_messages,
+            )
+            print(f"\n{format_stream_stats(completion)}")
+            record_usage(model_id, request_messages, completion)
+            router.record(
+                decision,
+                completion.usage,
+                completion.elapsed,
+                completion.time_to_first_token,
+            )
 
-    # Update token counts if the usage information is available.
-    if completion.usage:
-        completion_tokens += completion.usage.completion_tokens
-        prompt_tokens += completion.usage.prompt_tokens
-        total_tokens += completion.usage.total_tokens
+    # Store the streamed response.
+    next_assistant_message = completion.content
 
     # Optionally display detailed token count information.
     if show_tokens:
@@ -167,14 +237,18 @@ while True:
                 f"\n\nCompletion Tokens: {completion.usage.completion_tokens}"
                 f"\nPrompt Tokens: {completion.usage.prompt_tokens}"
                 f"\nTotal Tokens: {completion.usage.total_tokens}"
+                f"\nPrompt Tokens Saved by Summary: {history.tokens_saved}"
             )
         else:
             print("No usage information available.")
 
     # Append the assistant's response to the conversation history.
-    messages.append(
+    history.append(
         {
             "role": "assistant",
             "content": next_assistant_message,
         }
     )
+
+    # Fold older turns into a running summary in the background.
+    history.compact()
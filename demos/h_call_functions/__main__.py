@@ -2,18 +2,16 @@
 # Run using: python -m demos.h_call_functions
 
 # Import standard libraries and type helpers.
-import json  # For parsing JSON responses.
-from typing import TypedDict, cast
+from typing import TypedDict
 
-# Import OpenAI chat message and tool parameter types.
-from openai.types.chat import (
-    ChatCompletionMessageParam,
-    ChatCompletionToolParam,
-)
+# Import the OpenAI chat message type.
+from openai.types.chat import ChatCompletionMessageParam
 
 # Import custom utilities for interacting with OpenAI and OpenWeather.
 from ..utils.openai_utils import openai_service
 from ..utils.openweather_utils import format_weather_data, get_current_weather
+from ..utils.tool_utils import complete_with_tools
+from .weather_tools import tools
 
 
 # Define the Model type and a list of available models with their cost parameters.
@@ -54,29 +52,6 @@ messages: list[ChatCompletionMessageParam] = [
     },
 ]
 
-# Define available tools (functions) that the AI can call. In this case, a tool to get current weather data.
-tools: list[ChatCompletionToolParam] = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_current_weather",
-            "description": "Get the current weather for a given location.",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {
-                        "type": "string",
-                        "description": "City and country e.g. Bogotá, Colombia",
-                    },
-                },
-                "required": ["location"],
-                "additionalProperties": False,
-            },
-            "strict": True,
-        },
-    },
-]
-
 # Welcome the user and prompt for input.
 print("\n\n\nWelcome to the French Weather and Fashion Expert!\n")
 
@@ -106,14 +81,6 @@ messages.extend(
     ]
 )
 
-# Call the OpenAI chat API with the current message context and tool configuration.
-completion = openai_service.chat.completions.create(
-    model="gpt-4o-mini",
-    messages=messages,
-    tools=tools,
-    tool_choice="auto",
-)
-
 
 # Function to process tool calls (here, the weather retrieval).
 def call_function(name: str, args: dict) -> str:
@@ -123,35 +90,11 @@ def call_function(name: str, args: dict) -> str:
     return ""
 
 
-# Append the initial AI response message.
-messages.append(
-    cast(ChatCompletionMessageParam, completion.choices[0].message)
+# Call the OpenAI chat API with the tools, running the tool calls of each
+# round concurrently and stopping after MAX_TOOL_ROUNDS rounds.
+completion = complete_with_tools(
+    openai_service, "gpt-4o-mini", messages, tools, call_function
 )
 
-# Process any tool calls returned from the AI response.
-while completion.choices[0].message.tool_calls:
-    tool_calls = completion.choices[0].message.tool_calls
-    for tool_call in tool_calls:
-        name = tool_call.function.name
-        args = json.loads(tool_call.function.arguments)
-
-        # Execute the corresponding function for the tool call.
-        result = call_function(name, args)
-        messages.append(
-            {
-                "role": "tool",
-                "tool_call_id": tool_call.id,
-                "content": result,
-            }
-        )
-
-    # Make subsequent API calls with updated message context including tool responses.
-    completion = openai_service.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        tools=tools,
-        tool_choice="auto",
-    )
-
 # Print the final AI response.
 print(f"\n\n{completion.choices[0].message.content}\n")
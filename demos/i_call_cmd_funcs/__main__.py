@@ -2,40 +2,20 @@
 # python -m demos.i_call_cmd_funcs
 
 
-import json
-from typing import TypedDict, cast
-
 from openai.types.chat import (
+    ChatCompletion,
     ChatCompletionMessageParam,
     ChatCompletionToolParam,
 )
 
+from ..utils.guardrail_utils import Guardrail, run_guarded_chat_completion
+from ..utils.history_utils import ConversationHistory
 from ..utils.openai_utils import openai_service
+from ..utils.pricing_utils import get_price, models
+from ..utils.router_utils import ModelRouter, session_budget_from_env
+from ..utils.tool_utils import complete_with_tools
 
-
-class Model(TypedDict):
-    id: str
-    name: str
-    input: float
-    output: float
-
-
-models: list[Model] = [
-    {
-        "id": "gpt-4o-mini",
-        "name": "GPT-4o Mini",
-        "input": 0.15 / 1000000,
-        "output": 0.60 / 1000000,
-    },
-    {
-        "id": "gpt-4o",
-        "name": "GPT-4o",
-        "input": 2.50 / 1000000,
-        "output": 10.00 / 1000000,
-    },
-]
-
-messages: list[ChatCompletionMessageParam] = [
+system_messages: list[ChatCompletionMessageParam] = [
     {
         "role": "system",
         "content": (
@@ -96,20 +76,13 @@ tools: list[ChatCompletionToolParam] = [
 ]
 
 
-def get_price(
-    model_id: str,
-    prompt_tokens: int,
-    completion_tokens: int,
-) -> float:
-    for model_info in models:
-        if model_info["id"] == model_id:
-            input_price = model_info["input"]
-            output_price = model_info["output"]
-            break
-    else:
-        raise ValueError("Model not found")
-
-    return (input_price * prompt_tokens) + (output_price * completion_tokens)
+# checks each question while the first completion is generated, the tools
+# of the demo are on topic too
+guardrail = Guardrail(
+    "Only answer questions relevant to French culture and history. "
+    "Requests to toggle the token display or for stats on the session, "
+    "such as the model, the tokens used or their cost, are allowed too."
+)
 
 
 def call_function(name: str, args: dict) -> str:
@@ -118,32 +91,65 @@ def call_function(name: str, args: dict) -> str:
         show_tokens = not show_tokens
         return f"Show tokens: {show_tokens}"
     elif name == "token_stats":
-        return (
-            f"Model: {model_id}\n"
+        stats = (
+            f"Model: {'automatic' if router else model_id}\n"
             f"Total Tokens: {total_tokens} "
             "Total Expense: "
-            f"(${get_price(model_id, prompt_tokens, completion_tokens):.8f})"
+            f"(${total_cost:.8f})"
         )
+        if router:
+            stats += f"\n{router.report()}"
+        return stats
     return ""
 
 
+def record_completion(completion: ChatCompletion, seconds: float) -> None:
+    # Add the usage of a completion to the session totals. The router
+    # records the tool rounds here, and the answer once it is checked.
+    global completion_tokens, prompt_tokens, total_tokens, total_cost
+    global answer_seconds
+    if completion.usage:
+        completion_tokens += completion.usage.completion_tokens
+        prompt_tokens += completion.usage.prompt_tokens
+        total_tokens += completion.usage.total_tokens
+        total_cost += get_price(
+            model_id,
+            completion.usage.prompt_tokens,
+            completion.usage.completion_tokens,
+        )
+    if not completion.choices[0].message.tool_calls:
+        answer_seconds = seconds
+    elif router:
+        router.record(decision, completion.usage, seconds)
+
+
 show_tokens = False
 completion_tokens = 0
 prompt_tokens = 0
 total_tokens = 0
+total_cost = 0.0
+answer_seconds = 0.0
 
 print("\n\n\nWelcome to the French Culture Tutor!\n")
 
 print("Available models:")
 for model_index, model_info in enumerate(models):
     print(f"{model_index + 1} {model_info['name']} ({model_info['id']})")
+print(f"{len(models) + 1} Automatic (picks a model for each question)")
 
 model_number = int(input("\nWhich model would you like to use? "))
 model_index = model_number - 1
-if model_index > len(models) - 1 or model_index < 0:
+if model_index > len(models) or model_index < 0:
     raise ValueError("Invalid model number.")
 
-model_id = models[model_index]["id"]
+router = (
+    ModelRouter(session_budget=session_budget_from_env())
+    if model_index == len(models)
+    else None
+)
+model_id = router.large_model if router else models[model_index]["id"]
+
+history = ConversationHistory(system_messages, model=model_id)
 
 while True:
     next_user_message = input(
@@ -151,81 +157,118 @@ while True:
     )
 
     if next_user_message.lower() in ["exit", "quit", "q"]:
+        if router:
+            print(router.report())
+        print(guardrail.stats)
         print("Goodbye!")
         break
 
-    messages.append(
+    history.append(
         {
             "role": "user",
             "content": next_user_message,
         }
     )
 
-    completion = openai_service.chat.completions.create(
+    request_messages: list[ChatCompletionMessageParam] = [
+        *history.to_messages(),
+        {
+            "role": "system",
+            "content": (
+                "Only answer questions relevant to French culture and "
+                "history. It's ok to discuss controversial topics, but "
+                "keep it respectful of all cultures involved. Assume "
+                "the user is a high school student around the age of 16 "
+                "and keep answers simple and easy to understand and "
+                "appropriate. If the user asks to toggle tokens use the "
+                "toggle_tokens tool function. Of, if the user asks for "
+                "stats on the session such as the selected model the "
+                "number of tokens used, or the cost/expense of the "
+                "tokens use the token_stats tool function."
+            ),
+        },
+    ]
+    if router:
+        decision = router.route(request_messages, next_user_message)
+        model_id = decision.model
+
+    # The first completion is made while the guardrail checks the question,
+    # and cancelled when the question is blocked.
+    guarded = run_guarded_chat_completion(
+        guardrail,
+        next_user_message,
         model=model_id,
-        messages=[
-            *messages,
-            {
-                "role": "system",
-                "content": (
-                    "Only answer questions relevant to French culture and "
-                    "history. It's ok to discuss controversial topics, but "
-                    "keep it respectful of all cultures involved. Assume "
-                    "the user is a high school student around the age of 16 "
-                    "and keep answers simple and easy to understand and "
-                    "appropriate. If the user asks to toggle tokens use the "
-                    "toggle_tokens tool function. Of, if the user asks for "
-                    "stats on the session such as the selected model the "
-                    "number of tokens used, or the cost/expense of the "
-                    "tokens use the token_stats tool function."
-                ),
-            },
-        ],
+        messages=request_messages,
+        stream=False,
         tools=tools,
         tool_choice="auto",
     )
+    if guarded.completion is None or guarded.answer is None:
+        print(f"\n{guarded.content}")
+        print(
+            f"\n(blocked, {guarded.verdict.reason}: about "
+            f"{guarded.tokens_saved} completion tokens saved)"
+        )
+        history.append({"role": "assistant", "content": guarded.content})
+        history.compact()
+        continue
+    record_completion(guarded.completion, guarded.answer.elapsed)
+
+    # The tool calls of the turn, their results and the answer are added to
+    # the turn, and to the history once the answer is accepted.
+    turn_messages = list(request_messages)
+    completion = complete_with_tools(
+        openai_service,
+        model_id,
+        turn_messages,
+        tools,
+        call_function,
+        on_completion=record_completion,
+        completion=guarded.completion,
+    )
 
-    next_assistant_message = completion.choices[0].message
-    messages.append(cast(ChatCompletionMessageParam, next_assistant_message))
-
-    if completion.choices[0].message.tool_calls:
-        tool_calls = completion.choices[0].message.tool_calls
-        for tool_call in tool_calls:
-            name = tool_call.function.name
-            args = json.loads(tool_call.function.arguments)
-
-            result = call_function(name, args)
-            messages.append(
-                {
-                    "role": "tool",
-                    "tool_call_id": tool_call.id,
-                    "content": result,
-                }
-            )
-
-        completion = openai_service.chat.completions.create(
-            model=model_id,
-            messages=messages,
-            tools=tools,
-            tool_choice="auto",
+    if router:
+        # Retry on the large model when the answer looks cut off or empty.
+        answer_ok = router.check_answer(
+            decision,
+            completion.choices[0].message.content,
+            completion.choices[0].finish_reason,
+        )
+        router.record(
+            decision, completion.usage, answer_seconds, retried=not answer_ok
         )
+        if not answer_ok:
+            decision = router.escalate(decision)
+            model_id = decision.model
+            # drop the rejected answer, the tools already ran and their
+            # results are kept
+            turn_messages.pop()
+            completion = complete_with_tools(
+                openai_service,
+                model_id,
+                turn_messages,
+                tools,
+                call_function,
+                on_completion=record_completion,
+            )
+            router.record(decision, completion.usage, answer_seconds)
 
     next_assistant_message = completion.choices[0].message
     print(f"\n{next_assistant_message.content}")
 
-    if completion.usage:
-        completion_tokens += completion.usage.completion_tokens
-        prompt_tokens += completion.usage.prompt_tokens
-        total_tokens += completion.usage.total_tokens
-
     if show_tokens:
         if completion.usage:
             print(
                 f"\n\nCompletion Tokens: {completion.usage.completion_tokens}"
                 f"\nPrompt Tokens: {completion.usage.prompt_tokens}"
                 f"\nTotal Tokens: {completion.usage.total_tokens}"
+                f"\nPrompt Tokens Saved by Summary: {history.tokens_saved}"
             )
         else:
             print("No usage information available.")
 
-    messages.append(cast(ChatCompletionMessageParam, next_assistant_message))
+    for message in turn_messages[len(request_messages) :]:
+        history.append(message)
+
+    # fold older turns into a running summary in the background
+    history.compact()
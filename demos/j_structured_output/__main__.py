@@ -2,43 +2,22 @@
 # python -m demos.j_structured_output
 
 # Import necessary modules and classes
-from pydantic import BaseModel
-
+from ..utils.cache_utils import with_response_cache
 from ..utils.openai_utils import openai_service
+from .math_reasoning import MATH_MODEL, MATH_TUTOR_PROMPT, MathReasoning
 
-
-# Define a class to represent each step in the math reasoning
-class Step(BaseModel):
-    explanation: str
-    output: str
-
-
-# Define a class to represent the overall math reasoning, including steps and final answer
-class MathReasoning(BaseModel):
-    steps: list[Step]
-    final_answer: str
-
-    # Pretty print the math reasoning steps and final answer
-    def pretty_print(self) -> None:
-        for i, step in enumerate(self.steps, start=1):
-            print(f"Step {i}:")
-            print(f"  Explanation: {step.explanation}")
-            print(f"  Output: {step.output}")
-            print()
-        print(f"Final Answer: {self.final_answer}")
-
+# serve identical requests from the response cache when
+# OPENAI_RESPONSE_CACHE is set
+cached_openai_service = with_response_cache(openai_service)
 
 # Request a completion from the OpenAI service with a specific model
 # and messages
-completion = openai_service.beta.chat.completions.parse(
-    model="gpt-4o-2024-08-06",
+completion = cached_openai_service.beta.chat.completions.parse(
+    model=MATH_MODEL,
     messages=[
         {
             "role": "system",
-            "content": (
-                "You are a helpful math tutor. Guide the user through the "
-                "solution step by step."
-            ),
+            "content": MATH_TUTOR_PROMPT,
         },
         {
             "role": "user",
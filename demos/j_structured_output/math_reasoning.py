@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+
+MATH_MODEL = "gpt-4o-2024-08-06"
+MATH_TUTOR_PROMPT = (
+    "You are a helpful math tutor. Guide the user through the "
+    "solution step by step."
+)
+
+
+# Define a class to represent each step in the math reasoning
+class Step(BaseModel):
+    explanation: str
+    output: str
+
+
+# Define a class to represent the overall math reasoning, including steps and final answer
+class MathReasoning(BaseModel):
+    steps: list[Step]
+    final_answer: str
+
+    # Pretty print the math reasoning steps and final answer
+    def pretty_print(self) -> None:
+        for i, step in enumerate(self.steps, start=1):
+            print(f"Step {i}:")
+            print(f"  Explanation: {step.explanation}")
+            print(f"  Output: {step.output}")
+            print()
+        print(f"Final Answer: {self.final_answer}")
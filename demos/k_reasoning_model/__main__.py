@@ -1,7 +1,23 @@
 # To run this script, use the command from the root folder of the repo:
-# python -m demos.j_reasoning_model
+# python -m demos.k_reasoning_model [--effort low medium high]
+#     [--deadline SECONDS] [--repeat N]
+#
+# Reasoning latency has a long tail. When the reasoning model has not
+# answered by the deadline, the prompt also goes to a non-reasoning model
+# and the first answer wins. With --repeat the latency and reasoning token
+# distributions of each effort are printed.
 
-from ..utils.openai_utils import openai_service
+import argparse
+import asyncio
+
+from ..utils.cache_utils import response_cache_from_env
+from .reasoning import (
+    DEFAULT_DEADLINE,
+    DEFAULT_REASONING_EFFORT,
+    REASONING_EFFORTS,
+    ReasoningStats,
+    reasoning_completion,
+)
 
 prompt = """
 Instructions:
@@ -31,16 +47,57 @@ export default function BookList() {
 }
 """
 
-response = openai_service.chat.completions.create(
-    model="o1-mini",
-    messages=[
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-            ],
-        }
-    ],
+parser = argparse.ArgumentParser(prog="python -m demos.k_reasoning_model")
+parser.add_argument(
+    "--effort",
+    nargs="+",
+    choices=REASONING_EFFORTS,
+    default=[DEFAULT_REASONING_EFFORT],
 )
+parser.add_argument(
+    "--deadline",
+    type=float,
+    default=DEFAULT_DEADLINE,
+    help="seconds before the fallback model is asked too, 0 to wait",
+)
+parser.add_argument("--repeat", type=int, default=1)
+args = parser.parse_args()
+
+# serve identical requests from the response cache when
+# OPENAI_RESPONSE_CACHE is set
+cache = response_cache_from_env()
+stats = ReasoningStats()
+
+
+async def main() -> None:
+    for effort in args.effort:
+        for run in range(args.repeat):
+            result = await reasoning_completion(
+                [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                        ],
+                    }
+                ],
+                reasoning_effort=effort,
+                deadline=args.deadline or None,
+                cache=cache,
+            )
+            if run == 0:
+                print(result.content)
+            print(
+                f"\n({result.model}, {effort} effort, {result.seconds:.1f}s, "
+                f"{result.reasoning_tokens} of {result.completion_tokens} "
+                "completion tokens reasoning"
+                f"{', after the deadline' if result.hedged else ''}"
+                f"{', cached' if result.cached else ''})"
+            )
+            if not result.cached:
+                stats.record(result)
+
+    print(f"\n{stats.report()}")
+
 
-print(response.choices[0].message.content)
+asyncio.run(main())
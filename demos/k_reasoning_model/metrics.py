@@ -0,0 +1,39 @@
+from prometheus_client import Counter, Histogram
+
+from ..utils.metrics_utils import LATENCY_BUCKETS
+
+# reasoning tokens grow roughly by a factor of two to four per effort level
+REASONING_TOKEN_BUCKETS = (
+    0,
+    128,
+    256,
+    512,
+    1024,
+    2048,
+    4096,
+    8192,
+    16384,
+    32768,
+)
+
+REASONING_TOKENS = Histogram(
+    "reasoning_tokens",
+    "Hidden reasoning tokens of answered reasoning requests, by model and "
+    "reasoning effort.",
+    ["model", "effort"],
+    buckets=REASONING_TOKEN_BUCKETS,
+)
+REASONING_SECONDS = Histogram(
+    "reasoning_seconds",
+    "Seconds until a reasoning request was answered, by the reasoning "
+    "effort and the model that answered (the fallback model when the "
+    "deadline passed and it finished first).",
+    ["model", "effort"],
+    buckets=LATENCY_BUCKETS,
+)
+REASONING_HEDGES = Counter(
+    "reasoning_hedges",
+    "Reasoning requests that missed their deadline and were also sent to "
+    "the fallback model, winner is reasoning or fallback.",
+    ["winner"],
+)
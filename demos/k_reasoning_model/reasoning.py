@@ -0,0 +1,243 @@
+import asyncio
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Literal
+
+from openai.types.chat import ChatCompletion
+
+from ..utils.cache_utils import CompletionCache, request_key
+from ..utils.openai_utils import get_async_openai_service
+from .metrics import REASONING_HEDGES, REASONING_SECONDS, REASONING_TOKENS
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletionMessageParam
+
+ReasoningEffort = Literal["low", "medium", "high"]
+REASONING_EFFORTS: tuple[ReasoningEffort, ...] = ("low", "medium", "high")
+
+# o1-mini does not take a reasoning effort, o3-mini does at a similar price
+REASONING_MODEL = "o3-mini"
+# answers in the time a reasoning model spends thinking
+FALLBACK_MODEL = "gpt-4o"
+DEFAULT_REASONING_EFFORT: ReasoningEffort = "medium"
+# seconds the reasoning model has before the fallback model is asked too
+DEFAULT_DEADLINE = 30.0
+
+
+@dataclass
+class ReasoningResult:
+    """
+    The answer to a reasoning request.
+
+    Attributes:
+        content (str): The answer.
+        model (str): The model that answered, the fallback model when it
+            won the race after the deadline.
+        reasoning_effort (ReasoningEffort): The effort that was asked for.
+        seconds (float): Seconds until the answer.
+        reasoning_tokens (int): Hidden reasoning tokens of the answer.
+        completion_tokens (int): Completion tokens, including reasoning.
+        hedged (bool): Whether the fallback model was asked too.
+        cached (bool): Whether the answer came from the response cache.
+    """
+
+    content: str
+    model: str
+    reasoning_effort: ReasoningEffort
+    seconds: float
+    reasoning_tokens: int = 0
+    completion_tokens: int = 0
+    hedged: bool = False
+    cached: bool = False
+
+
+def _reasoning_tokens(completion: ChatCompletion) -> int:
+    usage = completion.usage
+    if usage is None or usage.completion_tokens_details is None:
+        return 0
+    return usage.completion_tokens_details.reasoning_tokens or 0
+
+
+def _result(
+    completion: ChatCompletion,
+    model: str,
+    reasoning_effort: ReasoningEffort,
+    seconds: float,
+    hedged: bool = False,
+    cached: bool = False,
+) -> ReasoningResult:
+    return ReasoningResult(
+        content=completion.choices[0].message.content or "",
+        model=model,
+        reasoning_effort=reasoning_effort,
+        seconds=seconds,
+        reasoning_tokens=_reasoning_tokens(completion),
+        completion_tokens=(
+            completion.usage.completion_tokens if completion.usage else 0
+        ),
+        hedged=hedged,
+        cached=cached,
+    )
+
+
+async def reasoning_completion(
+    messages: "list[ChatCompletionMessageParam]",
+    reasoning_effort: ReasoningEffort = DEFAULT_REASONING_EFFORT,
+    deadline: float | None = DEFAULT_DEADLINE,
+    model: str = REASONING_MODEL,
+    fallback_model: str = FALLBACK_MODEL,
+    client: "AsyncOpenAI | None" = None,
+    cache: CompletionCache | None = None,
+) -> ReasoningResult:
+    """
+    Ask a reasoning model, and the fallback model too once the deadline
+    passes or the reasoning model fails. The first answer wins and the
+    other request is cancelled.
+
+    Args:
+        messages (list[ChatCompletionMessageParam]): The prompt.
+        reasoning_effort (ReasoningEffort): How long the model may reason.
+        deadline (float | None): Seconds before the fallback model is
+            asked, None to always wait for the reasoning model.
+        model (str): The reasoning model.
+        fallback_model (str): The model raced against it after the
+            deadline.
+        client (AsyncOpenAI | None): The client to use, the shared asyncio
+            client from `openai_utils` when not given.
+        cache (CompletionCache | None): The response cache, checked for an
+            answer of the reasoning model before asking.
+
+    Returns:
+        ReasoningResult: The answer with its latency and reasoning tokens.
+    """
+    client = client or get_async_openai_service()
+    requests: dict[str, dict[str, Any]] = {
+        model: {
+            "model": model,
+            "messages": messages,
+            "reasoning_effort": reasoning_effort,
+        },
+        fallback_model: {"model": fallback_model, "messages": messages},
+    }
+    start = time.perf_counter()
+
+    if cache is not None:
+        cached = cache.get(
+            request_key("chat.completions.create", **requests[model])
+        )
+        if cached is not None:
+            return _result(
+                ChatCompletion.model_validate_json(cached),
+                model,
+                reasoning_effort,
+                time.perf_counter() - start,
+                cached=True,
+            )
+
+    async def ask(request_model: str) -> ChatCompletion:
+        return await client.chat.completions.create(**requests[request_model])
+
+    tasks = {asyncio.create_task(ask(model)): model}
+    hedged = False
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=deadline)
+        if not done or next(iter(done)).exception() is not None:
+            # too slow or failed, race the fallback model against it
+            hedged = True
+            tasks[asyncio.create_task(ask(fallback_model))] = fallback_model
+
+        pending = set(tasks)
+        error: BaseException | None = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            winner = next(
+                (task for task in done if task.exception() is None), None
+            )
+            if winner is not None:
+                break
+            error = next(iter(done)).exception()
+        else:
+            assert error is not None
+            raise error
+    finally:
+        # the loser is cancelled, which closes its connection
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    completion = winner.result()
+    answered_by = tasks[winner]
+    seconds = time.perf_counter() - start
+    if cache is not None:
+        cache.put(
+            request_key("chat.completions.create", **requests[answered_by]),
+            completion.model_dump_json(),
+        )
+
+    result = _result(
+        completion, answered_by, reasoning_effort, seconds, hedged=hedged
+    )
+    REASONING_SECONDS.labels(answered_by, reasoning_effort).observe(seconds)
+    if answered_by == model:
+        REASONING_TOKENS.labels(model, reasoning_effort).observe(
+            result.reasoning_tokens
+        )
+    if hedged:
+        REASONING_HEDGES.labels(
+            "reasoning" if answered_by == model else "fallback"
+        ).inc()
+    return result
+
+
+@dataclass
+class ReasoningStats:
+    """The latency and reasoning tokens of answers by reasoning effort."""
+
+    model: str = REASONING_MODEL
+    seconds: dict[str, list[float]] = field(default_factory=dict)
+    reasoning_tokens: dict[str, list[int]] = field(default_factory=dict)
+    hedged: dict[str, int] = field(default_factory=dict)
+    fallback_answers: dict[str, int] = field(default_factory=dict)
+
+    def record(self, result: ReasoningResult) -> None:
+        effort = result.reasoning_effort
+        self.seconds.setdefault(effort, []).append(result.seconds)
+        self.hedged[effort] = self.hedged.get(effort, 0) + result.hedged
+        if result.model == self.model:
+            self.reasoning_tokens.setdefault(effort, []).append(
+                result.reasoning_tokens
+            )
+        else:
+            self.fallback_answers[effort] = (
+                self.fallback_answers.get(effort, 0) + 1
+            )
+
+    def report(self) -> str:
+        lines = []
+        for effort, seconds in self.seconds.items():
+            tokens = self.reasoning_tokens.get(effort, [])
+            token_line = (
+                f"reasoning tokens p50 {_percentile(tokens, 50):.0f} "
+                f"p95 {_percentile(tokens, 95):.0f}"
+                if tokens
+                else "no reasoning answers"
+            )
+            lines.append(
+                f"{effort}: {len(seconds)} answers, latency p50 "
+                f"{_percentile(seconds, 50):.1f}s p95 "
+                f"{_percentile(seconds, 95):.1f}s, {token_line}, "
+                f"{self.hedged.get(effort, 0)} hedged, "
+                f"{self.fallback_answers.get(effort, 0)} answered by the "
+                "fallback"
+            )
+        return "\n".join(lines)
+
+
+def _percentile(values: list[float] | list[int], percent: int) -> float:
+    if len(values) == 1:
+        return float(values[0])
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
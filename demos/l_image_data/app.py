@@ -2,33 +2,81 @@ from pathlib import PurePath
 
 from flask import (
     Flask,
+    jsonify,
+    redirect,
     render_template,
     request,
+    url_for,
 )
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from werkzeug.wrappers import Response
 
-from .bills import get_bill_details
-from .files import delete_files_in_folder, handle_files
+from .files import SpooledUploadRequest, handle_files
+from .jobs import BillJobQueue, QueueFullError
+from .metrics import BILL_STAGE_SECONDS
 
 
 def create_app(upload_folder: PurePath) -> Flask:
     app = Flask(__name__)
     app.config["UPLOAD_FOLDER"] = upload_folder
+    # uploads stay in memory unless they are oversized
+    app.request_class = SpooledUploadRequest
+    # the uploads are extracted in the background, the request only reads
+    # the files into a new job
+    jobs = BillJobQueue()
+    app.extensions["bill_jobs"] = jobs
 
     @app.route("/", methods=["GET", "POST"])
-    def upload_file() -> Response | str:
+    def upload_file() -> Response | str | tuple[str, int]:
         if request.method == "POST":
             errors: list[str] = []
-            file_count, errors = handle_files(["invoice", "receipt"], errors)
+            try:
+                job = jobs.create_job()
+            except QueueFullError as e:
+                return render_template("index.html", errors=[str(e)]), 503
 
-            if file_count == 0:
+            with BILL_STAGE_SECONDS.labels("upload").time():
+                documents, errors = handle_files(
+                    ["invoice", "receipt"], errors, upload_folder
+                )
+
+            if not documents:
+                jobs.discard(job)
                 errors.append("No invoice or receipt")
                 return render_template("index.html", errors=errors)
-            else:
-                bill_details: list[str] = get_bill_details(upload_folder)
-                delete_files_in_folder(upload_folder)
-                return render_template("index.html", bill_details=bill_details)
+
+            jobs.start(job, documents)
+            return redirect(url_for("job_status", job_id=job.id), code=303)
 
         return render_template("index.html")
 
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id: str) -> Response | str | tuple[str, int]:
+        # poll with Accept: application/json for the status and result,
+        # browsers get a page that refreshes until the job is finished
+        job = jobs.get(job_id)
+        wants_json = request.accept_mimetypes.best == "application/json"
+        if job is None:
+            if wants_json:
+                response = jsonify({"error": "Job not found"})
+                response.status_code = 404
+                return response
+            return render_template("index.html", errors=["Job not found"]), 404
+
+        if wants_json:
+            return jsonify(job.to_dict())
+        return render_template(
+            "index.html",
+            job=job,
+            bill_details=job.result,
+            errors=[job.error] if job.error else None,
+        )
+
+    @app.route("/metrics")
+    def metrics() -> Response:
+        # the bill stages and the model call metrics of the OpenAI client
+        return Response(
+            generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST}
+        )
+
     return app
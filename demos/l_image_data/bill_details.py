@@ -0,0 +1,66 @@
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+# load from accounting system
+expense_categories = [
+    "Advertising",
+    "Bank Charges",
+    "Business Licenses and Permits",
+    "Contract Labor",
+    "Depreciation Expense",
+    "Dues and Subscriptions",
+    "Employee Benefits",
+    "Insurance",
+    "Interest Expense",
+    "Legal and Professional Fees",
+    "Meals and Entertainment",
+    "Office Supplies",
+    "Payroll Expenses",
+    "Postage and Delivery",
+    "Rent or Lease Payments",
+    "Repairs and Maintenance",
+    "Software and Subscriptions",
+    "Taxes",
+    "Travel Expenses",
+    "Utilities",
+    "Other",
+]
+
+# The categories become an enum in the JSON schema, so the model can only
+# answer with a category the accounting system knows.
+ExpenseCategory = Enum(  # type: ignore[misc]
+    "ExpenseCategory",
+    [(category, category) for category in expense_categories],
+    type=str,
+)
+
+
+# Define a class to represent one line of the bill payment form
+class BillLine(BaseModel):
+    item: str | None
+    expense_category: ExpenseCategory
+    description: str
+    quantity: float
+    price: float
+    tax: float | None
+    amount: float
+
+
+# Define a class to represent the fields of the bill payment form, null
+# where the invoice or receipt does not give a value
+class BillDetails(BaseModel):
+    vendor: str
+    currency: str = Field(description="ISO 4217 code, e.g. USD")
+    bill_date: str | None = Field(description="YYYY-MM-DD")
+    due_date: str | None = Field(description="YYYY-MM-DD")
+    bill_number: str | None
+    po_so_number: str | None = Field(
+        description="Purchase order or sales order number"
+    )
+    notes: str | None
+    lines: list[BillLine]
+    subtotal: float
+    total: float
+    total_paid: float
+    amount_due: float
@@ -1,104 +1,67 @@
-import base64  # Add this import
+import os
+from functools import cache
 from pathlib import Path, PurePath
 
+from openai import OpenAI
 from openai.types.chat import (
+    ChatCompletionContentPartImageParam,
     ChatCompletionMessageParam,
 )
 
-from ..utils.openai_utils import openai_service
-from .files import convert_pdf_to_images
-
-# load from accounting system
-expense_categories = [
-    "Advertising",
-    "Bank Charges",
-    "Business Licenses and Permits",
-    "Contract Labor",
-    "Depreciation Expense",
-    "Dues and Subscriptions",
-    "Employee Benefits",
-    "Insurance",
-    "Interest Expense",
-    "Legal and Professional Fees",
-    "Meals and Entertainment",
-    "Office Supplies",
-    "Payroll Expenses",
-    "Postage and Delivery",
-    "Rent or Lease Payments",
-    "Repairs and Maintenance",
-    "Software and Subscriptions",
-    "Taxes",
-    "Travel Expenses",
-    "Utilities",
-    "Other",
-]
-
-
-def get_bill_details(upload_folder: PurePath) -> str:
-    try:
-        invoice_images = convert_pdf_to_images(upload_folder / "invoice.pdf")
-    except:  # noqa: E722
-        invoice_images = []
-
-    try:
-        receipt_images = convert_pdf_to_images(upload_folder / "receipt.pdf")
-    except:  # noqa: E722
-        receipt_images = []
-
-    invoice_data = [
-        base64.b64encode(open(image_path, "rb").read()).decode("utf-8")
-        for image_path in invoice_images
-    ]
+from ..utils.cache_utils import (
+    CachedOpenAI,
+    CompletionCache,
+    request_key,
+    with_response_cache,
+)
+from ..utils.openai_utils import get_openai_service, load_env
+from .bill_details import BillDetails
+from .config import (
+    BILL_INDEX_MAX_ENTRIES,
+    BILL_INDEX_PATH_ENV,
+    BILL_INDEX_TTL,
+    DEFAULT_BILL_INDEX_PATH,
+    FORM_IMAGE_ENCODING,
+    PAGE_IMAGE_ENCODING,
+)
+from .files import (
+    BillDocument,
+    EncodedImage,
+    convert_pdfs_to_images,
+    documents_in_folder,
+    encode_image_file,
+)
+from .metrics import BILL_INDEX_LOOKUPS, BILL_STAGE_SECONDS
 
-    receipt_data = [
-        base64.b64encode(open(image_path, "rb").read()).decode("utf-8")
-        for image_path in receipt_images
-    ]
+BILL_MODEL = "gpt-4o-mini"
+# bump when build_bill_messages changes, the static messages, the schema
+# and the model are part of the prompt fingerprint already
+BILL_PROMPT_VERSION = 1
+BILL_DOCUMENTS = ("invoice", "receipt")
 
-    with open(
-        Path(__file__).parent / "assets" / "bill-screen.png", "rb"
-    ) as wave_image:
-        wave_image_data = base64.b64encode(wave_image.read()).decode("utf-8")
 
-    invoice_content = []
-    if invoice_data:
-        invoice_content = [
-            {
-                "type": "text",
-                "text": (
-                    "Here are the invoice images. All of the images "
-                    "represent each page of one invoice."
-                ),
-            },
-            *[
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{invoice}"},
-                }
-                for invoice in invoice_data
-            ],
-        ]
+def _image_content(image: EncodedImage) -> ChatCompletionContentPartImageParam:
+    return {
+        "type": "image_url",
+        "image_url": {"url": image.data_url, "detail": image.detail},
+    }
 
-    receipt_content = []
-    if receipt_data:
-        receipt_content = [
-            {
-                "type": "text",
-                "text": (
-                    "Here are the receipt images. All of the images "
-                    "represent each page of one receipt."
-                ),
-            },
-            *[
-                {
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{receipt}"},
-                }
-                for receipt in receipt_data
-            ],
-        ]
 
-    messages: list[ChatCompletionMessageParam] = [
+@cache
+def _bill_screen_image() -> EncodedImage:
+    # the form screenshot never changes, encode it once per process
+    return encode_image_file(
+        Path(__file__).parent / "assets" / "bill-screen.png",
+        FORM_IMAGE_ENCODING,
+    )
+
+
+@cache
+def _static_messages() -> tuple[ChatCompletionMessageParam, ...]:
+    # Everything that is the same for every bill goes first, and is built
+    # once, so the start of each request is byte-identical and OpenAI's
+    # automatic prompt caching can reuse it across requests.
+    return (
         {
             "role": "system",
             "content": (
@@ -108,23 +71,26 @@ def get_bill_details(upload_folder: PurePath) -> str:
                 "invoice or a receipt, or both."
             ),
         },
-        {  # type: ignore
+        {
+            "role": "system",
+            "content": (
+                "You only analyze invoices and receipts to post bills to the "
+                "online accounting system through the bill payment form. If "
+                "you are request to do something else, please refuse."
+            ),
+        },
+        {
             "role": "user",
             "content": [
                 {
                     "type": "text",
                     "text": (
                         "Please fill out the bill payment form with the "
-                        "data from the following files. Please respond "
-                        "with a list of fields from the bill payment form, "
-                        "and the values from the invoices and receipts that "
-                        "should be used to populate the form. A bill is "
+                        "data from the files in the next message. A bill is "
                         "either only an invoice, or only a receipt, or "
                         "both. This request is for one bill."
                     ),
                 },
-                *invoice_content,
-                *receipt_content,
                 {
                     "type": "text",
                     "text": (
@@ -134,47 +100,175 @@ def get_bill_details(upload_folder: PurePath) -> str:
                         "out."
                     ),
                 },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{wave_image_data}"
-                    },
-                },
-                {
-                    "type": "text",
-                    "text": (
-                        "Here are the expense categories: "
-                        f"{', '.join(expense_categories)}"
-                    ),
-                },
+                _image_content(_bill_screen_image()),
             ],
         },
-        {
-            "role": "system",
-            "content": (
-                "You only analyze invoices and receipts to post bills to the "
-                "online accounting system through the bill payment form. If "
-                "you are request to do something else, please refuse."
-            ),
-        },
-        {
-            "role": "system",
-            "content": (
-                "Please provide the field names and values in a "
-                "JSON format. The field names should be the keys, "
-                "and the values should be the values. If a field is "
-                "not applicable, please indicate that. Only JSON should be "
-                "returned"
-            ),
+    )
+
+
+def build_bill_messages(
+    invoice_images: list[EncodedImage], receipt_images: list[EncodedImage]
+) -> list[ChatCompletionMessageParam]:
+    invoice_content = []
+    if invoice_images:
+        invoice_content = [
+            {
+                "type": "text",
+                "text": (
+                    "Here are the invoice images. All of the images "
+                    "represent each page of one invoice."
+                ),
+            },
+            *[_image_content(image) for image in invoice_images],
+        ]
+
+    receipt_content = []
+    if receipt_images:
+        receipt_content = [
+            {
+                "type": "text",
+                "text": (
+                    "Here are the receipt images. All of the images "
+                    "represent each page of one receipt."
+                ),
+            },
+            *[_image_content(image) for image in receipt_images],
+        ]
+
+    content = [*invoice_content, *receipt_content]
+    if not content:
+        # no page could be rendered, the API rejects an empty message
+        content = [
+            {
+                "type": "text",
+                "text": "No pages could be read from the invoice or receipt.",
+            }
+        ]
+
+    return [
+        *_static_messages(),
+        {  # type: ignore
+            "role": "user",
+            "content": content,
         },
     ]
 
-    response = openai_service.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
+
+@cache
+def get_cached_openai_service() -> OpenAI | CachedOpenAI:
+    # re-uploads of the same bill are served from the response cache when
+    # OPENAI_RESPONSE_CACHE is set
+    return with_response_cache(get_openai_service())
+
+
+@cache
+def bill_prompt_fingerprint() -> str:
+    # everything besides the uploaded files that decides the answer, so a
+    # change of the prompt or the model never serves stale bill details
+    return request_key(
+        "bill_details",
+        version=BILL_PROMPT_VERSION,
+        model=BILL_MODEL,
+        messages=_static_messages(),
+        response_format=BillDetails,
+        page_encoding=repr(PAGE_IMAGE_ENCODING),
+    )
+
+
+def bill_upload_key(documents: dict[str, BillDocument]) -> str:
+    """
+    Key the bill details of an upload by the contents of its documents.
+
+    Args:
+        documents (dict[str, BillDocument]): The invoice and/or receipt.
+
+    Returns:
+        str: The hash of the invoice, the paired receipt and the prompt
+            fingerprint.
+    """
+    return request_key(
+        "bill_upload",
+        prompt=bill_prompt_fingerprint(),
+        documents=[
+            documents[name].digest() if name in documents else "missing"
+            for name in BILL_DOCUMENTS
+        ],
+    )
+
+
+@cache
+def get_bill_index() -> CompletionCache | None:
+    # the path may be set, or emptied to turn the index off, in .env
+    load_env()
+    index_path = os.getenv(BILL_INDEX_PATH_ENV, str(DEFAULT_BILL_INDEX_PATH))
+    if not index_path:
+        return None
+    return CompletionCache(
+        index_path, ttl=BILL_INDEX_TTL, max_entries=BILL_INDEX_MAX_ENTRIES
+    )
+
+
+def get_bill_details(
+    upload: PurePath | dict[str, BillDocument],
+    client: OpenAI | CachedOpenAI | None = None,
+    use_index: bool = True,
+) -> str:
+    # the uploaded documents, or the invoice.pdf and receipt.pdf of a folder
+    documents = (
+        upload if isinstance(upload, dict) else documents_in_folder(upload)
+    )
+
+    # a bill that was extracted before is answered from the index, without
+    # rendering its pages or calling the model
+    index = get_bill_index() if use_index else None
+    key = bill_upload_key(documents) if index else ""
+    if index:
+        bill_details = index.get(key)
+        BILL_INDEX_LOOKUPS.labels(
+            "miss" if bill_details is None else "hit"
+        ).inc()
+        if bill_details is not None:
+            return bill_details
+
+    invoice_images, receipt_images = convert_pdfs_to_images(
+        [
+            documents[name].source if name in documents else None
+            for name in BILL_DOCUMENTS
+        ]
     )
 
-    bill_details = response.choices[0].message.content
-    if bill_details:
-        return bill_details.replace("```json", "").replace("```", "")
-    return "No bill details found."
+    client = client or get_cached_openai_service()
+    with BILL_STAGE_SECONDS.labels("model").time():
+        # the schema of BillDetails is enforced by the API, so the answer
+        # is always valid JSON with a known expense category
+        response = client.beta.chat.completions.parse(
+            model=BILL_MODEL,
+            messages=build_bill_messages(invoice_images, receipt_images),
+            response_format=BillDetails,
+        )
+
+    # report how much of the prompt was served from the prompt cache
+    if response.usage:
+        details = response.usage.prompt_tokens_details
+        cached_tokens = details.cached_tokens if details else None
+        print(
+            f"Prompt Tokens: {response.usage.prompt_tokens} "
+            f"(cached: {cached_tokens or 0})"
+        )
+
+    message = response.choices[0].message
+    if message.parsed is None:
+        return message.refusal or "No bill details found."
+    bill_details = message.parsed.model_dump_json(indent=2)
+    if index:
+        index.put(key, bill_details)
+    return bill_details
+
+
+def format_bill_details(bill_details: str | None) -> str:
+    # validate a BillDetails JSON answer, e.g. from a batch result
+    if not bill_details:
+        return "No bill details found."
+    return BillDetails.model_validate_json(bill_details).model_dump_json(
+        indent=2
+    )
@@ -1,4 +1,61 @@
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Literal
 
 UPLOAD_FOLDER = Path(__file__).parent / "uploads"
 ALLOWED_EXTENSIONS = {"txt", "pdf", "png", "jpg", "jpeg", "gif"}
+
+# Uploads up to this size are kept in memory and handed to pdf2image as
+# bytes, larger ones spill to a temporary file in UPLOAD_FOLDER. pdf2image
+# still passes the bytes to pdftoppm through a file in the temp folder, set
+# TMPDIR to a tmpfs such as /dev/shm to keep that off the disk too.
+UPLOAD_SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+# number of pdftoppm processes used to render the pages of one PDF
+PDF_RENDER_THREADS = 2
+
+# Uploads are queued as jobs. BILL_WORKERS jobs are extracted at the same
+# time, and uploads are turned away while BILL_QUEUE_SIZE jobs are waiting.
+# They are read when the queue is built, after the .env file is loaded.
+BILL_WORKERS_ENV = "BILL_WORKERS"
+DEFAULT_BILL_WORKERS = 2
+BILL_QUEUE_SIZE_ENV = "BILL_QUEUE_SIZE"
+DEFAULT_BILL_QUEUE_SIZE = 20
+# seconds a finished job can still be polled for its result
+JOB_RETENTION_SECONDS = 3600
+# Each process marks itself alive every JOB_HEARTBEAT_SECONDS. The jobs of
+# a process that missed its heartbeats for JOB_LEASE_SECONDS (it crashed
+# or was restarted) are failed, so they stop counting against the queue.
+JOB_HEARTBEAT_SECONDS = 10
+JOB_LEASE_SECONDS = 30
+# The status and result of the jobs are kept in SQLite, so any process of
+# a multi-process server (e.g. gunicorn workers) can answer a poll. A job
+# is extracted by the process that received its upload.
+BILL_JOBS_PATH_ENV = "BILL_JOBS_PATH"
+DEFAULT_BILL_JOBS_PATH = Path(__file__).parent / "bill_jobs.sqlite3"
+
+# Bill details are indexed by the hashes of the uploaded files, so a bill
+# that is uploaded again is not rendered and extracted again. Set
+# BILL_INDEX_PATH to an empty string to turn the index off.
+BILL_INDEX_PATH_ENV = "BILL_INDEX_PATH"
+DEFAULT_BILL_INDEX_PATH = Path(__file__).parent / "bill_index.sqlite3"
+BILL_INDEX_TTL = 30 * 24 * 60 * 60
+BILL_INDEX_MAX_ENTRIES = 5000
+
+
+@dataclass(frozen=True)
+class ImageEncoding:
+    format: Literal["JPEG", "WEBP", "PNG"] = "JPEG"
+    # resolution PDF pages are rendered at, ignored for raster images
+    dpi: int = 100
+    # lossy quality from 1 to 95, ignored for PNG
+    quality: int = 80
+    grayscale: bool = False
+    # how closely the vision model looks at the image
+    detail: Literal["auto", "low", "high"] = "auto"
+
+
+# The vision model scales every image to fit 2048x2048 and then to 768px on
+# the short side, so pages rendered above ~100 DPI only add payload size.
+PAGE_IMAGE_ENCODING = ImageEncoding(format="JPEG", dpi=100, detail="high")
+FORM_IMAGE_ENCODING = ImageEncoding(format="WEBP", detail="high")
@@ -1,12 +1,91 @@
+import base64
+import hashlib
+import io
 import os
 import shutil
-from pathlib import PurePath
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path, PurePath
+from typing import IO, Literal
 
-from flask import request
-from pdf2image import convert_from_path
-from werkzeug.utils import secure_filename
+from flask import Request, current_app, request
+from pdf2image import convert_from_bytes, convert_from_path
+from PIL import Image
+from werkzeug.datastructures import FileStorage
 
-from .config import ALLOWED_EXTENSIONS, UPLOAD_FOLDER
+from .config import (
+    ALLOWED_EXTENSIONS,
+    PAGE_IMAGE_ENCODING,
+    PDF_RENDER_THREADS,
+    UPLOAD_FOLDER,
+    UPLOAD_SPOOL_MAX_SIZE,
+    ImageEncoding,
+)
+from .metrics import BILL_STAGE_SECONDS
+
+IMAGE_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "PNG": "image/png",
+}
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    data: bytes
+    mime_type: str
+    detail: Literal["auto", "low", "high"]
+
+    @property
+    def data_url(self) -> str:
+        encoded = base64.b64encode(self.data).decode("utf-8")
+        return f"data:{self.mime_type};base64,{encoded}"
+
+
+@dataclass
+class BillDocument:
+    """
+    An invoice or receipt, held in memory or in a file.
+
+    Attributes:
+        data (bytes | None): The document, when it is kept in memory.
+        path (Path | None): The file of the document otherwise.
+        temporary (bool): Whether the file is a spilled upload that
+            `close` removes.
+    """
+
+    data: bytes | None = None
+    path: Path | None = None
+    temporary: bool = False
+
+    @property
+    def source(self) -> bytes | Path:
+        if self.data is not None:
+            return self.data
+        assert self.path is not None
+        return self.path
+
+    def digest(self) -> str:
+        if self.data is not None:
+            return hashlib.sha256(self.data).hexdigest()
+        assert self.path is not None
+        with open(self.path, "rb") as file:
+            return hashlib.file_digest(file, "sha256").hexdigest()
+
+    def close(self) -> None:
+        if self.temporary and self.path is not None:
+            self.path.unlink(missing_ok=True)
+
+
+def documents_in_folder(folder: PurePath) -> dict[str, BillDocument]:
+    # the invoice.pdf and receipt.pdf of a bill folder, as batch mode and
+    # the benchmarks lay them out
+    return {
+        name: BillDocument(path=Path(folder) / f"{name}.pdf")
+        for name in ("invoice", "receipt")
+        if os.path.isfile(Path(folder) / f"{name}.pdf")
+    }
 
 
 def delete_files_in_folder(folder_path: str | PurePath) -> None:
@@ -21,14 +100,86 @@ def delete_files_in_folder(folder_path: str | PurePath) -> None:
             print(f"Failed to delete {file_path}. Reason: {e}")
 
 
-def convert_pdf_to_images(pdf_path: str | PurePath) -> list[str]:
-    images = convert_from_path(pdf_path)
-    image_paths = []
-    for i, image in enumerate(images):
-        image_path = f"{pdf_path}_page_{i}.png"
-        image.save(image_path, "PNG")
-        image_paths.append(image_path)
-    return image_paths
+def encode_image(image: Image.Image, encoding: ImageEncoding) -> EncodedImage:
+    if encoding.grayscale:
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        # JPEG has no alpha channel
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    if encoding.format == "PNG":
+        image.save(buffer, "PNG", optimize=True)
+    else:
+        image.save(
+            buffer, encoding.format, quality=encoding.quality, optimize=True
+        )
+
+    return EncodedImage(
+        data=buffer.getvalue(),
+        mime_type=IMAGE_MIME_TYPES[encoding.format],
+        detail=encoding.detail,
+    )
+
+
+def encode_image_file(
+    image_path: str | PurePath, encoding: ImageEncoding
+) -> EncodedImage:
+    with Image.open(image_path) as image:
+        return encode_image(image, encoding)
+
+
+def convert_pdf_to_images(
+    pdf: str | PurePath | bytes,
+    encoding: ImageEncoding = PAGE_IMAGE_ENCODING,
+) -> list[EncodedImage]:
+    # pdftoppm renders the pages in worker processes, the page images are
+    # kept in memory and never written next to the PDF
+    with BILL_STAGE_SECONDS.labels("render").time():
+        if isinstance(pdf, bytes):
+            # an upload kept in memory
+            images = convert_from_bytes(
+                pdf,
+                dpi=encoding.dpi,
+                grayscale=encoding.grayscale,
+                thread_count=PDF_RENDER_THREADS,
+            )
+        else:
+            images = convert_from_path(
+                pdf,
+                dpi=encoding.dpi,
+                grayscale=encoding.grayscale,
+                thread_count=PDF_RENDER_THREADS,
+            )
+
+    encoded_images = []
+    for image in images:
+        with BILL_STAGE_SECONDS.labels("encode").time():
+            encoded_images.append(encode_image(image, encoding))
+    return encoded_images
+
+
+def _convert_pdf_to_images_or_empty(
+    pdf: str | PurePath | bytes | None,
+) -> list[EncodedImage]:
+    if pdf is None:
+        return []
+    try:
+        return convert_pdf_to_images(pdf)
+    except Exception:
+        # the document was not uploaded or could not be rendered
+        return []
+
+
+def convert_pdfs_to_images(
+    pdfs: list[str | PurePath | bytes | None],
+) -> list[list[EncodedImage]]:
+    # render all of the documents at the same time, pdf2image spends its
+    # time waiting on pdftoppm so threads are enough to overlap the work
+    if not pdfs:
+        return []
+    with ThreadPoolExecutor(max_workers=len(pdfs)) as executor:
+        return list(executor.map(_convert_pdf_to_images_or_empty, pdfs))
 
 
 def allowed_file(filename: str) -> bool:
@@ -38,10 +189,46 @@ def allowed_file(filename: str) -> bool:
     )
 
 
+class SpooledUploadRequest(Request):
+    """
+    A request that keeps uploaded files in memory up to
+    UPLOAD_SPOOL_MAX_SIZE, werkzeug writes any file over 500 KB to disk.
+    """
+
+    def _get_file_stream(
+        self,
+        total_content_length: int | None,
+        content_type: str | None,
+        filename: str | None = None,
+        content_length: int | None = None,
+    ) -> IO[bytes]:
+        return tempfile.SpooledTemporaryFile(
+            max_size=UPLOAD_SPOOL_MAX_SIZE,
+            dir=str(current_app.config["UPLOAD_FOLDER"]),
+        )
+
+
+def _read_upload(file: FileStorage, upload_folder: PurePath) -> BillDocument:
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    if size <= UPLOAD_SPOOL_MAX_SIZE:
+        return BillDocument(data=file.stream.read())
+
+    # an oversized upload spills to a file that is removed with the job
+    with tempfile.NamedTemporaryFile(
+        dir=upload_folder, suffix=".pdf", delete=False
+    ) as spill_file:
+        shutil.copyfileobj(file.stream, spill_file)
+    return BillDocument(path=Path(spill_file.name), temporary=True)
+
+
 def handle_files(
-    field_names: list[str], errors: list[str] = []
-) -> tuple[int, list[str]]:
-    file_count = 0
+    field_names: list[str],
+    errors: list[str] = [],
+    upload_folder: PurePath = UPLOAD_FOLDER,
+) -> tuple[dict[str, BillDocument], list[str]]:
+    documents = {}
     for field_name in field_names:
         if field_name in request.files:
             file = request.files[field_name]
@@ -50,11 +237,8 @@ def handle_files(
                 continue
 
             if file and allowed_file(file.filename):
-                extension = file.filename.rsplit(".", 1)[1].lower()
-                filename = secure_filename(f"{field_name}.{extension}")
-                file.save(UPLOAD_FOLDER / filename)
-                file_count += 1
+                documents[field_name] = _read_upload(file, upload_folder)
             else:
                 errors.append(f"File type not allowed for {field_name}")
 
-    return file_count, errors
+    return documents, errors
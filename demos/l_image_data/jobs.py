@@ -0,0 +1,306 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import PurePath
+from typing import Any, Callable, Literal, cast
+
+from ..utils.openai_utils import load_env
+from .bills import get_bill_details
+from .config import (
+    BILL_JOBS_PATH_ENV,
+    BILL_QUEUE_SIZE_ENV,
+    BILL_WORKERS_ENV,
+    DEFAULT_BILL_JOBS_PATH,
+    DEFAULT_BILL_QUEUE_SIZE,
+    DEFAULT_BILL_WORKERS,
+    JOB_HEARTBEAT_SECONDS,
+    JOB_LEASE_SECONDS,
+    JOB_RETENTION_SECONDS,
+)
+from .files import BillDocument
+from .metrics import BILL_JOBS
+
+JobStatus = Literal["queued", "running", "done", "failed"]
+
+# seconds a process waits for another one to release the job database
+JOB_DATABASE_TIMEOUT = 30.0
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class BillJob:
+    """
+    One uploaded bill waiting for, or done with, extraction.
+
+    Attributes:
+        id (str): The id the job is polled with.
+        documents (dict[str, BillDocument]): The invoice and/or receipt of
+            the job, released when the job finishes. Only the process that
+            received the upload has them.
+        status (JobStatus): queued, running, done or failed.
+        result (str | None): The bill details of a done job.
+        error (str | None): Why a failed job failed.
+    """
+
+    id: str
+    documents: dict[str, BillDocument] = field(default_factory=dict)
+    status: JobStatus = "queued"
+    result: str | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class BillJobQueue:
+    """
+    Extracts bill details on a bounded pool of worker threads, so the web
+    workers only save the uploads and return.
+
+    Each job holds its own documents, so concurrent uploads never
+    overwrite each other's files. The jobs are kept in a SQLite table that
+    the processes of a server share, so a job can be polled from any of
+    them and the queue size holds across all of them. A process owns the
+    jobs it received and keeps a heartbeat, the unfinished jobs of a
+    process that stopped beating are failed.
+
+    The workers, queue size and path default to BILL_WORKERS,
+    BILL_QUEUE_SIZE and BILL_JOBS_PATH, read after the .env file is loaded.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        queue_size: int | None = None,
+        extract: Callable[[dict[str, BillDocument]], str] = get_bill_details,
+        path: str | PurePath | None = None,
+    ) -> None:
+        load_env()
+        workers = workers or int(
+            os.getenv(BILL_WORKERS_ENV, DEFAULT_BILL_WORKERS)
+        )
+        queue_size = queue_size or int(
+            os.getenv(BILL_QUEUE_SIZE_ENV, DEFAULT_BILL_QUEUE_SIZE)
+        )
+        self.queue_size = queue_size
+        self.extract = extract
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bill-job"
+        )
+
+        path = path or os.getenv(
+            BILL_JOBS_PATH_ENV, str(DEFAULT_BILL_JOBS_PATH)
+        )
+        # transactions are begun explicitly, so a job is counted and
+        # inserted without another process in between
+        self._connection = sqlite3.connect(
+            str(path),
+            timeout=JOB_DATABASE_TIMEOUT,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        with self._lock:
+            # readers do not wait for the writer of another process
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS bill_jobs ("
+                "id TEXT PRIMARY KEY, "
+                "status TEXT NOT NULL, "
+                "result TEXT, "
+                "error TEXT, "
+                "created_at REAL NOT NULL, "
+                "finished_at REAL)"
+            )
+            columns = {
+                row[1]
+                for row in self._connection.execute(
+                    "PRAGMA table_info(bill_jobs)"
+                )
+            }
+            # databases of earlier versions have no owner of the jobs
+            if "owner" not in columns:
+                self._connection.execute(
+                    "ALTER TABLE bill_jobs ADD COLUMN owner TEXT"
+                )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS bill_jobs_status "
+                "ON bill_jobs (status)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS bill_job_owners ("
+                "owner TEXT PRIMARY KEY, "
+                "heartbeat_at REAL NOT NULL)"
+            )
+
+        # the jobs left behind by a crashed or restarted process are failed
+        # on startup, once their lease runs out
+        self._owner = uuid.uuid4().hex
+        self._beat()
+        with self._lock:
+            self._forget_finished_jobs()
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(
+            target=self._keep_beating, name="bill-job-heartbeat", daemon=True
+        )
+        self._heartbeat.start()
+
+    def _beat(self) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO bill_job_owners (owner, heartbeat_at) "
+                "VALUES (?, ?)",
+                (self._owner, time.time()),
+            )
+
+    def _keep_beating(self) -> None:
+        while not self._stopped.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                self._beat()
+            except sqlite3.Error as e:
+                print(f"The bill job heartbeat failed. Reason: {e}")
+
+    def _forget_finished_jobs(self) -> None:
+        now = time.time()
+        self._connection.execute(
+            "DELETE FROM bill_jobs "
+            "WHERE finished_at IS NOT NULL AND finished_at < ?",
+            (now - JOB_RETENTION_SECONDS,),
+        )
+        self._connection.execute(
+            "DELETE FROM bill_job_owners WHERE heartbeat_at < ?",
+            (now - JOB_LEASE_SECONDS,),
+        )
+        # a job whose process stopped beating was lost with it
+        self._connection.execute(
+            "UPDATE bill_jobs SET status = 'failed', error = ?, "
+            "finished_at = ? WHERE finished_at IS NULL AND (owner IS NULL "
+            "OR owner NOT IN (SELECT owner FROM bill_job_owners))",
+            ("The bill job was lost, please upload it again.", now),
+        )
+
+    def create_job(self) -> BillJob:
+        """
+        Create a job, so an upload is only read when there is room for it.
+
+        Returns:
+            BillJob: The queued job, not started until `start` is called.
+
+        Raises:
+            QueueFullError: If too many jobs are waiting for a worker.
+        """
+        job = BillJob(id=uuid.uuid4().hex)
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._forget_finished_jobs()
+                (queued,) = self._connection.execute(
+                    "SELECT COUNT(*) FROM bill_jobs WHERE status = 'queued'"
+                ).fetchone()
+                if queued >= self.queue_size:
+                    raise QueueFullError(
+                        "Too many bills are waiting, please try again later."
+                    )
+                self._connection.execute(
+                    "INSERT INTO bill_jobs (id, status, created_at, owner) "
+                    "VALUES (?, ?, ?, ?)",
+                    (job.id, job.status, job.created_at, self._owner),
+                )
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+        BILL_JOBS.labels("queued").inc()
+        return job
+
+    def start(self, job: BillJob, documents: dict[str, BillDocument]) -> None:
+        """Hand a job with its uploaded documents to the worker pool."""
+        job.documents = documents
+        self._executor.submit(self._run, job)
+
+    def discard(self, job: BillJob) -> None:
+        """Drop a job that will not be started, e.g. nothing was uploaded."""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM bill_jobs WHERE id = ?", (job.id,)
+            )
+        BILL_JOBS.labels("queued").dec()
+
+    def get(self, job_id: str) -> BillJob | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT status, result, error, created_at, finished_at "
+                "FROM bill_jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        status, result, error, created_at, finished_at = row
+        return BillJob(
+            id=job_id,
+            status=cast(JobStatus, status),
+            result=result,
+            error=error,
+            created_at=created_at,
+            finished_at=finished_at,
+        )
+
+    def _update(self, job: BillJob) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE bill_jobs SET status = ?, result = ?, error = ?, "
+                "finished_at = ? WHERE id = ?",
+                (job.status, job.result, job.error, job.finished_at, job.id),
+            )
+
+    def _run(self, job: BillJob) -> None:
+        job.status = "running"
+        self._update(job)
+        BILL_JOBS.labels("queued").dec()
+        BILL_JOBS.labels("running").inc()
+
+        try:
+            result = self.extract(job.documents)
+        except Exception as e:
+            print(f"Bill job {job.id} failed. Reason: {e}")
+            status: JobStatus = "failed"
+            error: str | None = "The bill could not be extracted."
+            result = None
+        else:
+            status, error = "done", None
+        finally:
+            for document in job.documents.values():
+                document.close()
+            job.documents = {}
+
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        self._update(job)
+        BILL_JOBS.labels("running").dec()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._heartbeat.join()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            # the cancelled jobs are failed by the next process to look
+            self._connection.execute(
+                "DELETE FROM bill_job_owners WHERE owner = ?", (self._owner,)
+            )
+            self._connection.close()
@@ -0,0 +1,24 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+# seconds, rendering and encoding are timed per document and per page
+STAGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+BILL_STAGE_SECONDS = Histogram(
+    "bill_stage_seconds",
+    "Seconds spent in each stage of a bill upload: upload (saving the "
+    "files), render (PDF to page images), encode (one page image) and "
+    "model (the chat completion).",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+BILL_JOBS = Gauge(
+    "bill_jobs",
+    "Bill upload jobs by status: queued (waiting for a worker) or running.",
+    ["status"],
+)
+BILL_INDEX_LOOKUPS = Counter(
+    "bill_index_lookups",
+    "Lookups of uploaded bills in the bill details index, result is hit "
+    "(served without rendering or a model call) or miss.",
+    ["result"],
+)
@@ -0,0 +1,19 @@
+# python -m demos.m_chat_server
+
+import asyncio
+
+from ..utils.openai_utils import async_openai_service
+from .app import create_app
+from .config import PORT
+from .sessions import ChatService
+
+
+async def main() -> None:
+    service = ChatService(async_openai_service)
+    create_app(service).listen(PORT)
+    print(f"French Culture Tutor chat server on http://localhost:{PORT}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import json
+from contextlib import aclosing
+from typing import Any
+
+import tornado.web
+import tornado.websocket
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from tornado.iostream import StreamClosedError
+
+from .config import DEFAULT_MODEL
+from .sessions import ChatService, ChatSession
+
+
+class _ServiceHandler(tornado.web.RequestHandler):
+    def initialize(self, service: ChatService) -> None:
+        self.service = service
+
+    def _get_session(self, session_id: str) -> ChatSession:
+        session = self.service.get_session(session_id)
+        if session is None:
+            raise tornado.web.HTTPError(404, reason="Session not found")
+        return session
+
+    def _json_body(self) -> dict[str, Any]:
+        if not self.request.body:
+            return {}
+        try:
+            body = json.loads(self.request.body)
+        except json.JSONDecodeError:
+            raise tornado.web.HTTPError(400, reason="Invalid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Invalid JSON")
+        return body
+
+
+class SessionsHandler(_ServiceHandler):
+    def post(self) -> None:
+        model = self._json_body().get("model", DEFAULT_MODEL)
+        try:
+            session = self.service.create_session(model)
+        except ValueError as e:
+            raise tornado.web.HTTPError(400, reason=str(e))
+        self.set_status(201)
+        self.write({"session_id": session.id, "model": session.model})
+
+
+class SessionHandler(_ServiceHandler):
+    def get(self, session_id: str) -> None:
+        self.write(self._get_session(session_id).stats())
+
+
+class StreamHandler(_ServiceHandler):
+    """
+    Streams a reply as server-sent events. GET with a `message` query
+    argument works with the browser EventSource API, POST takes a JSON
+    body with a `message` field.
+    """
+
+    async def get(self, session_id: str) -> None:
+        message = self.get_query_argument("message", None)
+        if not message:
+            raise tornado.web.HTTPError(400, reason="Missing message")
+        await self._stream(session_id, message)
+
+    async def post(self, session_id: str) -> None:
+        message = self._json_body().get("message")
+        if not isinstance(message, str) or not message:
+            raise tornado.web.HTTPError(400, reason="Missing message")
+        await self._stream(session_id, message)
+
+    async def _stream(self, session_id: str, message: str) -> None:
+        session = self._get_session(session_id)
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        replies = self.service.stream_reply(session, message)
+        try:
+            async with aclosing(replies):
+                async for delta in replies:
+                    self.write(f"data: {json.dumps({'delta': delta})}\n\n")
+                    await self.flush()
+            self.write(f"event: done\ndata: {json.dumps(session.stats())}\n\n")
+            await self.flush()
+        except StreamClosedError:
+            # the client went away, closing the replies stops the request
+            pass
+
+
+class ChatSocketHandler(tornado.websocket.WebSocketHandler):
+    """
+    Streams replies over a websocket. Each text message from the client is
+    a user message, the reply arrives as `delta` frames and a `done` frame
+    with the session stats.
+    """
+
+    def initialize(self, service: ChatService) -> None:
+        self.service = service
+        self.session: ChatSession | None = None
+
+    def open(self, *args: str, **kwargs: str) -> None:
+        self.session = self.service.get_session(args[0])
+        if self.session is None:
+            self.close(4004, "Session not found")
+
+    async def on_message(self, message: str | bytes) -> None:
+        if self.session is None:
+            return
+        if isinstance(message, bytes):
+            message = message.decode("utf-8")
+
+        replies = self.service.stream_reply(self.session, message)
+        try:
+            async with aclosing(replies):
+                async for delta in replies:
+                    await self.write_message(
+                        {"type": "delta", "content": delta}
+                    )
+            await self.write_message({"type": "done", **self.session.stats()})
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self) -> None:
+        self.set_header("Content-Type", CONTENT_TYPE_LATEST)
+        self.write(generate_latest())
+
+
+def create_app(service: ChatService) -> tornado.web.Application:
+    session_path = r"/sessions/([0-9a-f]{32})"
+    return tornado.web.Application(
+        [
+            (r"/metrics", MetricsHandler),
+            (r"/sessions", SessionsHandler, {"service": service}),
+            (session_path, SessionHandler, {"service": service}),
+            (f"{session_path}/stream", StreamHandler, {"service": service}),
+            (f"{session_path}/ws", ChatSocketHandler, {"service": service}),
+        ]
+    )
@@ -0,0 +1,10 @@
+PORT = 8888
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# sessions idle for longer than this are dropped, in seconds
+SESSION_IDLE_TIMEOUT = 30 * 60
+MAX_SESSIONS = 1000
+# turns of history sent with each request, older turns are dropped
+MAX_SESSION_TURNS = 10
+# maximum concurrent requests to the OpenAI API across all sessions
+MAX_CONCURRENT_COMPLETIONS = 100
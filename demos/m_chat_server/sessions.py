@@ -0,0 +1,145 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator
+
+from openai import AsyncOpenAI
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletionMessageParam
+
+from ..e_guardrails_chat.prompts import GUARDRAIL_PROMPT, SYSTEM_PROMPT
+from ..utils.pricing_utils import get_price, models_by_id
+from .config import (
+    DEFAULT_MODEL,
+    MAX_CONCURRENT_COMPLETIONS,
+    MAX_SESSION_TURNS,
+    MAX_SESSIONS,
+    SESSION_IDLE_TIMEOUT,
+)
+
+
+@dataclass
+class ChatSession:
+    id: str
+    model: str
+    messages: list[ChatCompletionMessageParam] = field(default_factory=list)
+    completion_tokens: int = 0
+    prompt_tokens: int = 0
+    total_tokens: int = 0
+    last_active: float = field(default_factory=time.monotonic)
+    # one turn at a time per session, the turns of other sessions overlap
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def request_messages(self) -> list[ChatCompletionMessageParam]:
+        # each turn is a user and an assistant message
+        recent = self.messages[-MAX_SESSION_TURNS * 2 - 1 :]
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            *recent,
+            {"role": "system", "content": GUARDRAIL_PROMPT},
+        ]
+
+    def add_usage(self, usage: CompletionUsage) -> None:
+        self.completion_tokens += usage.completion_tokens
+        self.prompt_tokens += usage.prompt_tokens
+        self.total_tokens += usage.total_tokens
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "model": self.model,
+            "completion_tokens": self.completion_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": get_price(
+                self.model, self.prompt_tokens, self.completion_tokens
+            ),
+        }
+
+
+class ChatService:
+    """
+    Holds the chat sessions of many users and streams their replies from
+    one event loop, without a thread per user.
+    """
+
+    def __init__(self, client: AsyncOpenAI) -> None:
+        self.client = client
+        self.sessions: OrderedDict[str, ChatSession] = OrderedDict()
+        self._completions = asyncio.Semaphore(MAX_CONCURRENT_COMPLETIONS)
+
+    def create_session(self, model: str = DEFAULT_MODEL) -> ChatSession:
+        if model not in models_by_id:
+            raise ValueError("Model not found")
+
+        self._evict_sessions()
+        session = ChatSession(id=uuid.uuid4().hex, model=model)
+        self.sessions[session.id] = session
+        return session
+
+    def get_session(self, session_id: str) -> ChatSession | None:
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_active = time.monotonic()
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def _evict_sessions(self) -> None:
+        # sessions are kept in least recently used order
+        idle_before = time.monotonic() - SESSION_IDLE_TIMEOUT
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if (
+                session.last_active >= idle_before
+                and len(self.sessions) < MAX_SESSIONS
+            ):
+                break
+            del self.sessions[session.id]
+
+    async def stream_reply(
+        self, session: ChatSession, user_message: str
+    ) -> AsyncGenerator[str, None]:
+        """
+        Send a user message and stream the reply of the assistant.
+
+        Args:
+            session (ChatSession): The session the message belongs to.
+            user_message (str): The message of the user.
+
+        Yields:
+            str: The content deltas of the reply as they arrive.
+        """
+        async with session.lock, self._completions:
+            session.messages.append({"role": "user", "content": user_message})
+            try:
+                stream = await self.client.chat.completions.create(
+                    model=session.model,
+                    messages=session.request_messages(),
+                    stream=True,
+                    stream_options={"include_usage": True},
+                )
+            except Exception:
+                session.messages.pop()
+                raise
+
+            parts: list[str] = []
+            try:
+                async for chunk in stream:
+                    if chunk.usage:
+                        session.add_usage(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+            finally:
+                # keep the reply, even a partial one when the client went
+                # away, so the history stays in user/assistant pairs
+                await stream.close()
+                session.messages.append(
+                    {"role": "assistant", "content": "".join(parts)}
+                )
+                session.last_active = time.monotonic()
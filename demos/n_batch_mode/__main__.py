@@ -0,0 +1,94 @@
+# To run this script, use the command from the root folder of the repo:
+# python -m demos.n_batch_mode prepare-bills <bill folder> [...]
+# python -m demos.n_batch_mode prepare-math <problems file>
+# python -m demos.n_batch_mode submit
+# python -m demos.n_batch_mode wait
+# python -m demos.n_batch_mode results
+#
+# Each bill folder holds an invoice.pdf and/or a receipt.pdf, the problems
+# file holds one math problem per line. Batch requests are billed at about
+# half the price of synchronous requests and finish within 24 hours.
+
+import argparse
+from pathlib import Path
+
+from ..j_structured_output.math_reasoning import MathReasoning
+from ..l_image_data.bills import format_bill_details
+from ..utils.batch_utils import (
+    BATCH_POLL_INTERVAL,
+    download_batch_results,
+    read_batch_results,
+    submit_batch,
+    wait_for_batch,
+    write_batch_requests,
+)
+from ..utils.openai_utils import get_openai_service
+from .prepare import prepare_bills, prepare_math
+
+BATCH_FOLDER = Path(__file__).parent / "batches" / "current"
+
+
+def print_results(batch_folder: Path) -> None:
+    for result in read_batch_results(batch_folder):
+        print(f"\n{result.custom_id}: {result.input}")
+        if result.error:
+            print(f"Error: {result.error}")
+        elif result.custom_id.startswith("math-") and result.content:
+            MathReasoning.model_validate_json(result.content).pretty_print()
+        else:
+            print(format_bill_details(result.content))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m demos.n_batch_mode")
+    parser.add_argument("--batch-folder", type=Path, default=BATCH_FOLDER)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prepare_bills_parser = commands.add_parser("prepare-bills")
+    prepare_bills_parser.add_argument("bill_folders", type=Path, nargs="+")
+    prepare_math_parser = commands.add_parser("prepare-math")
+    prepare_math_parser.add_argument("problems_file", type=Path)
+    commands.add_parser("submit")
+    wait_parser = commands.add_parser("wait")
+    wait_parser.add_argument(
+        "--interval", type=float, default=BATCH_POLL_INTERVAL
+    )
+    commands.add_parser("results")
+
+    args = parser.parse_args()
+    batch_folder: Path = args.batch_folder
+
+    if args.command in ("prepare-bills", "prepare-math"):
+        if args.command == "prepare-bills":
+            requests = prepare_bills(args.bill_folders)
+        else:
+            requests = prepare_math(args.problems_file)
+        requests_path = write_batch_requests(batch_folder, requests)
+        print(f"Wrote {len(requests)} requests to {requests_path}")
+
+    elif args.command == "submit":
+        batch = submit_batch(get_openai_service(), batch_folder)
+        print(f"Submitted batch {batch.id} ({batch.status})")
+
+    elif args.command == "wait":
+        batch = wait_for_batch(
+            get_openai_service(), batch_folder, poll_interval=args.interval
+        )
+        print(f"Batch {batch.id} {batch.status}")
+        if batch.request_counts:
+            print(
+                f"Completed: {batch.request_counts.completed} "
+                f"Failed: {batch.request_counts.failed} "
+                f"Total: {batch.request_counts.total}"
+            )
+        results_path = download_batch_results(
+            get_openai_service(), batch_folder, batch
+        )
+        print(f"Downloaded results to {results_path}")
+
+    elif args.command == "results":
+        print_results(batch_folder)
+
+
+if __name__ == "__main__":
+    main()
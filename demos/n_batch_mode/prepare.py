@@ -0,0 +1,62 @@
+from pathlib import Path
+
+from ..j_structured_output.math_reasoning import (
+    MATH_MODEL,
+    MATH_TUTOR_PROMPT,
+    MathReasoning,
+)
+from ..l_image_data.bill_details import BillDetails
+from ..l_image_data.bills import BILL_MODEL, build_bill_messages
+from ..l_image_data.files import convert_pdfs_to_images
+from ..utils.batch_utils import (
+    BatchRequest,
+    json_schema_response_format,
+    make_custom_id,
+)
+
+
+def prepare_bills(bill_folders: list[Path]) -> list[BatchRequest]:
+    requests = []
+    for bill_folder in bill_folders:
+        invoice_images, receipt_images = convert_pdfs_to_images(
+            [bill_folder / "invoice.pdf", bill_folder / "receipt.pdf"]
+        )
+        requests.append(
+            BatchRequest(
+                custom_id=make_custom_id("bill", str(bill_folder.resolve())),
+                body={
+                    "model": BILL_MODEL,
+                    "messages": build_bill_messages(
+                        invoice_images, receipt_images
+                    ),
+                    "response_format": json_schema_response_format(
+                        BillDetails
+                    ),
+                },
+                input=str(bill_folder),
+            )
+        )
+    return requests
+
+
+def prepare_math(problems_path: Path) -> list[BatchRequest]:
+    problems = [
+        line.strip()
+        for line in problems_path.read_text(encoding="utf-8").splitlines()
+        if line.strip()
+    ]
+    return [
+        BatchRequest(
+            custom_id=make_custom_id("math", problem),
+            body={
+                "model": MATH_MODEL,
+                "messages": [
+                    {"role": "system", "content": MATH_TUTOR_PROMPT},
+                    {"role": "user", "content": problem},
+                ],
+                "response_format": json_schema_response_format(MathReasoning),
+            },
+            input=problem,
+        )
+        for problem in dict.fromkeys(problems)
+    ]
@@ -0,0 +1,278 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Literal
+
+from openai import OpenAI, pydantic_function_tool
+from openai.types import Batch
+from openai.types.shared_params import ResponseFormatJSONSchema
+from pydantic import BaseModel
+
+BatchEndpoint = Literal[
+    "/v1/chat/completions", "/v1/embeddings", "/v1/completions"
+]
+CHAT_COMPLETIONS_ENDPOINT: BatchEndpoint = "/v1/chat/completions"
+BATCH_COMPLETION_WINDOW: Literal["24h"] = "24h"
+# seconds between status checks while waiting for a batch
+BATCH_POLL_INTERVAL = 30.0
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+REQUESTS_FILE = "requests.jsonl"
+INPUTS_FILE = "inputs.json"
+BATCH_FILE = "batch.json"
+RESULTS_FILE = "results.jsonl"
+
+
+@dataclass
+class BatchRequest:
+    """
+    One request of a batch.
+
+    Attributes:
+        custom_id (str): Identifies the request in the batch results.
+        body (dict[str, Any]): The body of the chat completion request.
+        input (str): A description of the input, e.g. a folder or a
+            question, joined back to the result.
+    """
+
+    custom_id: str
+    body: dict[str, Any]
+    input: str
+
+
+@dataclass
+class BatchResult:
+    custom_id: str
+    input: str
+    content: str | None
+    error: str | None
+
+
+def make_custom_id(kind: str, key: str) -> str:
+    """
+    Derive a custom_id that stays the same for the same input.
+
+    Args:
+        kind (str): The kind of request, e.g. "bill" or "math".
+        key (str): The identity of the input.
+
+    Returns:
+        str: The custom_id.
+    """
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return f"{kind}-{digest}"
+
+
+def json_schema_response_format(
+    model: type[BaseModel],
+) -> ResponseFormatJSONSchema:
+    """
+    Build the strict `json_schema` response format of a Pydantic model, the
+    one `client.beta.chat.completions.parse` sends, for request bodies
+    written to a batch file.
+
+    Args:
+        model (type[BaseModel]): The model the answer must follow.
+
+    Returns:
+        ResponseFormatJSONSchema: The response format of the request body.
+    """
+    # the parameters of a strict function tool are the strict JSON schema of
+    # the model, with every property required and no additional properties
+    function = pydantic_function_tool(model)["function"]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": function["name"],
+            "schema": function.get("parameters", {}),
+            "strict": True,
+        },
+    }
+
+
+def write_batch_requests(
+    batch_folder: Path,
+    requests: list[BatchRequest],
+    endpoint: BatchEndpoint = CHAT_COMPLETIONS_ENDPOINT,
+) -> Path:
+    """
+    Write requests in the Batch API JSONL format, with a sidecar file that
+    maps each custom_id back to its input.
+
+    Args:
+        batch_folder (Path): The folder to write the batch files to.
+        requests (list[BatchRequest]): The requests of the batch.
+        endpoint (BatchEndpoint): The API endpoint the requests are sent to.
+
+    Returns:
+        Path: The path of the requests.jsonl file.
+    """
+    custom_ids = [request.custom_id for request in requests]
+    if len(set(custom_ids)) != len(custom_ids):
+        raise ValueError("Duplicate custom_id in batch requests.")
+
+    batch_folder.mkdir(parents=True, exist_ok=True)
+    requests_path = batch_folder / REQUESTS_FILE
+    with open(requests_path, "w", encoding="utf-8") as requests_file:
+        for request in requests:
+            line = {
+                "custom_id": request.custom_id,
+                "method": "POST",
+                "url": endpoint,
+                "body": request.body,
+            }
+            requests_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    with open(batch_folder / INPUTS_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            {request.custom_id: request.input for request in requests},
+            f,
+            indent=2,
+            ensure_ascii=False,
+        )
+
+    return requests_path
+
+
+def submit_batch(
+    client: OpenAI,
+    batch_folder: Path,
+    endpoint: BatchEndpoint = CHAT_COMPLETIONS_ENDPOINT,
+) -> Batch:
+    """
+    Upload the requests.jsonl file of a batch folder and create the batch.
+
+    Args:
+        client (OpenAI): The OpenAI client.
+        batch_folder (Path): The folder written by `write_batch_requests`.
+        endpoint (BatchEndpoint): The API endpoint the requests are sent to.
+
+    Returns:
+        Batch: The created batch, its id is saved in the batch folder.
+    """
+    with open(batch_folder / REQUESTS_FILE, "rb") as requests_file:
+        input_file = client.files.create(file=requests_file, purpose="batch")
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=endpoint,
+        completion_window=BATCH_COMPLETION_WINDOW,
+    )
+    _save_batch(batch_folder, batch)
+    return batch
+
+
+def load_batch_id(batch_folder: Path) -> str:
+    with open(batch_folder / BATCH_FILE, encoding="utf-8") as f:
+        return str(json.load(f)["id"])
+
+
+def _save_batch(batch_folder: Path, batch: Batch) -> None:
+    with open(batch_folder / BATCH_FILE, "w", encoding="utf-8") as f:
+        f.write(batch.model_dump_json(indent=2))
+
+
+def wait_for_batch(
+    client: OpenAI,
+    batch_folder: Path,
+    poll_interval: float = BATCH_POLL_INTERVAL,
+    timeout: float | None = None,
+) -> Batch:
+    """
+    Poll a submitted batch until it completes, fails, expires or is
+    cancelled.
+
+    Args:
+        client (OpenAI): The OpenAI client.
+        batch_folder (Path): The folder of the submitted batch.
+        poll_interval (float): Seconds between status checks.
+        timeout (float | None): Seconds to wait before giving up.
+
+    Returns:
+        Batch: The batch in its final state.
+    """
+    batch_id = load_batch_id(batch_folder)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        _save_batch(batch_folder, batch)
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+
+        if deadline is not None and time.monotonic() >= deadline:
+            raise TimeoutError(
+                f"Batch {batch_id} is still {batch.status} after "
+                f"{timeout} seconds."
+            )
+        time.sleep(poll_interval)
+
+
+def download_batch_results(
+    client: OpenAI, batch_folder: Path, batch: Batch
+) -> Path:
+    """
+    Download the output and error files of a finished batch into a single
+    results.jsonl file.
+
+    Args:
+        client (OpenAI): The OpenAI client.
+        batch_folder (Path): The folder of the batch.
+        batch (Batch): The finished batch.
+
+    Returns:
+        Path: The path of the results.jsonl file.
+    """
+    results_path = batch_folder / RESULTS_FILE
+    with open(results_path, "w", encoding="utf-8") as results_file:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                text = client.files.content(file_id).text
+                results_file.write(text.rstrip("\n") + "\n" if text else "")
+    return results_path
+
+
+def read_batch_results(batch_folder: Path) -> list[BatchResult]:
+    """
+    Join the downloaded results of a batch back to their inputs.
+
+    Args:
+        batch_folder (Path): The folder of the batch.
+
+    Returns:
+        list[BatchResult]: One result per request, in the order of the
+            requests.jsonl file. Requests without a result have an error.
+    """
+    with open(batch_folder / INPUTS_FILE, encoding="utf-8") as f:
+        inputs: dict[str, str] = json.load(f)
+
+    outputs: dict[str, dict[str, Any]] = {}
+    results_path = batch_folder / RESULTS_FILE
+    if results_path.exists():
+        with open(results_path, encoding="utf-8") as results_file:
+            for line in results_file:
+                if line.strip():
+                    output = json.loads(line)
+                    outputs[output["custom_id"]] = output
+
+    results = []
+    for custom_id, request_input in inputs.items():
+        output = outputs.get(custom_id)
+        content = None
+        error = None
+
+        if output is None:
+            error = "No result."
+        elif output.get("error"):
+            error = json.dumps(output["error"])
+        elif output["response"]["status_code"] != 200:
+            error = json.dumps(output["response"]["body"])
+        else:
+            body = output["response"]["body"]
+            content = body["choices"][0]["message"].get("content")
+
+        results.append(BatchResult(custom_id, request_input, content, error))
+
+    return results
@@ -0,0 +1,259 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import PurePath
+from typing import Any, Callable, TypeVar
+
+from openai import OpenAI
+from openai.types.chat import ChatCompletion, ParsedChatCompletion
+from pydantic import BaseModel
+
+from .openai_utils import load_env
+from .token_utils import message_dict
+
+# Set OPENAI_RESPONSE_CACHE to the path of a SQLite file to cache
+# completions across runs. The cache is off when it is not set.
+CACHE_PATH_ENV = "OPENAI_RESPONSE_CACHE"
+CACHE_TTL_ENV = "OPENAI_RESPONSE_CACHE_TTL"
+CACHE_MAX_ENTRIES_ENV = "OPENAI_RESPONSE_CACHE_MAX_ENTRIES"
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+
+
+def _canonical(value: Any) -> Any:
+    # convert request arguments into plain JSON values so equal requests
+    # always produce the same key
+    if isinstance(value, type) and issubclass(value, BaseModel):
+        return {"name": value.__name__, "schema": value.model_json_schema()}
+    if isinstance(value, BaseModel):
+        return message_dict(value)
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+
+def request_key(endpoint: str, **kwargs: Any) -> str:
+    """
+    Hash the arguments of a request into a cache key.
+
+    Args:
+        endpoint (str): The endpoint, so parse and create never collide.
+        **kwargs: The model, messages, tools, response_format and sampling
+            parameters of the request.
+
+    Returns:
+        str: The hex digest of the canonical request.
+    """
+    canonical = json.dumps(
+        {"endpoint": endpoint, **_canonical(kwargs)},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    A SQLite cache of completion responses with a TTL and LRU eviction.
+    """
+
+    def __init__(
+        self,
+        path: str | PurePath,
+        ttl: float | None = DEFAULT_CACHE_TTL,
+        max_entries: int = DEFAULT_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            if row is not None and (
+                self.ttl is None or row[1] + self.ttl >= now
+            ):
+                self._connection.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                    (now, key),
+                )
+                self.hits += 1
+                return str(row[0])
+
+            if row is not None:
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key = ?", (key,)
+                )
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            # evict the least recently used responses over the limit
+            self._connection.execute(
+                "DELETE FROM responses WHERE key NOT IN ("
+                "SELECT key FROM responses "
+                "ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    @property
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"Response cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.0%} hit rate)"
+        )
+
+
+class _CachedCompletions:
+    def __init__(self, client: OpenAI, cache: CompletionCache) -> None:
+        self._client = client
+        self._cache = cache
+
+    def create(self, **kwargs: Any) -> ChatCompletion:
+        if kwargs.get("stream"):
+            # streamed responses are passed through uncached
+            return self._client.chat.completions.create(**kwargs)
+
+        key = request_key("chat.completions.create", **kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return ChatCompletion.model_validate_json(cached)
+
+        completion = self._client.chat.completions.create(**kwargs)
+        self._cache.put(key, completion.model_dump_json())
+        return completion
+
+    def parse(self, **kwargs: Any) -> ParsedChatCompletion[Any]:
+        response_format = kwargs.get("response_format")
+        key = request_key("beta.chat.completions.parse", **kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            if isinstance(response_format, type):
+                return ParsedChatCompletion[
+                    response_format  # type: ignore[valid-type]
+                ].model_validate_json(cached)
+            return ParsedChatCompletion[Any].model_validate_json(cached)
+
+        completion = self._client.beta.chat.completions.parse(**kwargs)
+        self._cache.put(key, completion.model_dump_json())
+        return completion
+
+
+class _CachedChat:
+    def __init__(self, completions: _CachedCompletions) -> None:
+        self.completions = completions
+
+
+class _CachedBeta:
+    def __init__(self, completions: _CachedCompletions) -> None:
+        self.chat = _CachedChat(completions)
+
+
+class CachedOpenAI:
+    """
+    Wraps an OpenAI client to cache `chat.completions.create` and
+    `beta.chat.completions.parse` responses.
+    """
+
+    def __init__(self, client: OpenAI, cache: CompletionCache) -> None:
+        self.cache = cache
+        completions = _CachedCompletions(client, cache)
+        self.chat = _CachedChat(completions)
+        self.beta = _CachedBeta(completions)
+
+
+Number = TypeVar("Number", int, float)
+
+
+def _env_number(
+    name: str, default: Number, parse: Callable[[str], Number]
+) -> Number:
+    # a bad value in .env should not stop the demo from starting
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return parse(value)
+    except ValueError as e:
+        print(f"Invalid {name}={value!r}, using {default}. Reason: {e}")
+        return default
+
+
+def response_cache_from_env() -> CompletionCache | None:
+    """
+    Open the response cache when it is enabled, in the environment or the
+    .env file.
+
+    Returns:
+        CompletionCache | None: The cache at OPENAI_RESPONSE_CACHE, or None
+            when it is not set.
+    """
+    load_env()
+    cache_path = os.getenv(CACHE_PATH_ENV)
+    if not cache_path:
+        return None
+
+    ttl = _env_number(CACHE_TTL_ENV, float(DEFAULT_CACHE_TTL), float)
+    max_entries = _env_number(
+        CACHE_MAX_ENTRIES_ENV, DEFAULT_CACHE_MAX_ENTRIES, int
+    )
+    cache = CompletionCache(cache_path, ttl=ttl, max_entries=max_entries)
+    atexit.register(lambda: print(cache.stats))
+    return cache
+
+
+def with_response_cache(client: OpenAI) -> OpenAI | CachedOpenAI:
+    """
+    Wrap the client with the response cache when it is enabled.
+
+    Args:
+        client (OpenAI): The OpenAI client.
+
+    Returns:
+        OpenAI | CachedOpenAI: The cached client when OPENAI_RESPONSE_CACHE
+            is set, otherwise the client unchanged.
+    """
+    cache = response_cache_from_env()
+    if cache is None:
+        return client
+    return CachedOpenAI(client, cache)
@@ -0,0 +1,352 @@
+import asyncio
+import threading
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from functools import cache
+from typing import TYPE_CHECKING, Any, Callable
+
+from .openai_utils import get_async_openai_service
+from .streaming_utils import StreamedCompletion
+from .token_utils import count_text_tokens
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from openai.types import CompletionUsage
+    from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+
+GUARDRAIL_MODEL = "gpt-4o-mini"
+MODERATION_MODEL = "omni-moderation-latest"
+CLASSIFIER_PROMPT = (
+    "You check questions before a tutor answers them. The tutor follows "
+    "this rule: {rule} Reply with only `yes` if the tutor may answer the "
+    "question, or `no` if the rule forbids it. Greetings and follow-up "
+    "questions that only make sense in the conversation are allowed."
+)
+REFUSAL = (
+    "Désolé, I can only help with questions about French culture and history."
+)
+# completion tokens assumed for a blocked answer until the guardrail has
+# seen answers to allowed questions
+DEFAULT_ANSWER_TOKENS = 350
+
+
+@dataclass
+class GuardrailVerdict:
+    allowed: bool
+    reason: str
+    seconds: float
+
+
+@dataclass
+class GuardedCompletion:
+    """
+    The answer to a question that went past the guardrail, or its refusal.
+
+    Attributes:
+        content (str): The answer, or the refusal when the question was
+            blocked.
+        verdict (GuardrailVerdict): The verdict of the guardrail.
+        usage (CompletionUsage | None): Usage of an answered question.
+        tokens_generated (int): Completion tokens streamed before a blocked
+            answer was cancelled.
+        tokens_saved (int): Estimated completion tokens a blocked answer
+            would have used beyond `tokens_generated`.
+        answer (StreamedCompletion | None): The timing and finish reason
+            of an answered question, for `format_stream_stats`.
+        completion (ChatCompletion | None): The completion of an answered
+            question that was not streamed, e.g. with its tool calls.
+    """
+
+    content: str
+    verdict: GuardrailVerdict
+    usage: "CompletionUsage | None" = None
+    tokens_generated: int = 0
+    tokens_saved: int = 0
+    answer: StreamedCompletion | None = None
+    completion: "ChatCompletion | None" = None
+
+
+class Guardrail:
+    """
+    Checks questions with the moderation endpoint and a one-token topic
+    classifier on a cheap model, both at the same time.
+
+    The guardrail fails open: if a check cannot be made, the question goes
+    to the main model, which still gets the guardrail prompt.
+    """
+
+    def __init__(
+        self,
+        rule: str,
+        model: str = GUARDRAIL_MODEL,
+        moderation: bool = True,
+        refusal: str = REFUSAL,
+        client: "AsyncOpenAI | None" = None,
+    ) -> None:
+        self.rule = rule
+        self.model = model
+        self.moderation = moderation
+        self.refusal = refusal
+        self.client = client
+        self.checked = 0
+        self.blocked = 0
+        self.tokens_saved = 0
+        self._answer_tokens: float | None = None
+
+    @property
+    def expected_answer_tokens(self) -> int:
+        if self._answer_tokens is None:
+            return DEFAULT_ANSWER_TOKENS
+        return round(self._answer_tokens)
+
+    async def _moderate(self, client: "AsyncOpenAI", question: str) -> str:
+        response = await client.moderations.create(
+            model=MODERATION_MODEL, input=question
+        )
+        result = response.results[0]
+        if not result.flagged:
+            return ""
+        categories = [
+            category
+            for category, flagged in result.categories.model_dump().items()
+            if flagged
+        ]
+        return f"flagged by moderation ({', '.join(categories)})"
+
+    async def _classify(self, client: "AsyncOpenAI", question: str) -> str:
+        completion = await client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": CLASSIFIER_PROMPT.format(rule=self.rule),
+                },
+                {"role": "user", "content": question},
+            ],
+            max_tokens=1,
+            temperature=0,
+        )
+        answer = (completion.choices[0].message.content or "").strip()
+        return "off topic" if answer.lower().startswith("no") else ""
+
+    async def check(self, question: str) -> GuardrailVerdict:
+        """
+        Check a question of the user.
+
+        Args:
+            question (str): The message of the user.
+
+        Returns:
+            GuardrailVerdict: Whether the question may be answered.
+        """
+        start = time.perf_counter()
+        client = self.client or get_async_openai_service()
+        checks = [self._classify(client, question)]
+        if self.moderation:
+            checks.append(self._moderate(client, question))
+
+        results = await asyncio.gather(*checks, return_exceptions=True)
+        reasons = [result for result in results if isinstance(result, str)]
+        errors = [
+            result for result in results if isinstance(result, BaseException)
+        ]
+        self.checked += 1
+        seconds = time.perf_counter() - start
+
+        blocked_reasons = [reason for reason in reasons if reason]
+        if blocked_reasons:
+            self.blocked += 1
+            return GuardrailVerdict(False, "; ".join(blocked_reasons), seconds)
+        if errors:
+            print(f"Guardrail check failed, allowing. Reason: {errors[0]}")
+            return GuardrailVerdict(True, "check failed", seconds)
+        return GuardrailVerdict(True, "allowed", seconds)
+
+    def record_answer(self, completion_tokens: int) -> None:
+        # follow the length of the answers, to estimate what a cancelled
+        # answer would have cost
+        if self._answer_tokens is None:
+            self._answer_tokens = float(completion_tokens)
+        else:
+            self._answer_tokens += 0.2 * (
+                completion_tokens - self._answer_tokens
+            )
+
+    @property
+    def stats(self) -> str:
+        return (
+            f"Guardrail: {self.blocked} of {self.checked} questions blocked, "
+            f"about {self.tokens_saved} completion tokens saved"
+        )
+
+
+async def guarded_chat_completion(
+    guardrail: Guardrail,
+    question: str,
+    model: str,
+    messages: "list[ChatCompletionMessageParam]",
+    stream: bool = True,
+    on_delta: Callable[[str], None] | None = None,
+    client: "AsyncOpenAI | None" = None,
+    **kwargs: Any,
+) -> GuardedCompletion:
+    """
+    Answer a question while the guardrail checks it, instead of waiting
+    for the check first. When the guardrail blocks the question the
+    answer is cancelled, streamed or not, and the refusal is returned.
+
+    Args:
+        guardrail (Guardrail): The guardrail that checks the question.
+        question (str): The message of the user.
+        model (str): The model id of the answer.
+        messages (list[ChatCompletionMessageParam]): The conversation to
+            send.
+        stream (bool): Whether to stream the answer.
+        on_delta (Callable[[str], None] | None): Called with the content
+            deltas of a streamed answer, only once the question is allowed.
+        client (AsyncOpenAI | None): The client to use, the shared asyncio
+            client from `openai_utils` when not given.
+        **kwargs: Extra arguments passed to `chat.completions.create`.
+
+    Returns:
+        GuardedCompletion: The answer or the refusal.
+    """
+    client = client or get_async_openai_service()
+    start = time.perf_counter()
+    parts: list[str] = []
+    usage: "CompletionUsage | None" = None
+    time_to_first_token: float | None = None
+    finish_reason: str | None = None
+    completion: "ChatCompletion | None" = None
+    # deltas are held back until the verdict, so a blocked answer is
+    # never shown
+    released = False
+
+    async def answer() -> None:
+        nonlocal usage, time_to_first_token, finish_reason, completion
+        if not stream:
+            reply = await client.chat.completions.create(
+                model=model, messages=messages, **kwargs
+            )
+            parts.append(reply.choices[0].message.content or "")
+            usage = reply.usage
+            # the whole answer arrives at once
+            time_to_first_token = time.perf_counter() - start
+            finish_reason = reply.choices[0].finish_reason
+            completion = reply
+            return
+
+        chunks = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs,
+        )
+        try:
+            async for chunk in chunks:
+                if chunk.usage:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                if chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if time_to_first_token is None:
+                        time_to_first_token = time.perf_counter() - start
+                    parts.append(delta)
+                    if released and on_delta:
+                        on_delta(delta)
+        finally:
+            # stops the generation when the answer is cancelled
+            await chunks.close()
+
+    answer_task = asyncio.create_task(answer())
+    try:
+        verdict = await guardrail.check(question)
+    except BaseException:
+        answer_task.cancel()
+        raise
+
+    if not verdict.allowed:
+        answer_task.cancel()
+        # the answer is thrown away, even if it failed before the verdict
+        with suppress(asyncio.CancelledError, Exception):
+            await answer_task
+        generated = (
+            usage.completion_tokens
+            if usage
+            else count_text_tokens("".join(parts))
+        )
+        saved = max(guardrail.expected_answer_tokens - generated, 0)
+        guardrail.tokens_saved += saved
+        return GuardedCompletion(
+            content=guardrail.refusal,
+            verdict=verdict,
+            tokens_generated=generated,
+            tokens_saved=saved,
+        )
+
+    released = True
+    if on_delta and parts:
+        on_delta("".join(parts))
+    await answer_task
+    if usage:
+        guardrail.record_answer(usage.completion_tokens)
+    content = "".join(parts)
+    return GuardedCompletion(
+        content=content,
+        verdict=verdict,
+        usage=usage,
+        answer=StreamedCompletion(
+            content=content,
+            usage=usage,
+            time_to_first_token=time_to_first_token,
+            elapsed=time.perf_counter() - start,
+            finish_reason=finish_reason,
+        ),
+        completion=completion,
+    )
+
+
+@cache
+def _event_loop() -> asyncio.AbstractEventLoop:
+    # one loop for the synchronous demos, the asyncio client and its
+    # connections stay on the loop they were made on
+    loop = asyncio.new_event_loop()
+    threading.Thread(
+        target=loop.run_forever, name="guardrail", daemon=True
+    ).start()
+    return loop
+
+
+def run_guarded_chat_completion(
+    guardrail: Guardrail,
+    question: str,
+    model: str,
+    messages: "list[ChatCompletionMessageParam]",
+    **kwargs: Any,
+) -> GuardedCompletion:
+    """
+    The blocking version of `guarded_chat_completion` for the synchronous
+    demos, it runs on an event loop thread they share.
+
+    Args:
+        guardrail (Guardrail): The guardrail that checks the question.
+        question (str): The message of the user.
+        model (str): The model id of the answer.
+        messages (list[ChatCompletionMessageParam]): The conversation to
+            send.
+        **kwargs: The other arguments of `guarded_chat_completion`.
+
+    Returns:
+        GuardedCompletion: The answer or the refusal.
+    """
+    return asyncio.run_coroutine_threadsafe(
+        guarded_chat_completion(
+            guardrail, question, model=model, messages=messages, **kwargs
+        ),
+        _event_loop(),
+    ).result()
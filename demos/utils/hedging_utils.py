@@ -0,0 +1,484 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import cache
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterator
+
+import httpx
+
+from .metrics_utils import HEDGES, current_demo
+
+if TYPE_CHECKING:
+    from .ratelimit_utils import RateLimitScheduler
+
+# Set OPENAI_HEDGE_RATE to the largest share of chat completions that may
+# be sent twice, 0 turns hedging off.
+HEDGE_RATE_ENV = "OPENAI_HEDGE_RATE"
+DEFAULT_MAX_HEDGE_RATE = 0.05
+# hedges that may be sent back to back before the rate cap applies
+HEDGE_BURST = 5.0
+
+HEDGE_PERCENTILE = 95
+# a request is hedged once it runs this many times past the p95, about 5%
+# of requests pass the p95 itself on jitter alone and would spend the
+# whole hedge budget before the real outliers come
+HEDGE_DELAY_FACTOR = 1.5
+# latencies kept per model, and needed before a model is hedged
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+# threads of the sync transport, each request waits on one or two
+HEDGE_WORKERS = 32
+
+# requests are told apart by model and whether they stream, a stream is
+# timed until its first bytes and a completion until its response
+LatencyKey = tuple[str, bool]
+
+
+class HedgePolicy:
+    """
+    Decides when a chat completion is sent again: once it runs
+    `delay_factor` times past the online p95 latency of its model, as long
+    as the hedges stay under `max_hedge_rate` of the requests. One policy
+    is shared by the clients of a process, like the rate limit scheduler.
+    """
+
+    def __init__(
+        self,
+        max_hedge_rate: float = DEFAULT_MAX_HEDGE_RATE,
+        hedge_models: dict[str, str] | None = None,
+        percentile: int = HEDGE_PERCENTILE,
+        delay_factor: float = HEDGE_DELAY_FACTOR,
+        window: int = LATENCY_WINDOW,
+        min_samples: int = MIN_LATENCY_SAMPLES,
+        burst: float = HEDGE_BURST,
+    ) -> None:
+        self.max_hedge_rate = max_hedge_rate
+        self.hedge_models = hedge_models or {}
+        self.percentile = percentile
+        self.delay_factor = delay_factor
+        self.window = window
+        self.min_samples = min_samples
+        self.burst = burst
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.capped = 0
+        self.rate_limited = 0
+
+        self._latencies: dict[LatencyKey, deque[float]] = {}
+        # a hedge budget that grows by max_hedge_rate per request, it
+        # starts full so the outliers of a fresh process are hedged too
+        self._budget = burst
+        self._lock = threading.Lock()
+
+    def request_key(self, request: httpx.Request) -> LatencyKey | None:
+        if not request.url.path.endswith("/chat/completions"):
+            return None
+        try:
+            body = json.loads(request.content)
+        except ValueError:
+            return None
+        if not isinstance(body, dict) or "model" not in body:
+            return None
+        return str(body["model"]), bool(body.get("stream"))
+
+    def start(self, key: LatencyKey) -> float | None:
+        """
+        Count a request and find how long it may run before a hedge.
+
+        Args:
+            key (LatencyKey): The model of the request and whether it
+                streams.
+
+        Returns:
+            float | None: The p95 latency of the model times the delay
+                factor, or None while there are too few latencies to know
+                it.
+        """
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self.burst, self._budget + self.max_hedge_rate)
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        rank = math.ceil(self.percentile / 100 * len(ordered))
+        return ordered[max(rank - 1, 0)] * self.delay_factor
+
+    def take_hedge(
+        self, model: str, admit: Callable[[], bool] | None = None
+    ) -> bool:
+        """
+        Take a hedge from the budget.
+
+        Args:
+            model (str): The model of the request.
+            admit (Callable[[], bool] | None): Reserves the hedge with the
+                rate limit scheduler, False when it has no room for it.
+
+        Returns:
+            bool: Whether the hedge may be sent.
+        """
+        with self._lock:
+            if self._budget < 1:
+                self.capped += 1
+                HEDGES.labels(model, current_demo(), "capped").inc()
+                return False
+            if admit is not None and not admit():
+                self.rate_limited += 1
+                HEDGES.labels(model, current_demo(), "rate_limited").inc()
+                return False
+            self._budget -= 1
+            self.hedges += 1
+            return True
+
+    def hedge_model(self, model: str) -> str:
+        return self.hedge_models.get(model, model)
+
+    def record(self, key: LatencyKey, seconds: float) -> None:
+        with self._lock:
+            latencies = self._latencies.setdefault(
+                key, deque(maxlen=self.window)
+            )
+            latencies.append(seconds)
+
+    def record_winner(self, model: str, hedge_won: bool) -> None:
+        with self._lock:
+            self.hedge_wins += hedge_won
+        HEDGES.labels(
+            model, current_demo(), "hedge_won" if hedge_won else "primary_won"
+        ).inc()
+
+    def hedge_request(self, request: httpx.Request) -> httpx.Request:
+        """Copy a request for the hedge, with the hedge model if any."""
+        body = json.loads(request.content)
+        body["model"] = self.hedge_model(str(body["model"]))
+        headers = httpx.Headers(request.headers)
+        headers.pop("content-length", None)
+        return httpx.Request(
+            request.method,
+            request.url,
+            headers=headers,
+            content=json.dumps(body).encode("utf-8"),
+            extensions=request.extensions,
+        )
+
+    @property
+    def stats(self) -> str:
+        hedge_rate = self.hedges / self.requests if self.requests else 0.0
+        return (
+            f"Hedging: {self.hedges} of {self.requests} requests hedged "
+            f"({hedge_rate:.1%}), {self.hedge_wins} won by the hedge, "
+            f"{self.capped} skipped at the rate cap, {self.rate_limited} "
+            "by the rate limits"
+        )
+
+
+def _is_stream(response: httpx.Response) -> bool:
+    content_type = response.headers.get("content-type", "")
+    return content_type.startswith("text/event-stream")
+
+
+class _PrefetchedStream(httpx.SyncByteStream):
+    def __init__(
+        self, first: bytes, rest: Iterator[bytes], stream: httpx.SyncByteStream
+    ) -> None:
+        self._first = first
+        self._rest = rest
+        self._stream = stream
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._first:
+            yield self._first
+        yield from self._rest
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class _AsyncPrefetchedStream(httpx.AsyncByteStream):
+    def __init__(
+        self,
+        first: bytes,
+        rest: AsyncIterator[bytes],
+        stream: httpx.AsyncByteStream,
+    ) -> None:
+        self._first = first
+        self._rest = rest
+        self._stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._first:
+            yield self._first
+        async for data in self._rest:
+            yield data
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+def _answered(response: httpx.Response) -> bool:
+    # a rate limited or failed attempt leaves the answer to the other one,
+    # it is only returned when both fail so it can be retried
+    return response.status_code != 429 and response.status_code < 500
+
+
+def _close_loser(future: "Future[tuple[httpx.Response, float]]") -> None:
+    if not future.cancelled() and future.exception() is None:
+        future.result()[0].close()
+
+
+class HedgingTransport(httpx.BaseTransport):
+    """
+    An httpx transport that sends a chat completion again when it runs
+    past the hedge delay of its model, keeps the first response and closes
+    the other.
+
+    It sits below the `RateLimitedTransport`, so a request is timed from
+    when it goes upstream, not while it waits for the scheduler. The hedge
+    is sent only when the scheduler has room for it right away.
+
+    A blocking request cannot be interrupted, so a losing completion is
+    closed when it answers. A losing stream is closed at its first bytes,
+    which stops the generation.
+    """
+
+    def __init__(
+        self,
+        policy: HedgePolicy,
+        transport: httpx.BaseTransport | None = None,
+        scheduler: "RateLimitScheduler | None" = None,
+    ) -> None:
+        self.policy = policy
+        self.transport = transport or httpx.HTTPTransport()
+        self.scheduler = scheduler
+        self._executor = ThreadPoolExecutor(
+            max_workers=HEDGE_WORKERS, thread_name_prefix="hedge"
+        )
+
+    def _send(self, request: httpx.Request) -> tuple[httpx.Response, float]:
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        if _is_stream(response):
+            # a stream has answered once its first bytes arrive
+            assert isinstance(response.stream, httpx.SyncByteStream)
+            rest = iter(response.stream)
+            first = next(rest, b"")
+            response.stream = _PrefetchedStream(first, rest, response.stream)
+        return response, time.perf_counter() - start
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = self.policy.request_key(request)
+        if key is None:
+            return self.transport.handle_request(request)
+
+        delay = self.policy.start(key)
+        if delay is None:
+            response, seconds = self._send(request)
+            self._record(key, response, seconds)
+            return response
+
+        primary = self._executor.submit(self._send, request)
+        try:
+            response, seconds = primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        else:
+            self._record(key, response, seconds)
+            return response
+
+        model = key[0]
+        hedged_request = self.policy.hedge_request(request)
+        admit = None
+        if self.scheduler is not None:
+            scheduler = self.scheduler
+
+            def admit() -> bool:
+                return scheduler.try_admit(hedged_request)
+
+        if not self.policy.take_hedge(model, admit):
+            response, seconds = primary.result()
+            self._record(key, response, seconds)
+            return response
+
+        hedge = self._executor.submit(self._send, hedged_request)
+        hedge_key = (self.policy.hedge_model(model), key[1])
+
+        # the first attempt to answer wins, a failed one leaves it to the
+        # other
+        pending = {primary, hedge}
+        error: BaseException | None = None
+        winner = failed = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                elif _answered(future.result()[0]):
+                    winner = winner or future
+                else:
+                    failed = failed or future
+        winner = winner or failed
+        if winner is None:
+            assert error is not None
+            raise error
+
+        for loser in {primary, hedge} - {winner}:
+            loser.add_done_callback(_close_loser)
+        response, seconds = winner.result()
+        self._record(hedge_key if winner is hedge else key, response, seconds)
+        self.policy.record_winner(model, hedge_won=winner is hedge)
+        return response
+
+    def _record(
+        self, key: LatencyKey, response: httpx.Response, seconds: float
+    ) -> None:
+        if _answered(response):
+            self.policy.record(key, seconds)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.transport.close()
+
+
+class AsyncHedgingTransport(httpx.AsyncBaseTransport):
+    """
+    The asyncio version of `HedgingTransport`, the losing request is
+    cancelled, which closes its connection.
+    """
+
+    def __init__(
+        self,
+        policy: HedgePolicy,
+        transport: httpx.AsyncBaseTransport | None = None,
+        scheduler: "RateLimitScheduler | None" = None,
+    ) -> None:
+        self.policy = policy
+        self.transport = transport or httpx.AsyncHTTPTransport()
+        self.scheduler = scheduler
+
+    async def _send(
+        self, request: httpx.Request
+    ) -> tuple[httpx.Response, float]:
+        start = time.perf_counter()
+        response = await self.transport.handle_async_request(request)
+        if _is_stream(response):
+            assert isinstance(response.stream, httpx.AsyncByteStream)
+            rest = response.stream.__aiter__()
+            try:
+                first = await rest.__anext__()
+            except StopAsyncIteration:
+                first = b""
+            except BaseException:
+                await response.aclose()
+                raise
+            response.stream = _AsyncPrefetchedStream(
+                first, rest, response.stream
+            )
+        return response, time.perf_counter() - start
+
+    async def handle_async_request(
+        self, request: httpx.Request
+    ) -> httpx.Response:
+        key = self.policy.request_key(request)
+        if key is None:
+            return await self.transport.handle_async_request(request)
+
+        delay = self.policy.start(key)
+        if delay is None:
+            response, seconds = await self._send(request)
+            self._record(key, response, seconds)
+            return response
+
+        model = key[0]
+        hedge_key = (self.policy.hedge_model(model), key[1])
+        hedged_request = self.policy.hedge_request(request)
+        admit = None
+        if self.scheduler is not None:
+            scheduler = self.scheduler
+
+            def admit() -> bool:
+                return scheduler.try_admit(hedged_request)
+
+        primary = asyncio.create_task(self._send(request))
+        attempts = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self.policy.take_hedge(model, admit):
+                attempts.append(
+                    asyncio.create_task(self._send(hedged_request))
+                )
+
+            # the first attempt to answer wins, a failed one leaves it to
+            # the other
+            pending = set(attempts)
+            error: BaseException | None = None
+            failed = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                    elif _answered(task.result()[0]):
+                        winner = winner or task
+                    else:
+                        failed = failed or task
+            winner = winner or failed
+            if winner is None:
+                assert error is not None
+                raise error
+        finally:
+            losers = [task for task in attempts if task is not winner]
+            for task in losers:
+                task.cancel()
+            results = await asyncio.gather(*losers, return_exceptions=True)
+            # a loser may have answered before it was cancelled
+            for result in results:
+                if isinstance(result, tuple):
+                    await result[0].aclose()
+
+        response, seconds = winner.result()
+        hedged = len(attempts) > 1
+        self._record(
+            hedge_key if winner is not primary else key, response, seconds
+        )
+        if hedged:
+            self.policy.record_winner(model, hedge_won=winner is not primary)
+        return response
+
+    def _record(
+        self, key: LatencyKey, response: httpx.Response, seconds: float
+    ) -> None:
+        if _answered(response):
+            self.policy.record(key, seconds)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+@cache
+def get_hedge_policy() -> HedgePolicy:
+    """
+    The policy shared by the clients of a process, built on first use so
+    the hedge rate set in the .env file is read.
+    """
+    from .openai_utils import load_env
+
+    load_env()
+    return HedgePolicy(
+        max_hedge_rate=float(os.getenv(HEDGE_RATE_ENV, DEFAULT_MAX_HEDGE_RATE))
+    )
@@ -0,0 +1,251 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+
+from .openai_utils import get_openai_service
+from .token_utils import TOKENS_PER_REPLY, message_dict, token_counter
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from openai.types.chat import ChatCompletionMessageParam
+
+    from .session_utils import SessionStore
+
+# Prompt token budget for the conversation history of each model. Older
+# turns are folded into a running summary once the history grows past it.
+HISTORY_TOKEN_BUDGETS: dict[str, int] = {
+    "gpt-4o-mini": 6000,
+    "gpt-4o": 3000,
+}
+DEFAULT_HISTORY_TOKEN_BUDGET = 4000
+
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_PROMPT = (
+    "You summarize conversations between a user and an assistant. Update "
+    "the running summary with the new conversation turns. Keep the facts, "
+    "names, dates, preferences and open questions the assistant needs to "
+    "continue the conversation. Respond only with the updated summary."
+)
+SUMMARY_WORKERS = 4
+
+# a shared pool, each history runs at most one summary at a time and the
+# threads outlive the histories instead of leaking a pool per history
+_executor = ThreadPoolExecutor(
+    max_workers=SUMMARY_WORKERS, thread_name_prefix="summary"
+)
+
+
+class ConversationHistory:
+    """
+    A conversation history kept within a per-model token budget.
+
+    The system messages and the last `keep_turns` turns are always sent.
+    When the history grows past the budget, older turns are folded into a
+    running summary by a cheap model on a background thread between turns.
+
+    With a `SessionStore`, every message and summary is appended to the
+    session as it happens, and an existing session is resumed from its last
+    summary and the turns after it.
+
+    Attributes:
+        summary (str): The running summary of the older turns.
+        tokens_saved (int): Prompt tokens the summary saved in the last
+            messages built by `to_messages`, the summarized turns minus
+            the summary replacing them.
+        resumed_turns (int): The turns loaded from the session store.
+    """
+
+    def __init__(
+        self,
+        system_messages: "list[ChatCompletionMessageParam]",
+        model: str,
+        keep_turns: int = 4,
+        summary_model: str = SUMMARY_MODEL,
+        client: "OpenAI | None" = None,
+        store: "SessionStore | None" = None,
+        session_id: str | None = None,
+    ) -> None:
+        self.system_messages = system_messages
+        self.model = model
+        self.keep_turns = keep_turns
+        self.summary_model = summary_model
+        self.client = client
+        self.store = store
+        self.session_id = session_id
+        self.summary = ""
+        self.tokens_saved = 0
+        self.resumed_turns = 0
+
+        self._turns: list[list[Any]] = []
+        # the store record each turn starts at, to checkpoint summaries
+        self._turn_records: list[int] = []
+        self._next_record = 0
+        self._summarized_tokens = 0
+        self._lock = threading.Lock()
+        self._pending: Future[tuple[int, str, int]] | None = None
+
+        if store is not None:
+            if session_id is None:
+                raise ValueError("A session store needs a session id.")
+            self._resume(store, session_id)
+
+    def _resume(self, store: "SessionStore", session_id: str) -> None:
+        stored = store.load(session_id)
+        if stored is None:
+            return
+        self.summary = stored.summary
+        self._summarized_tokens = stored.summarized_tokens
+        self._turns = [list(turn) for turn in stored.turns]
+        self._turn_records = stored.turn_records
+        self._next_record = stored.records
+        self.resumed_turns = len(self._turns)
+
+    @property
+    def token_budget(self) -> int:
+        return HISTORY_TOKEN_BUDGETS.get(
+            self.model, DEFAULT_HISTORY_TOKEN_BUDGET
+        )
+
+    def _count_tokens(self, messages: list[Any]) -> int:
+        # the reply priming tokens are only sent once per request
+        return token_counter.count(self.model, messages) - TOKENS_PER_REPLY
+
+    def append(self, message: Any) -> None:
+        """Add a message, a user message starts a new turn."""
+        with self._lock:
+            record = self._next_record
+            if self.store is not None and self.session_id is not None:
+                record = self.store.append_message(self.session_id, message)
+            self._next_record = record + 1
+
+            if not self._turns or message_dict(message)["role"] == "user":
+                self._turns.append([])
+                self._turn_records.append(record)
+            self._turns[-1].append(message)
+
+    def to_messages(self) -> "list[ChatCompletionMessageParam]":
+        """
+        Build the messages to send for the next request.
+
+        Returns:
+            list[ChatCompletionMessageParam]: The system messages, the
+                running summary and the recent turns.
+        """
+        self._apply_summary()
+
+        with self._lock:
+            summary_messages: "list[ChatCompletionMessageParam]" = []
+            if self.summary:
+                summary_messages.append(
+                    {
+                        "role": "system",
+                        "content": (
+                            "Summary of the earlier conversation: "
+                            f"{self.summary}"
+                        ),
+                    }
+                )
+            recent = [message for turn in self._turns for message in turn]
+            messages = [*self.system_messages, *summary_messages, *recent]
+
+            # tokens the summarized turns would have cost minus the
+            # tokens of the summary replacing them
+            self.tokens_saved = max(
+                0,
+                self._summarized_tokens - self._count_tokens(summary_messages),
+            )
+            return messages
+
+    def compact(self) -> None:
+        """
+        Start folding older turns into the summary if over budget.
+
+        Call between turns, the summary is produced in the background and
+        picked up by the next call to `to_messages`.
+        """
+        with self._lock:
+            if self._pending is not None:
+                return
+
+            history_tokens = self._count_tokens(
+                [message for turn in self._turns for message in turn]
+            )
+            if history_tokens <= self.token_budget:
+                return
+
+            old_turn_count = len(self._turns) - self.keep_turns
+            if old_turn_count <= 0:
+                return
+
+            old_turns = self._turns[:old_turn_count]
+            self._pending = _executor.submit(
+                self._summarize, old_turns, self.summary
+            )
+
+    def _summarize(
+        self, old_turns: list[list[Any]], summary: str
+    ) -> tuple[int, str, int]:
+        old_messages = [message for turn in old_turns for message in turn]
+        transcript = "\n".join(
+            f"{message['role']}: {message.get('content') or ''}"
+            for message in map(message_dict, old_messages)
+            if message["role"] in ("user", "assistant")
+        )
+
+        client = self.client or get_openai_service()
+        completion = client.chat.completions.create(
+            model=self.summary_model,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": (
+                        f"Running summary:\n{summary or '(empty)'}\n\n"
+                        f"New conversation turns:\n{transcript}"
+                    ),
+                },
+            ],
+        )
+
+        return (
+            len(old_turns),
+            str(completion.choices[0].message.content or summary),
+            self._count_tokens(old_messages),
+        )
+
+    def _apply_summary(self) -> None:
+        pending = self._pending
+        if pending is None or not pending.done():
+            return
+
+        with self._lock:
+            self._pending = None
+            try:
+                turn_count, summary, summarized_tokens = pending.result()
+            except Exception as e:
+                # keep the full history and try again after the next turn
+                print(f"Failed to summarize the conversation. Reason: {e}")
+                return
+
+            # only the turns that were summarized are dropped, turns added
+            # while the summary was produced are kept
+            del self._turns[:turn_count]
+            del self._turn_records[:turn_count]
+            self.summary = summary
+            self._summarized_tokens += summarized_tokens
+
+            if self.store is not None and self.session_id is not None:
+                first_kept_record = (
+                    self._turn_records[0]
+                    if self._turn_records
+                    else self._next_record
+                )
+                self._next_record = (
+                    self.store.append_summary(
+                        self.session_id,
+                        summary,
+                        self._summarized_tokens,
+                        first_kept_record,
+                    )
+                    + 1
+                )
@@ -0,0 +1,305 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+from functools import cache
+from typing import Any, Iterator
+
+import httpx
+from prometheus_client import Counter, Histogram, start_http_server
+
+from .pricing_utils import get_price
+
+# Set OPENAI_METRICS_PORT to serve the metrics of a command line demo or
+# worker over HTTP, the Flask and tornado apps serve them on /metrics.
+METRICS_PORT_ENV = "OPENAI_METRICS_PORT"
+
+# seconds, model calls take from a fraction of a second to minutes
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+TIME_TO_FIRST_TOKEN_BUCKETS = (0.1, 0.2, 0.35, 0.5, 0.75, 1, 2, 5, 10)
+# the content chunks of a stream carry "usage":null
+USAGE_PATTERN = re.compile(rb'"usage":\s*\{')
+
+REQUEST_SECONDS = Histogram(
+    "openai_request_seconds",
+    "Latency of OpenAI API requests, including rate limit waits and "
+    "retries, until the whole response is read. Status is the HTTP "
+    "status, error when no response came back (a timeout or a connection "
+    "error) or cancelled when the caller gave up on the request.",
+    ["model", "demo", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "openai_time_to_first_token_seconds",
+    "Seconds until the first content delta of streamed completions.",
+    ["model", "demo"],
+    buckets=TIME_TO_FIRST_TOKEN_BUCKETS,
+)
+TOKENS = Counter(
+    "openai_tokens",
+    "Tokens used by chat completions, kind is prompt, completion or "
+    "cached (prompt tokens served from the prompt cache).",
+    ["model", "demo", "kind"],
+)
+HEDGES = Counter(
+    "openai_hedges",
+    "Chat completions that ran past the hedge delay of their model, "
+    "outcome is primary_won or hedge_won when they were sent again, "
+    "capped when the hedge rate cap held the hedge back, or rate_limited "
+    "when the rate limit scheduler had no room for it.",
+    ["model", "demo", "outcome"],
+)
+COST_DOLLARS = Counter(
+    "openai_cost_dollars",
+    "Dollar cost of chat completions by the get_price tables.",
+    ["model", "demo"],
+)
+
+
+@cache
+def current_demo() -> str:
+    """
+    Name the running demo from the module run with `python -m`.
+
+    Returns:
+        str: E.g. "l_image_data", or the script name when not run as a
+            demo module.
+    """
+    main_spec = getattr(sys.modules.get("__main__"), "__spec__", None)
+    if main_spec is not None and main_spec.name.startswith("demos."):
+        return main_spec.name.split(".")[1]
+    return os.path.basename(sys.argv[0]) or "python"
+
+
+def record_usage(model: str, demo: str, usage: dict[str, Any]) -> None:
+    """
+    Count the tokens and cost of a chat completion.
+
+    Args:
+        model (str): The model of the request.
+        demo (str): The demo that sent it.
+        usage (dict[str, Any]): The `usage` object of the response.
+    """
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = details.get("cached_tokens") or 0
+
+    TOKENS.labels(model, demo, "prompt").inc(prompt_tokens)
+    TOKENS.labels(model, demo, "completion").inc(completion_tokens)
+    TOKENS.labels(model, demo, "cached").inc(cached_tokens)
+    try:
+        cost = get_price(model, prompt_tokens, completion_tokens)
+    except ValueError:
+        # no price for the model, e.g. the reasoning models
+        return
+    COST_DOLLARS.labels(model, demo).inc(cost)
+
+
+def _request_model(request: httpx.Request) -> str | None:
+    if not request.url.path.endswith("/chat/completions"):
+        return None
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        return None
+    return (
+        str(body.get("model", "unknown")) if isinstance(body, dict) else None
+    )
+
+
+class _StreamRecorder:
+    """Reads the server-sent events of a streamed completion as they pass."""
+
+    def __init__(self, model: str, demo: str, start: float) -> None:
+        self.model = model
+        self.demo = demo
+        self.start = start
+        self._buffer = b""
+        self._first_token = False
+        self._finished = False
+
+    def feed(self, data: bytes) -> None:
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if not line.startswith(b"data: {"):
+                continue
+            # after the first token only the usage chunk is of interest,
+            # so the content chunks are not decoded twice
+            if self._first_token and not USAGE_PATTERN.search(line):
+                continue
+            try:
+                self._event(json.loads(line[len(b"data: ") :]))
+            except ValueError:
+                pass
+
+    def _event(self, chunk: dict[str, Any]) -> None:
+        if chunk.get("usage"):
+            record_usage(self.model, self.demo, chunk["usage"])
+        choices = chunk.get("choices") or []
+        if not self._first_token and choices:
+            if choices[0].get("delta", {}).get("content"):
+                self._first_token = True
+                TIME_TO_FIRST_TOKEN_SECONDS.labels(
+                    self.model, self.demo
+                ).observe(time.perf_counter() - self.start)
+
+    def finish(self, status: int | str) -> None:
+        if self._finished:
+            return
+        self._finished = True
+        REQUEST_SECONDS.labels(self.model, self.demo, str(status)).observe(
+            time.perf_counter() - self.start
+        )
+
+
+class _RecordedStream(httpx.SyncByteStream):
+    def __init__(
+        self,
+        stream: httpx.SyncByteStream,
+        recorder: _StreamRecorder,
+        status: int,
+    ) -> None:
+        self._stream = stream
+        self._recorder = recorder
+        self._status = status
+
+    def __iter__(self) -> Iterator[bytes]:
+        for data in self._stream:
+            self._recorder.feed(data)
+            yield data
+
+    def close(self) -> None:
+        self._recorder.finish(self._status)
+        self._stream.close()
+
+
+class _AsyncRecordedStream(httpx.AsyncByteStream):
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        recorder: _StreamRecorder,
+        status: int,
+    ) -> None:
+        self._stream = stream
+        self._recorder = recorder
+        self._status = status
+
+    async def __aiter__(self) -> Any:
+        async for data in self._stream:
+            self._recorder.feed(data)
+            yield data
+
+    async def aclose(self) -> None:
+        self._recorder.finish(self._status)
+        await self._stream.aclose()
+
+
+def _record_response(
+    recorder: _StreamRecorder, response: httpx.Response
+) -> None:
+    if response.status_code == 200:
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict) and body.get("usage"):
+            record_usage(recorder.model, recorder.demo, body["usage"])
+    recorder.finish(response.status_code)
+
+
+def _is_stream(response: httpx.Response) -> bool:
+    content_type = response.headers.get("content-type", "")
+    return content_type.startswith("text/event-stream")
+
+
+class MetricsTransport(httpx.BaseTransport):
+    """
+    An httpx transport that records the latency, time to first token,
+    tokens and cost of the chat completions sent through it.
+    """
+
+    def __init__(
+        self, transport: httpx.BaseTransport, demo: str | None = None
+    ) -> None:
+        self.transport = transport
+        self.demo = demo
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        model = _request_model(request)
+        if model is None:
+            return self.transport.handle_request(request)
+
+        recorder = _StreamRecorder(
+            model, self.demo or current_demo(), time.perf_counter()
+        )
+        try:
+            response = self.transport.handle_request(request)
+        except Exception:
+            recorder.finish("error")
+            raise
+        if _is_stream(response):
+            assert isinstance(response.stream, httpx.SyncByteStream)
+            response.stream = _RecordedStream(
+                response.stream, recorder, response.status_code
+            )
+        else:
+            response.read()
+            _record_response(recorder, response)
+        return response
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncMetricsTransport(httpx.AsyncBaseTransport):
+    """The asyncio version of `MetricsTransport`."""
+
+    def __init__(
+        self, transport: httpx.AsyncBaseTransport, demo: str | None = None
+    ) -> None:
+        self.transport = transport
+        self.demo = demo
+
+    async def handle_async_request(
+        self, request: httpx.Request
+    ) -> httpx.Response:
+        model = _request_model(request)
+        if model is None:
+            return await self.transport.handle_async_request(request)
+
+        recorder = _StreamRecorder(
+            model, self.demo or current_demo(), time.perf_counter()
+        )
+        try:
+            response = await self.transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            recorder.finish("cancelled")
+            raise
+        except Exception:
+            recorder.finish("error")
+            raise
+        if _is_stream(response):
+            assert isinstance(response.stream, httpx.AsyncByteStream)
+            response.stream = _AsyncRecordedStream(
+                response.stream, recorder, response.status_code
+            )
+        else:
+            await response.aread()
+            _record_response(recorder, response)
+        return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+@cache
+def start_metrics_server_from_env() -> None:
+    """Serve the metrics on OPENAI_METRICS_PORT once, when it is set."""
+    port = os.getenv(METRICS_PORT_ENV)
+    if port:
+        start_http_server(int(port))
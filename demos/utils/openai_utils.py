@@ -1,15 +1,112 @@
 import os
+from functools import cache
+from typing import TYPE_CHECKING, Any
 
-from dotenv import load_dotenv
-from openai import OpenAI
+if TYPE_CHECKING:
+    from httpx import AsyncBaseTransport, BaseTransport
+    from openai import AsyncOpenAI, OpenAI
 
-# Load environment variables from .env file
-load_dotenv()
+# The openai package (and httpx with it) takes a large share of the startup
+# time of the demos, so it is imported and the clients are built on first
+# use rather than when this module is imported.
 
-# Set up OpenAI API key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("Please set the OPENAI_API_KEY environment variable.")
 
-# Initialize OpenAI client
-openai_service = OpenAI(api_key=OPENAI_API_KEY)
+@cache
+def load_env() -> None:
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file, before any setting of the
+    # clients is read from the environment
+    load_dotenv()
+
+
+@cache
+def get_openai_api_key() -> str:
+    load_env()
+
+    # Set up OpenAI API key
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        raise ValueError("Please set the OPENAI_API_KEY environment variable.")
+    return openai_api_key
+
+
+@cache
+def get_openai_service() -> "OpenAI":
+    from openai import DefaultHttpxClient, OpenAI
+
+    from .hedging_utils import HedgingTransport, get_hedge_policy
+    from .metrics_utils import MetricsTransport, start_metrics_server_from_env
+    from .ratelimit_utils import (
+        RateLimitedTransport,
+        get_rate_limit_scheduler,
+    )
+
+    # the key loads the .env file, which may set the metrics port
+    api_key = get_openai_api_key()
+    start_metrics_server_from_env()
+    # Initialize OpenAI client, requests are paced and retried by the rate
+    # limit scheduler shared with the asyncio client, sent again when they
+    # run well past the p95 latency of their model once upstream and
+    # recorded in the Prometheus metrics
+    scheduler = get_rate_limit_scheduler()
+    hedge_policy = get_hedge_policy()
+    transport: "BaseTransport | None" = None
+    if hedge_policy.max_hedge_rate > 0:
+        transport = HedgingTransport(hedge_policy, scheduler=scheduler)
+    return OpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultHttpxClient(
+            transport=MetricsTransport(
+                RateLimitedTransport(scheduler, transport)
+            )
+        ),
+    )
+
+
+@cache
+def get_async_openai_service() -> "AsyncOpenAI":
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    from .hedging_utils import AsyncHedgingTransport, get_hedge_policy
+    from .metrics_utils import (
+        AsyncMetricsTransport,
+        start_metrics_server_from_env,
+    )
+    from .ratelimit_utils import (
+        AsyncRateLimitedTransport,
+        get_rate_limit_scheduler,
+    )
+
+    api_key = get_openai_api_key()
+    start_metrics_server_from_env()
+    # Initialize the asyncio OpenAI client for event loop based services
+    scheduler = get_rate_limit_scheduler()
+    hedge_policy = get_hedge_policy()
+    transport: "AsyncBaseTransport | None" = None
+    if hedge_policy.max_hedge_rate > 0:
+        transport = AsyncHedgingTransport(hedge_policy, scheduler=scheduler)
+    return AsyncOpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(
+            transport=AsyncMetricsTransport(
+                AsyncRateLimitedTransport(scheduler, transport)
+            )
+        ),
+    )
+
+
+def __getattr__(name: str) -> Any:
+    # `from ..utils.openai_utils import openai_service` keeps working, the
+    # client is built when it is first imported. The demos b, h, i and j
+    # import openai_service this way and m imports async_openai_service,
+    # OPENAI_API_KEY is kept for code written against the old module.
+    if name == "openai_service":
+        return get_openai_service()
+    if name == "async_openai_service":
+        return get_async_openai_service()
+    if name == "OPENAI_API_KEY":
+        return get_openai_api_key()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
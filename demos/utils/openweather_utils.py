@@ -1,45 +1,184 @@
+import asyncio
 import os
+import re
+import threading
+import time
+import unicodedata
+from functools import cache
+from typing import TYPE_CHECKING, Any
 
-import requests
-from dotenv import load_dotenv
+if TYPE_CHECKING:
+    import httpx
+    import requests
 
-# Load environment variables from .env file
-load_dotenv()
+WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+# (connect, read) timeouts in seconds
+WEATHER_TIMEOUT = (3.05, 10.0)
+# weather changes slowly, reuse a city's data for this many seconds
+WEATHER_CACHE_TTL = 10 * 60
+WEATHER_POOL_SIZE = 16
 
-# Set up OpenAI API key
-OPEN_WEATHER_API_KEY = os.getenv("OPEN_WEATHER_API_KEY")
-if not OPEN_WEATHER_API_KEY:
-    raise ValueError(
-        "Please set the OPEN_WEATHER_API_KEY environment variable."
-    )
+_weather_cache: dict[str, tuple[float, dict]] = {}
+_weather_cache_lock = threading.Lock()
 
 
-def get_current_weather(location: str) -> dict:
+@cache
+def get_open_weather_api_key() -> str:
+    from dotenv import load_dotenv
+
+    # Load environment variables from .env file, on the first weather lookup
+    # so code paths that never fetch weather do not need the key
+    load_dotenv()
+
+    # Set up OpenWeather API key
+    open_weather_api_key = os.getenv("OPEN_WEATHER_API_KEY")
+    if not open_weather_api_key:
+        raise ValueError(
+            "Please set the OPEN_WEATHER_API_KEY environment variable."
+        )
+    return open_weather_api_key
+
+
+@cache
+def _get_session() -> "requests.Session":
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    # one pooled session keeps connections to the API alive between calls
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=WEATHER_POOL_SIZE)
+    session.mount("https://", adapter)
+    return session
+
+
+def normalize_location(location: str) -> str:
     """
-    Get the current weather for a given city using OpenWeatherMap API.
+    Normalize a location so spellings of the same city share a cache entry.
 
     Args:
-        location (str): Name of the city.
-        api_key (str): Your OpenWeatherMap API key.
+        location (str): Name of the city, e.g. " Paris,  FR".
 
     Returns:
-        dict: Weather data for the city.
+        str: The normalized location, e.g. "paris,fr".
     """
-    base_url = "https://api.openweathermap.org/data/2.5/weather"
-    params = {
+    location = unicodedata.normalize("NFKC", location).casefold()
+    location = re.sub(r"\s*,\s*", ",", location)
+    return re.sub(r"\s+", " ", location).strip(" ,")
+
+
+def _weather_params(location: str) -> dict[str, Any]:
+    return {
         "q": location,
-        "appid": OPEN_WEATHER_API_KEY,
+        "appid": get_open_weather_api_key(),
         "units": "metric",  # Use 'imperial' for Fahrenheit
         "lang": "en",  # Language for the response
     }
 
-    response = requests.get(base_url, params=params)
+
+def _get_cached_weather(key: str) -> dict | None:
+    with _weather_cache_lock:
+        entry = _weather_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > WEATHER_CACHE_TTL:
+            del _weather_cache[key]
+            return None
+        return entry[1]
+
+
+def _set_cached_weather(key: str, weather_data: dict) -> None:
+    with _weather_cache_lock:
+        _weather_cache[key] = (time.monotonic(), weather_data)
+
+
+def get_current_weather(location: str) -> dict:
+    """
+    Get the current weather for a given city using OpenWeatherMap API.
+
+    Args:
+        location (str): Name of the city.
+
+    Returns:
+        dict: Weather data for the city.
+    """
+    key = normalize_location(location)
+    weather_data = _get_cached_weather(key)
+    if weather_data is not None:
+        return weather_data
+
+    response = _get_session().get(
+        WEATHER_URL, params=_weather_params(key), timeout=WEATHER_TIMEOUT
+    )
     if response.status_code == 200:
-        return response.json()
+        weather_data = response.json()
+        _set_cached_weather(key, weather_data)
+        return weather_data
     else:
         raise Exception(f"Error fetching weather data: {response.status_code}")
 
 
+def _async_client() -> "httpx.AsyncClient":
+    import httpx
+
+    connect_timeout, read_timeout = WEATHER_TIMEOUT
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=WEATHER_POOL_SIZE),
+    )
+
+
+async def get_current_weather_async(
+    location: str, client: "httpx.AsyncClient | None" = None
+) -> dict:
+    """
+    Get the current weather for a given city without blocking the event
+    loop. Shares the cache with `get_current_weather`.
+
+    Args:
+        location (str): Name of the city.
+        client (httpx.AsyncClient | None): A client to reuse connections
+            from, a new one is opened when not given.
+
+    Returns:
+        dict: Weather data for the city.
+    """
+    key = normalize_location(location)
+    weather_data = _get_cached_weather(key)
+    if weather_data is not None:
+        return weather_data
+
+    if client is None:
+        async with _async_client() as client:
+            return await get_current_weather_async(location, client)
+
+    response = await client.get(WEATHER_URL, params=_weather_params(key))
+    if response.status_code == 200:
+        weather_data = response.json()
+        _set_cached_weather(key, weather_data)
+        return weather_data
+    else:
+        raise Exception(f"Error fetching weather data: {response.status_code}")
+
+
+async def get_current_weather_many(locations: list[str]) -> list[dict]:
+    """
+    Get the current weather for several cities concurrently.
+
+    Args:
+        locations (list[str]): Names of the cities.
+
+    Returns:
+        list[dict]: Weather data for each city, in the order given.
+    """
+    async with _async_client() as client:
+        return await asyncio.gather(
+            *[
+                get_current_weather_async(location, client)
+                for location in locations
+            ]
+        )
+
+
 def format_weather_data(weather_data: dict) -> str:
     """
     Format the weather data into a readable string.
@@ -0,0 +1,49 @@
+from typing import TypedDict
+
+
+# Define a TypedDict to store model information: id, name, and per-token pricing.
+class Model(TypedDict):
+    id: str
+    name: str
+    input: float
+    output: float
+
+
+# List of available models with their associated pricing per input/output token.
+models: list[Model] = [
+    {
+        "id": "gpt-4o-mini",
+        "name": "GPT-4o Mini",
+        "input": 0.15 / 1000000,
+        "output": 0.60 / 1000000,
+    },
+    {
+        "id": "gpt-4o",
+        "name": "GPT-4o",
+        "input": 2.50 / 1000000,
+        "output": 10.00 / 1000000,
+    },
+]
+
+
+# Index the models by id so a price is looked up without scanning the list.
+models_by_id: dict[str, Model] = {
+    model_info["id"]: model_info for model_info in models
+}
+
+
+# Function to compute the total price based on prompt and completion token usage.
+def get_price(
+    model_id: str,
+    prompt_tokens: int,
+    completion_tokens: int,
+) -> float:
+    # Look up the pricing details of the model.
+    model_info = models_by_id.get(model_id)
+    if model_info is None:
+        raise ValueError("Model not found")
+
+    # Calculate and return the total cost.
+    return (model_info["input"] * prompt_tokens) + (
+        model_info["output"] * completion_tokens
+    )
@@ -0,0 +1,413 @@
+import asyncio
+import email.utils
+import json
+import os
+import random
+import re
+import threading
+import time
+from functools import cache
+
+import httpx
+
+from .token_utils import token_counter
+
+# Account limits of the API key, read from the rate limit headers once the
+# first response arrives. Set them to the limits of your usage tier so the
+# first requests are paced too.
+RPM_LIMIT_ENV = "OPENAI_RPM_LIMIT"
+TPM_LIMIT_ENV = "OPENAI_TPM_LIMIT"
+DEFAULT_RPM_LIMIT = 500
+DEFAULT_TPM_LIMIT = 200_000
+
+MAX_RETRIES = 6
+# seconds of the first backoff, doubled on each retry up to the maximum
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RETRY_STATUS_CODES = {429, 503}
+
+# "6m0s", "1.5s" or "20ms"
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+def parse_duration(value: str) -> float | None:
+    """
+    Parse a duration from an `x-ratelimit-reset-*` header.
+
+    Args:
+        value (str): The header value, e.g. "6m0s" or "20ms".
+
+    Returns:
+        float | None: The duration in seconds, or None if it is not a
+            duration.
+    """
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(
+        float(amount) * DURATION_SECONDS[unit] for amount, unit in parts
+    )
+
+
+def parse_retry_after(headers: httpx.Headers) -> float | None:
+    """
+    Read how long the server asks to wait before retrying.
+
+    Args:
+        headers (httpx.Headers): The headers of a 429 or 503 response.
+
+    Returns:
+        float | None: Seconds to wait, or None if the server did not say.
+    """
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    # an HTTP date, a malformed one leaves the wait to the backoff
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class TokenBucket:
+    """
+    A token bucket that hands out waits instead of blocking, so the same
+    bucket paces threads and asyncio tasks.
+
+    Reservations may drive the bucket below zero, each caller then waits
+    until the refill has paid back its share of the debt.
+    """
+
+    def __init__(self, capacity: float, per_second: float) -> None:
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated
+        self.tokens = min(
+            self.capacity, self.tokens + elapsed * self.per_second
+        )
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take tokens from the bucket.
+
+        Args:
+            amount (float): The tokens the request needs.
+
+        Returns:
+            float: Seconds to wait before the request may be sent.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            # a request larger than the bucket must still get through
+            self.tokens -= min(amount, self.capacity)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.per_second
+
+    def try_reserve(self, amount: float) -> bool:
+        """
+        Take tokens from the bucket only if they are there now.
+
+        Args:
+            amount (float): The tokens the request needs.
+
+        Returns:
+            bool: Whether the tokens were taken.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            amount = min(amount, self.capacity)
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def release(self, amount: float) -> None:
+        """Give back tokens of a request that was not sent."""
+        with self._lock:
+            self.tokens = min(
+                self.capacity, self.tokens + min(amount, self.capacity)
+            )
+
+    def sync(
+        self, limit: float, remaining: float, reset: float | None
+    ) -> None:
+        """
+        Align the bucket with the limits reported by the server.
+
+        Args:
+            limit (float): The `x-ratelimit-limit-*` header.
+            remaining (float): The `x-ratelimit-remaining-*` header.
+            reset (float | None): Seconds until the limit is fully
+                replenished, from the `x-ratelimit-reset-*` header.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.capacity = limit
+            # the server only knows the requests that reached it, so the
+            # reservations of requests still in flight are kept
+            self.tokens = min(self.tokens, remaining)
+            if reset and limit > remaining:
+                self.per_second = (limit - remaining) / reset
+            else:
+                self.per_second = limit / 60
+
+    def drain(self, seconds: float) -> None:
+        """Keep every caller waiting at least this long, e.g. after a 429."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.per_second)
+
+
+class RateLimitScheduler:
+    """
+    Paces requests to stay under the request and token limits of the API
+    key and retries rate limited requests with jittered exponential
+    backoff. One scheduler is shared by every client of a process, so
+    concurrent demos and threads see the same budget.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = DEFAULT_RPM_LIMIT,
+        tokens_per_minute: int = DEFAULT_TPM_LIMIT,
+        max_retries: int = MAX_RETRIES,
+        backoff_base: float = BACKOFF_BASE,
+        backoff_max: float = BACKOFF_MAX,
+    ) -> None:
+        self.requests = TokenBucket(
+            requests_per_minute, requests_per_minute / 60
+        )
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retries = 0
+        self.rate_limited = 0
+
+    def estimate_tokens(self, request: httpx.Request) -> int:
+        """
+        Estimate the tokens a request counts against the token limit: its
+        prompt tokens plus the completion tokens it may use.
+
+        Args:
+            request (httpx.Request): The request to the API.
+
+        Returns:
+            int: The estimated tokens, 0 for requests without messages.
+        """
+        if not request.url.path.endswith("/chat/completions"):
+            return 0
+        try:
+            body = json.loads(request.content)
+        except ValueError:
+            return 0
+        if not isinstance(body, dict) or "messages" not in body:
+            return 0
+
+        tokens = token_counter.count(
+            body.get("model", ""), body["messages"], body.get("tools")
+        )
+        max_tokens = body.get("max_completion_tokens", body.get("max_tokens"))
+        if isinstance(max_tokens, int):
+            tokens += max_tokens * (body.get("n") or 1)
+        return tokens
+
+    def admit(self, request: httpx.Request) -> float:
+        """
+        Reserve a request and its tokens.
+
+        Args:
+            request (httpx.Request): The request to send.
+
+        Returns:
+            float: Seconds to wait before sending it.
+        """
+        return max(
+            self.requests.reserve(1),
+            self.tokens.reserve(self.estimate_tokens(request)),
+        )
+
+    def try_admit(self, request: httpx.Request) -> bool:
+        """
+        Reserve a request and its tokens only if it can be sent right
+        away, e.g. for an optional request such as a hedge.
+
+        Args:
+            request (httpx.Request): The request to send.
+
+        Returns:
+            bool: Whether the request was reserved.
+        """
+        if not self.requests.try_reserve(1):
+            return False
+        if not self.tokens.try_reserve(self.estimate_tokens(request)):
+            self.requests.release(1)
+            return False
+        return True
+
+    def update(self, headers: httpx.Headers) -> None:
+        """
+        Refill the buckets from the rate limit headers of a response.
+
+        Args:
+            headers (httpx.Headers): The headers of the response.
+        """
+        for kind, bucket in (
+            ("requests", self.requests),
+            ("tokens", self.tokens),
+        ):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if not limit or not remaining:
+                continue
+            try:
+                limit_value = float(limit)
+                remaining_value = float(remaining)
+            except ValueError:
+                continue
+            reset = headers.get(f"x-ratelimit-reset-{kind}")
+            bucket.sync(
+                limit_value,
+                remaining_value,
+                parse_duration(reset) if reset else None,
+            )
+
+    def retry_delay(self, response: httpx.Response, attempt: int) -> float:
+        """
+        Decide how long to wait before retrying a rate limited request.
+
+        Args:
+            response (httpx.Response): The 429 or 503 response.
+            attempt (int): The number of retries so far.
+
+        Returns:
+            float: Seconds to wait, `retry-after` plus jitter when the
+                server sent it, otherwise a full jitter exponential backoff.
+        """
+        backoff = min(self.backoff_max, self.backoff_base * 2**attempt)
+        retry_after = parse_retry_after(response.headers)
+        if retry_after is not None:
+            # spread the retries of requests that were told the same time
+            delay = retry_after + random.uniform(0, self.backoff_base)
+        else:
+            delay = random.uniform(0, backoff)
+
+        self.retries += 1
+        if response.status_code == 429:
+            self.rate_limited += 1
+            # hold back the other requests too instead of sending them into
+            # the same limit
+            self.requests.drain(delay)
+        return delay
+
+    def should_retry(self, response: httpx.Response, attempt: int) -> bool:
+        return (
+            response.status_code in RETRY_STATUS_CODES
+            and attempt < self.max_retries
+        )
+
+    @property
+    def stats(self) -> str:
+        return (
+            f"Rate limits: {self.rate_limited} rate limited responses, "
+            f"{self.retries} retries"
+        )
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """
+    An httpx transport that sends each request through a scheduler. Give
+    the client `max_retries=0` so the OpenAI client does not retry too.
+    """
+
+    def __init__(
+        self,
+        scheduler: RateLimitScheduler,
+        transport: httpx.BaseTransport | None = None,
+    ) -> None:
+        self.scheduler = scheduler
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        attempt = 0
+        while True:
+            time.sleep(self.scheduler.admit(request))
+            response = self.transport.handle_request(request)
+            self.scheduler.update(response.headers)
+            if not self.scheduler.should_retry(response, attempt):
+                return response
+
+            response.close()
+            time.sleep(self.scheduler.retry_delay(response, attempt))
+            attempt += 1
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    The asyncio version of `RateLimitedTransport`, waits without blocking
+    the event loop.
+    """
+
+    def __init__(
+        self,
+        scheduler: RateLimitScheduler,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ) -> None:
+        self.scheduler = scheduler
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(
+        self, request: httpx.Request
+    ) -> httpx.Response:
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.scheduler.admit(request))
+            response = await self.transport.handle_async_request(request)
+            self.scheduler.update(response.headers)
+            if not self.scheduler.should_retry(response, attempt):
+                return response
+
+            await response.aclose()
+            await asyncio.sleep(self.scheduler.retry_delay(response, attempt))
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+@cache
+def get_rate_limit_scheduler() -> RateLimitScheduler:
+    """
+    The scheduler shared by the clients of a process, built on first use
+    so the limits set in the .env file are read.
+    """
+    from .openai_utils import load_env
+
+    load_env()
+    return RateLimitScheduler(
+        requests_per_minute=int(os.getenv(RPM_LIMIT_ENV, DEFAULT_RPM_LIMIT)),
+        tokens_per_minute=int(os.getenv(TPM_LIMIT_ENV, DEFAULT_TPM_LIMIT)),
+    )
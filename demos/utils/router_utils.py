@@ -0,0 +1,370 @@
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any
+
+from .pricing_utils import get_price
+from .token_utils import token_counter
+
+if TYPE_CHECKING:
+    from openai.types import CompletionUsage
+
+SMALL_MODEL = "gpt-4o-mini"
+LARGE_MODEL = "gpt-4o"
+
+# questions scoring at least this much go to the large model
+COMPLEXITY_THRESHOLD = 3.0
+# a prompt this long is expensive on the large model, the small model
+# takes it unless the question itself is complex
+LONG_PROMPT_TOKENS = 4000
+# Set OPENAI_SESSION_BUDGET to the dollars a routed session may spend
+# before the router keeps complex questions on the small model.
+SESSION_BUDGET_ENV = "OPENAI_SESSION_BUDGET"
+DEFAULT_SESSION_BUDGET = 0.50
+# completion tokens assumed when pricing a turn before it is answered
+EXPECTED_COMPLETION_TOKENS = 400
+# stay on the small model once a large turn would use more than this
+# share of the remaining session budget
+BUDGET_SHARE = 0.25
+# seconds, the large model is skipped for moderately complex questions
+# while its observed time to first token is slower than this
+LATENCY_TARGET = 2.0
+LATENCY_WEIGHT = 0.3
+
+# Time to first token (seconds) and tokens per second assumed for a model
+# until the router has observed it.
+DEFAULT_LATENCY: dict[str, tuple[float, float]] = {
+    "gpt-4o-mini": (0.5, 80.0),
+    "gpt-4o": (0.7, 50.0),
+}
+
+# Words that hint a question needs reasoning rather than recall. Each
+# match adds its weight to the complexity score.
+COMPLEXITY_HINTS: dict[str, float] = {
+    r"\b(why|how come)\b": 1.0,
+    r"\b(compare|comparison|contrast|differences?|versus|vs\.?)\b": 1.5,
+    r"\b(analy[sz]e|analysis|evaluate|assess|critique|argue)\b": 1.5,
+    r"\b(explain|interpret|significance|impact|influence)\b": 1.0,
+    r"\b(essay|in detail|step by step|pros and cons)\b": 1.5,
+    r"\b(philosoph\w*|revolution\w*|enlightenment|existentialis\w*)\b": 0.5,
+    r"\b(translate|poem|write)\b": 1.0,
+}
+COMPILED_HINTS = [
+    (re.compile(pattern, re.IGNORECASE), weight)
+    for pattern, weight in COMPLEXITY_HINTS.items()
+]
+
+# Answers that mean the small model gave up or did not really answer.
+LOW_QUALITY_ANSWERS = re.compile(
+    r"^(i'?m sorry|sorry|i (can ?not|can't|am unable|don't know))\b|"
+    r"\bas an ai\b",
+    re.IGNORECASE,
+)
+MIN_ANSWER_WORDS = 12
+
+
+def question_complexity(question: str) -> float:
+    """
+    Score how much reasoning a question needs from cheap text signals.
+
+    Args:
+        question (str): The message of the user.
+
+    Returns:
+        float: 0 for a short factual question, 3 or more for questions
+            that should go to the large model.
+    """
+    words = len(question.split())
+    score = min(words / 25, 2.0)
+    # several questions in one message
+    score += max(question.count("?") - 1, 0) * 0.75
+    for pattern, weight in COMPILED_HINTS:
+        if pattern.search(question):
+            score += weight
+    return score
+
+
+@dataclass
+class RouteDecision:
+    model: str
+    reason: str
+    complexity: float
+    estimated_prompt_tokens: int
+    escalated: bool = False
+
+
+@dataclass
+class _ModelStats:
+    turns: int = 0
+    cost: float = 0.0
+    seconds: float = 0.0
+    time_to_first_token: float | None = None
+    tokens_per_second: float | None = None
+
+
+@dataclass
+class _Savings:
+    turns: int = 0
+    escalations: int = 0
+    # complex questions kept on the small model by the session budget
+    budget_holds: int = 0
+    cost: float = 0.0
+    baseline_cost: float = 0.0
+    seconds: float = 0.0
+    baseline_seconds: float = 0.0
+    models: dict[str, _ModelStats] = field(default_factory=dict)
+
+
+class ModelRouter:
+    """
+    Picks the small or the large model for each turn of a conversation.
+
+    The small model answers by default. A turn goes to the large model when
+    the question looks complex, unless the session budget is running out or
+    the large model is currently slow. An answer of the small model that
+    fails `check_answer` can be retried on the large model. The router
+    tracks what the session cost against always using the large model.
+    """
+
+    def __init__(
+        self,
+        small_model: str = SMALL_MODEL,
+        large_model: str = LARGE_MODEL,
+        session_budget: float | None = None,
+        latency_target: float = LATENCY_TARGET,
+    ) -> None:
+        self.small_model = small_model
+        self.large_model = large_model
+        self.session_budget = session_budget
+        self.latency_target = latency_target
+        self._savings = _Savings()
+        self._lock = threading.Lock()
+
+    @property
+    def spent(self) -> float:
+        return self._savings.cost
+
+    @property
+    def remaining_budget(self) -> float | None:
+        if self.session_budget is None:
+            return None
+        return max(self.session_budget - self._savings.cost, 0.0)
+
+    def _stats(self, model: str) -> _ModelStats:
+        return self._savings.models.setdefault(model, _ModelStats())
+
+    def _latency(self, model: str) -> tuple[float, float]:
+        stats = self._stats(model)
+        default_ttft, default_rate = DEFAULT_LATENCY.get(model, (1.0, 50.0))
+        return (
+            stats.time_to_first_token or default_ttft,
+            stats.tokens_per_second or default_rate,
+        )
+
+    def route(self, messages: list[Any], question: str) -> RouteDecision:
+        """
+        Pick the model for a turn.
+
+        Args:
+            messages (list[Any]): The messages the request will send.
+            question (str): The message of the user.
+
+        Returns:
+            RouteDecision: The model and the reason it was picked.
+        """
+        with self._lock:
+            self._savings.turns += 1
+        complexity = question_complexity(question)
+        prompt_tokens = token_counter.count(self.large_model, messages)
+
+        def decide(model: str, reason: str) -> RouteDecision:
+            return RouteDecision(model, reason, complexity, prompt_tokens)
+
+        if complexity < COMPLEXITY_THRESHOLD:
+            return decide(self.small_model, "simple question")
+
+        remaining = self.remaining_budget
+        large_cost = get_price(
+            self.large_model, prompt_tokens, EXPECTED_COMPLETION_TOKENS
+        )
+        if remaining is not None and large_cost > remaining * BUDGET_SHARE:
+            with self._lock:
+                self._savings.budget_holds += 1
+            return decide(self.small_model, "session budget")
+
+        very_complex = complexity >= COMPLEXITY_THRESHOLD * 1.5
+        if prompt_tokens > LONG_PROMPT_TOKENS and not very_complex:
+            return decide(self.small_model, "long prompt")
+
+        time_to_first_token, _ = self._latency(self.large_model)
+        if time_to_first_token > self.latency_target and not very_complex:
+            return decide(self.small_model, "large model is slow")
+
+        return decide(self.large_model, "complex question")
+
+    def check_answer(
+        self,
+        decision: RouteDecision,
+        answer: str | None,
+        finish_reason: str | None = None,
+    ) -> bool:
+        """
+        Check an answer with cheap heuristics before showing it.
+
+        Args:
+            decision (RouteDecision): The decision the answer came from.
+            answer (str | None): The content of the answer.
+            finish_reason (str | None): The finish reason of the answer.
+
+        Returns:
+            bool: False if the answer should be retried on the large model.
+        """
+        if decision.model == self.large_model or decision.escalated:
+            return True
+        if finish_reason == "length" or not answer:
+            return False
+        if LOW_QUALITY_ANSWERS.search(answer.strip()):
+            return False
+        # a complex question deserves more than a one-liner
+        return not (
+            decision.complexity >= COMPLEXITY_THRESHOLD / 2
+            and len(answer.split()) < MIN_ANSWER_WORDS
+        )
+
+    def escalate(self, decision: RouteDecision) -> RouteDecision:
+        """Retry a turn on the large model."""
+        with self._lock:
+            self._savings.escalations += 1
+        return RouteDecision(
+            self.large_model,
+            "failed quality check",
+            decision.complexity,
+            decision.estimated_prompt_tokens,
+            escalated=True,
+        )
+
+    def record(
+        self,
+        decision: RouteDecision,
+        usage: "CompletionUsage | None",
+        seconds: float,
+        time_to_first_token: float | None = None,
+        retried: bool = False,
+    ) -> None:
+        """
+        Record a completion, its cost and latency.
+
+        Args:
+            decision (RouteDecision): The decision the completion came from.
+            usage (CompletionUsage | None): The usage of the completion.
+            seconds (float): How long the completion took.
+            time_to_first_token (float | None): Seconds to the first token
+                of a streamed completion.
+            retried (bool): Whether the answer failed `check_answer` and
+                is retried, it costs money but would not have been asked
+                of the large model.
+        """
+        prompt_tokens = usage.prompt_tokens if usage else 0
+        completion_tokens = usage.completion_tokens if usage else 0
+        cost = get_price(decision.model, prompt_tokens, completion_tokens)
+        with self._lock:
+            stats = self._stats(decision.model)
+            stats.turns += 1
+            stats.cost += cost
+            stats.seconds += seconds
+
+            # follow the observed latency of the model
+            if time_to_first_token is not None:
+                stats.time_to_first_token = _moving_average(
+                    stats.time_to_first_token, time_to_first_token
+                )
+                generation_time = seconds - time_to_first_token
+                if completion_tokens > 1 and generation_time > 0:
+                    stats.tokens_per_second = _moving_average(
+                        stats.tokens_per_second,
+                        completion_tokens / generation_time,
+                    )
+
+            self._savings.cost += cost
+            self._savings.seconds += seconds
+            if retried:
+                return
+
+            # what the completion would have cost and taken on the large
+            # model
+            self._savings.baseline_cost += get_price(
+                self.large_model, prompt_tokens, completion_tokens
+            )
+            if decision.model == self.large_model and not decision.escalated:
+                self._savings.baseline_seconds += seconds
+            else:
+                large_ttft, large_rate = self._latency(self.large_model)
+                self._savings.baseline_seconds += (
+                    large_ttft + completion_tokens / large_rate
+                )
+
+    def report(self) -> str:
+        """
+        Summarize the money and time the routing saved.
+
+        Returns:
+            str: The turns per model, escalations, cost and latency of the
+                session against always using the large model.
+        """
+        with self._lock:
+            savings = self._savings
+            model_lines = [
+                f"  {model}: {stats.turns} completions, ${stats.cost:.6f}"
+                for model, stats in savings.models.items()
+            ]
+            cost_saved = savings.baseline_cost - savings.cost
+            seconds_saved = savings.baseline_seconds - savings.seconds
+            cost_share = (
+                cost_saved / savings.baseline_cost
+                if savings.baseline_cost
+                else 0.0
+            )
+            budget_lines = []
+            if self.session_budget is not None:
+                remaining = max(self.session_budget - savings.cost, 0.0)
+                budget_lines.append(
+                    f"Budget: ${self.session_budget:.6f}, "
+                    f"${remaining:.6f} left, {savings.budget_holds} complex "
+                    f"questions kept on {self.small_model} by the budget"
+                )
+            return "\n".join(
+                [
+                    f"Routed turns: {savings.turns} "
+                    f"(escalations: {savings.escalations})",
+                    *model_lines,
+                    f"Cost: ${savings.cost:.6f}, always {self.large_model}: "
+                    f"${savings.baseline_cost:.6f} "
+                    f"(saved ${cost_saved:.6f}, {cost_share:.0%})",
+                    f"Latency: {savings.seconds:.1f}s, always "
+                    f"{self.large_model}: about "
+                    f"{savings.baseline_seconds:.1f}s "
+                    f"(saved {seconds_saved:.1f}s)",
+                    *budget_lines,
+                ]
+            )
+
+
+def session_budget_from_env() -> float:
+    """
+    Read the session budget of the router from OPENAI_SESSION_BUDGET, after
+    the .env file is loaded.
+
+    Returns:
+        float: The dollars a session may spend, $0.50 when it is not set.
+    """
+    from .openai_utils import load_env
+
+    load_env()
+    return float(os.getenv(SESSION_BUDGET_ENV, DEFAULT_SESSION_BUDGET))
+
+
+def _moving_average(average: float | None, value: float) -> float:
+    if average is None:
+        return value
+    return average + LATENCY_WEIGHT * (value - average)
@@ -0,0 +1,273 @@
+import hashlib
+import math
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Protocol
+
+# A sparse vector, L2 normalized: dimension -> weight. Dense embeddings
+# fit too, with every dimension set.
+SparseVector = dict[int, float]
+
+HASHING_DIMENSIONS = 2**20
+# words that do not change what a question asks about; "when", "why",
+# "who", "where" and "how" are kept so those questions about the same topic
+# stay apart
+STOP_WORDS = frozenset(
+    "a about an and are as at be can could did do does for from give i in "
+    "is know me my of on or please s tell the there to us was were with "
+    "what which would you your".split()
+)
+# Follow-ups like "tell me more" or "who was his wife?" depend on the
+# conversation, they are never answered from the cache. A question needs
+# this many content words and none of these words to be cached.
+MIN_QUESTION_WORDS = 2
+FOLLOW_UP_WORDS = frozenset(
+    "again another else he her hers him his it its more other same she "
+    "that their them these they this those".split()
+)
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.85
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+# rough bytes of the bookkeeping of an entry and of each of its terms
+ENTRY_OVERHEAD_BYTES = 400
+TERM_OVERHEAD_BYTES = 120
+
+
+class Embedder(Protocol):
+    def embed(self, text: str) -> SparseVector: ...
+
+
+def normalize_text(text: str) -> str:
+    # lowercase without accents, so "Élysée" and "elysee" match
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def words(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", normalize_text(text))
+
+
+def is_standalone_question(question: str) -> bool:
+    question_words = words(question)
+    content_words = [word for word in question_words if word not in STOP_WORDS]
+    return len(content_words) >= MIN_QUESTION_WORDS and not any(
+        word in FOLLOW_UP_WORDS for word in question_words
+    )
+
+
+class HashingEmbedder:
+    """
+    Embeds text offline by hashing its words and word pairs into a sparse
+    vector with sublinear term frequencies.
+    """
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS) -> None:
+        self.dimensions = dimensions
+
+    def terms(self, text: str) -> list[str]:
+        content_words = [
+            word for word in words(text) if word not in STOP_WORDS
+        ]
+        pairs = [
+            f"{first} {second}"
+            for first, second in zip(content_words, content_words[1:])
+        ]
+        return content_words + pairs
+
+    def embed(self, text: str) -> SparseVector:
+        vector: SparseVector = {}
+        for term, count in Counter(self.terms(text)).items():
+            dimension = zlib.crc32(term.encode("utf-8")) % self.dimensions
+            vector[dimension] = (
+                vector.get(dimension, 0.0) + 1 + math.log(count)
+            )
+
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if not norm:
+            return {}
+        return {
+            dimension: weight / norm for dimension, weight in vector.items()
+        }
+
+
+def prompt_version(*prompts: str) -> str:
+    """
+    Hash the prompts answers depend on, so answers given under an older
+    system prompt are never returned.
+
+    Args:
+        *prompts (str): The system prompts and the model of the answers.
+
+    Returns:
+        str: A short version of the prompts.
+    """
+    return hashlib.sha256("\0".join(prompts).encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    similarity: float
+    seconds: float
+
+
+@dataclass
+class _Entry:
+    namespace: str
+    question: str
+    answer: str
+    vector: SparseVector
+    seconds: float
+    size: int
+
+
+class SemanticCache:
+    """
+    An in-memory cache of answers, looked up by the similarity of the
+    question to the questions already answered.
+
+    The vectors are kept in inverted lists, one per dimension, so a lookup
+    only scores the entries sharing a dimension with the question instead
+    of every entry. The least recently used answers are evicted once the
+    cache grows past `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder | None = None,
+        threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._postings: dict[tuple[str, int], dict[int, float]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, question: str) -> SparseVector | None:
+        if not is_standalone_question(question):
+            return None
+        return self.embedder.embed(question) or None
+
+    def get(self, namespace: str, question: str) -> CachedAnswer | None:
+        """
+        Find the answer to the most similar question asked before.
+
+        Args:
+            namespace (str): The prompt version the answer must come from.
+            question (str): The question of the user.
+
+        Returns:
+            CachedAnswer | None: The answer if a question is at least
+                `threshold` similar, otherwise None.
+        """
+        start = time.perf_counter()
+        vector = self._vector(question)
+
+        with self._lock:
+            scores: dict[int, float] = {}
+            if vector is not None:
+                for dimension, weight in vector.items():
+                    postings = self._postings.get((namespace, dimension), {})
+                    for entry_id, entry_weight in postings.items():
+                        scores[entry_id] = (
+                            scores.get(entry_id, 0.0) + weight * entry_weight
+                        )
+
+            best_id = max(scores, key=scores.__getitem__, default=None)
+            if best_id is None or scores[best_id] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            entry = self._entries[best_id]
+            self.hits += 1
+            self.seconds_saved += max(
+                entry.seconds - (time.perf_counter() - start), 0.0
+            )
+            return CachedAnswer(
+                question=entry.question,
+                answer=entry.answer,
+                similarity=scores[best_id],
+                seconds=entry.seconds,
+            )
+
+    def put(
+        self, namespace: str, question: str, answer: str, seconds: float
+    ) -> bool:
+        """
+        Cache the answer to a question.
+
+        Args:
+            namespace (str): The prompt version of the answer.
+            question (str): The question of the user.
+            answer (str): The answer of the model.
+            seconds (float): How long the answer took, reported as saved on
+                each hit.
+
+        Returns:
+            bool: Whether the answer was cached, questions that depend on
+                the conversation are not.
+        """
+        vector = self._vector(question)
+        if vector is None:
+            return False
+
+        size = (
+            len(question.encode("utf-8"))
+            + len(answer.encode("utf-8"))
+            + ENTRY_OVERHEAD_BYTES
+            + TERM_OVERHEAD_BYTES * len(vector)
+        )
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = _Entry(
+                namespace, question, answer, vector, seconds, size
+            )
+            for dimension, weight in vector.items():
+                self._postings.setdefault((namespace, dimension), {})[
+                    entry_id
+                ] = weight
+            self.size += size
+
+            while self.size > self.max_bytes:
+                self._evict_oldest()
+        return True
+
+    def _evict_oldest(self) -> None:
+        entry_id, entry = self._entries.popitem(last=False)
+        for dimension in entry.vector:
+            key = (entry.namespace, dimension)
+            postings = self._postings[key]
+            del postings[entry_id]
+            if not postings:
+                del self._postings[key]
+        self.size -= entry.size
+
+    @property
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return (
+            f"Semantic cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.0%} hit rate), {len(self._entries)} answers in "
+            f"{self.size / 1024:.0f} KB, about {self.seconds_saved:.1f}s "
+            "saved"
+        )
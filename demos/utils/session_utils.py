@@ -0,0 +1,321 @@
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path, PurePath
+from typing import Any, Iterator
+
+from .token_utils import message_dict
+
+# One index entry per record: segment number, byte offset, byte length and
+# kind. The fixed width lets the tail of a session be found by seeking
+# from the end of the index instead of reading the segments.
+INDEX_ENTRY = struct.Struct("<IQIB")
+KIND_TURN = 0
+KIND_MESSAGE = 1
+KIND_SUMMARY = 2
+
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024
+# segments at least this large are memory-mapped instead of read
+DEFAULT_MMAP_THRESHOLD = 1024 * 1024
+# index entries read at a time while looking back for the last summary
+INDEX_SCAN_BLOCK = 256
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Windows has no flock or pread, the lock is always exclusive there and
+# reads seek first
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock(file: Any, exclusive: bool) -> None:
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after about 10 seconds, keep waiting
+                continue
+
+    def _unlock(file: Any) -> None:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _pread(file: Any, length: int, offset: int) -> bytes:
+        file.seek(offset)
+        return file.read(length)
+
+else:
+    import fcntl
+
+    def _lock(file: Any, exclusive: bool) -> None:
+        fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+    def _unlock(file: Any) -> None:
+        fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _pread(file: Any, length: int, offset: int) -> bytes:
+        return os.pread(file.fileno(), length, offset)
+
+
+@dataclass
+class StoredSession:
+    """
+    The part of a session needed to continue it.
+
+    Attributes:
+        summary (str): The running summary of the summarized turns.
+        summarized_tokens (int): The tokens of the summarized turns.
+        turns (list[list[dict[str, Any]]]): The turns after the summary.
+        turn_records (list[int]): The record number each turn starts at.
+        records (int): The number of records in the session.
+    """
+
+    summary: str = ""
+    summarized_tokens: int = 0
+    turns: list[list[dict[str, Any]]] = field(default_factory=list)
+    turn_records: list[int] = field(default_factory=list)
+    records: int = 0
+
+
+class SessionStore:
+    """
+    Stores conversations in append-only JSONL segments with a compact
+    binary index, one folder per session.
+
+    Every message is appended as it happens, nothing is rewritten. The
+    summaries of `ConversationHistory` are appended as checkpoints, so
+    resuming a session reads the index back to the last summary and only
+    loads the turns after it. Appends take an exclusive file lock and loads
+    a shared one, so processes can share the store.
+    """
+
+    def __init__(
+        self,
+        folder: str | PurePath,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        mmap_threshold: int = DEFAULT_MMAP_THRESHOLD,
+        fsync: bool = False,
+    ) -> None:
+        self.folder = Path(folder)
+        self.segment_size = segment_size
+        self.mmap_threshold = mmap_threshold
+        self.fsync = fsync
+
+    def _session_folder(self, session_id: str) -> Path:
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"Invalid session id: {session_id!r}")
+        return self.folder / session_id
+
+    @contextmanager
+    def _locked(self, folder: Path, exclusive: bool) -> Iterator[None]:
+        with open(folder / "lock", "a+b") as lock_file:
+            _lock(lock_file, exclusive)
+            try:
+                yield
+            finally:
+                _unlock(lock_file)
+
+    def _segment_path(self, folder: Path, segment: int) -> Path:
+        return folder / f"{segment:06d}.jsonl"
+
+    def _write(self, file: Any, data: bytes) -> None:
+        file.write(data)
+        file.flush()
+        if self.fsync:
+            os.fsync(file.fileno())
+
+    def _append(self, session_id: str, kind: int, record: Any) -> int:
+        folder = self._session_folder(session_id)
+        folder.mkdir(parents=True, exist_ok=True)
+        line = (
+            json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+            + "\n"
+        ).encode("utf-8")
+
+        with self._locked(folder, exclusive=True):
+            with open(folder / "index.bin", "a+b") as index:
+                # drop a torn entry left by a crash during an append
+                size = index.seek(0, os.SEEK_END)
+                if size % INDEX_ENTRY.size:
+                    size -= size % INDEX_ENTRY.size
+                    index.truncate(size)
+
+                segment = 0
+                if size:
+                    index.seek(size - INDEX_ENTRY.size)
+                    last_entry = index.read(INDEX_ENTRY.size)
+                    segment = INDEX_ENTRY.unpack(last_entry)[0]
+                segment_path = self._segment_path(folder, segment)
+                offset = (
+                    segment_path.stat().st_size if segment_path.exists() else 0
+                )
+                if offset and offset + len(line) > self.segment_size:
+                    segment += 1
+                    segment_path = self._segment_path(folder, segment)
+                    offset = 0
+
+                # the record is written before its index entry, a crash in
+                # between leaves a record that is never read
+                with open(segment_path, "ab") as segment_file:
+                    self._write(segment_file, line)
+                self._write(
+                    index, INDEX_ENTRY.pack(segment, offset, len(line), kind)
+                )
+                return size // INDEX_ENTRY.size
+
+    def append_message(self, session_id: str, message: Any) -> int:
+        """
+        Append a message to a session.
+
+        Args:
+            session_id (str): The session, letters, digits, - and _.
+            message (Any): A message param or a ChatCompletionMessage.
+
+        Returns:
+            int: The record number of the message.
+        """
+        record = message_dict(message)
+        kind = KIND_TURN if record["role"] == "user" else KIND_MESSAGE
+        return self._append(session_id, kind, record)
+
+    def append_summary(
+        self,
+        session_id: str,
+        summary: str,
+        summarized_tokens: int,
+        first_kept_record: int,
+    ) -> int:
+        """
+        Append a summary checkpoint to a session.
+
+        Args:
+            session_id (str): The session.
+            summary (str): The running summary.
+            summarized_tokens (int): The tokens of the summarized turns.
+            first_kept_record (int): The record the turns that are not in
+                the summary start at.
+
+        Returns:
+            int: The record number of the summary.
+        """
+        return self._append(
+            session_id,
+            KIND_SUMMARY,
+            {
+                "summary": summary,
+                "summarized_tokens": summarized_tokens,
+                "first_kept_record": first_kept_record,
+            },
+        )
+
+    def _read_entries(
+        self, index: Any, start: int, stop: int
+    ) -> list[tuple[int, int, int, int]]:
+        data = _pread(
+            index,
+            (stop - start) * INDEX_ENTRY.size,
+            start * INDEX_ENTRY.size,
+        )
+        return list(INDEX_ENTRY.iter_unpack(data))
+
+    def _read_records(
+        self, folder: Path, entries: list[tuple[int, int, int, int]]
+    ) -> list[Any]:
+        records: list[Any] = []
+        # read each segment once, from the first to the last record needed
+        by_segment: dict[int, list[tuple[int, int, int, int]]] = {}
+        for entry in entries:
+            by_segment.setdefault(entry[0], []).append(entry)
+
+        for segment, segment_entries in by_segment.items():
+            start = segment_entries[0][1]
+            end = segment_entries[-1][1] + segment_entries[-1][2]
+            with open(self._segment_path(folder, segment), "rb") as file:
+                if os.fstat(file.fileno()).st_size >= self.mmap_threshold:
+                    with mmap.mmap(
+                        file.fileno(), 0, access=mmap.ACCESS_READ
+                    ) as mapped:
+                        data = mapped[start:end]
+                else:
+                    data = _pread(file, end - start, start)
+            for _, offset, length, _ in segment_entries:
+                records.append(
+                    json.loads(data[offset - start : offset - start + length])
+                )
+        return records
+
+    def load(self, session_id: str) -> StoredSession | None:
+        """
+        Load the tail of a session: its last summary and the turns after it.
+
+        Args:
+            session_id (str): The session.
+
+        Returns:
+            StoredSession | None: The session, or None if it does not exist.
+        """
+        folder = self._session_folder(session_id)
+        if not (folder / "index.bin").exists():
+            return None
+
+        session = StoredSession()
+        with self._locked(folder, exclusive=False):
+            with open(folder / "index.bin", "rb") as index:
+                count = os.fstat(index.fileno()).st_size // INDEX_ENTRY.size
+                session.records = count
+
+                # look back from the end for the last summary
+                summary_entry = None
+                stop = count
+                while stop > 0 and summary_entry is None:
+                    start = max(stop - INDEX_SCAN_BLOCK, 0)
+                    entries = self._read_entries(index, start, stop)
+                    summary_entry = next(
+                        (
+                            entry
+                            for entry in reversed(entries)
+                            if entry[3] == KIND_SUMMARY
+                        ),
+                        None,
+                    )
+                    stop = start
+
+                first_record = 0
+                if summary_entry is not None:
+                    summary = self._read_records(folder, [summary_entry])[0]
+                    session.summary = summary["summary"]
+                    session.summarized_tokens = summary["summarized_tokens"]
+                    first_record = summary["first_kept_record"]
+
+                entries = self._read_entries(index, first_record, count)
+
+            numbered = [
+                (first_record + position, entry)
+                for position, entry in enumerate(entries)
+                if entry[3] != KIND_SUMMARY
+            ]
+            messages = self._read_records(
+                folder, [entry for _, entry in numbered]
+            )
+
+        for (number, entry), message in zip(numbered, messages):
+            if entry[3] == KIND_TURN or not session.turns:
+                session.turns.append([])
+                session.turn_records.append(number)
+            session.turns[-1].append(message)
+        return session
+
+    def session_ids(self) -> list[str]:
+        if not self.folder.exists():
+            return []
+        return sorted(
+            path.name
+            for path in self.folder.iterdir()
+            if (path / "index.bin").exists()
+        )
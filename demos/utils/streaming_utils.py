@@ -0,0 +1,130 @@
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any
+
+from .openai_utils import get_openai_service
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from openai.types import CompletionUsage
+    from openai.types.chat import ChatCompletionMessageParam
+
+
+@dataclass
+class StreamedCompletion:
+    """
+    The result of a streamed chat completion.
+
+    Attributes:
+        content (str): The full assistant message rebuilt from the deltas.
+        usage (CompletionUsage | None): Token usage from the final chunk.
+        time_to_first_token (float | None): Seconds until the first content
+            delta arrived, or None if no content was streamed.
+        elapsed (float): Seconds from sending the request to the last chunk.
+        finish_reason (str | None): Why the model stopped, e.g. "length"
+            when the answer was cut off.
+    """
+
+    content: str
+    usage: "CompletionUsage | None"
+    time_to_first_token: float | None
+    elapsed: float
+    finish_reason: str | None = None
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        """Completion tokens per second, measured after the first token."""
+        if self.usage is None or self.time_to_first_token is None:
+            return None
+        generation_time = self.elapsed - self.time_to_first_token
+        if generation_time <= 0:
+            return None
+        return self.usage.completion_tokens / generation_time
+
+
+def print_delta(delta: str) -> None:
+    """Print a content delta of a streamed answer as it arrives."""
+    print(delta, end="", flush=True)
+
+
+def stream_chat_completion(
+    model: str,
+    messages: "list[ChatCompletionMessageParam]",
+    client: "OpenAI | None" = None,
+    **kwargs: Any,
+) -> StreamedCompletion:
+    """
+    Stream a chat completion, printing the content deltas as they arrive.
+
+    Args:
+        model (str): The model id to use.
+        messages (list[ChatCompletionMessageParam]): The conversation to send.
+        client (OpenAI | None): The client to use, the shared client from
+            `openai_utils` when not given.
+        **kwargs: Extra arguments passed to `chat.completions.create`.
+
+    Returns:
+        StreamedCompletion: The rebuilt message, usage and timing stats.
+    """
+    start = time.perf_counter()
+    client = client or get_openai_service()
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+
+    parts: list[str] = []
+    usage: "CompletionUsage | None" = None
+    time_to_first_token: float | None = None
+    finish_reason: str | None = None
+
+    print()
+    for chunk in stream:
+        # The usage chunk is the last one and has an empty choices list.
+        if chunk.usage:
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        if chunk.choices[0].finish_reason:
+            finish_reason = chunk.choices[0].finish_reason
+
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            parts.append(delta)
+            print_delta(delta)
+    print()
+
+    return StreamedCompletion(
+        content="".join(parts),
+        usage=usage,
+        time_to_first_token=time_to_first_token,
+        elapsed=time.perf_counter() - start,
+        finish_reason=finish_reason,
+    )
+
+
+def format_stream_stats(completion: StreamedCompletion) -> str:
+    """
+    Format the timing stats of a streamed completion.
+
+    Args:
+        completion (StreamedCompletion): The streamed completion.
+
+    Returns:
+        str: Time-to-first-token and tokens/sec on a single line.
+    """
+    if completion.time_to_first_token is None:
+        return f"(no content, {completion.elapsed:.2f}s)"
+
+    tokens_per_second = completion.tokens_per_second
+    rate = (
+        f"{tokens_per_second:.1f} tokens/sec"
+        if tokens_per_second is not None
+        else "tokens/sec unavailable"
+    )
+    return f"(first token {completion.time_to_first_token:.2f}s, {rate})"
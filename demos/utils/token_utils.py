@@ -0,0 +1,325 @@
+import base64
+import binascii
+import io
+import json
+import math
+import re
+import threading
+from typing import TYPE_CHECKING, Any, Iterable, cast
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionToolParam
+
+# Splits text the way the GPT tokenizers pre-tokenize it: contractions,
+# words with their leading space, runs of up to three digits, punctuation
+# and whitespace. Each piece is then costed with a few simple rules, so no
+# encoding files have to be downloaded.
+_PIECE_PATTERN = re.compile(
+    r"'(?:[sdmt]|ll|ve|re)"
+    r"| ?[^\W\d_]+"
+    r"| ?\d{1,3}"
+    r"| ?[^\s\w]+"
+    r"|\s+(?!\S)"
+    r"|\s+",
+    re.IGNORECASE,
+)
+
+# Tokens added for every message, for every name field and to prime the
+# reply, as documented in the OpenAI cookbook for the gpt-4o family.
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+TOKENS_PER_REPLY = 3
+
+# Tokens added for tool definitions, from the same cookbook notebook.
+TOOL_FUNCTION_INIT = 7
+TOOL_PROPERTY_INIT = 3
+TOOL_PROPERTY_KEY = 3
+TOOL_ENUM_INIT = -3
+TOOL_ENUM_ITEM = 3
+TOOL_FUNCTION_END = 12
+
+# (base tokens, tokens per 512px tile) charged for an image by each model,
+# gpt-4o-mini charges more tokens per image at a lower price per token.
+IMAGE_TOKEN_COSTS: dict[str, tuple[int, int]] = {
+    "gpt-4o-mini": (2833, 5667),
+    "gpt-4o": (85, 170),
+}
+DEFAULT_IMAGE_TOKEN_COST = IMAGE_TOKEN_COSTS["gpt-4o"]
+# tiles assumed for a high detail image whose size cannot be read
+DEFAULT_IMAGE_TILES = 4
+
+# how quickly the calibration follows the usage reported by the API
+CALIBRATION_WEIGHT = 0.3
+
+
+def message_dict(message: Any) -> dict[str, Any]:
+    """
+    Convert a message to a dict.
+
+    Args:
+        message (Any): A message param or a ChatCompletionMessage object
+            appended straight from a completion.
+
+    Returns:
+        dict[str, Any]: The message fields.
+    """
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude_none=True)
+    return dict(message)
+
+
+def count_text_tokens(text: str) -> int:
+    """
+    Estimate the tokens in a piece of text without a tokenizer.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    tokens = 0
+    for piece in _PIECE_PATTERN.findall(text):
+        stripped = piece.lstrip(" ")
+        if not stripped:
+            tokens += 1
+        elif stripped[0].isalpha():
+            # common words are a single token, long words are split
+            tokens += max(1, round(len(stripped) / 6))
+        elif stripped[0].isdigit() or stripped.isspace():
+            tokens += 1
+        else:
+            tokens += math.ceil(len(stripped) / 2)
+    return tokens
+
+
+def _image_token_cost(model: str) -> tuple[int, int]:
+    # match the longest model id prefix, gpt-4o-mini before gpt-4o
+    for model_id in sorted(IMAGE_TOKEN_COSTS, key=len, reverse=True):
+        if model.startswith(model_id):
+            return IMAGE_TOKEN_COSTS[model_id]
+    return DEFAULT_IMAGE_TOKEN_COST
+
+
+def _image_size(url: str) -> tuple[int, int] | None:
+    if not url.startswith("data:") or "," not in url:
+        return None
+    try:
+        from PIL import Image
+
+        data = base64.b64decode(url.split(",", 1)[1])
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except (binascii.Error, ImportError, OSError, ValueError):
+        return None
+
+
+def count_image_tokens(model: str, url: str, detail: str = "auto") -> int:
+    """
+    Estimate the tokens charged for an image part.
+
+    Args:
+        model (str): The model id.
+        url (str): The image URL, the size is read from data URLs.
+        detail (str): The detail level of the image.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    base_tokens, tile_tokens = _image_token_cost(model)
+    if detail == "low":
+        return base_tokens
+
+    size = _image_size(url)
+    if size is None:
+        return base_tokens + tile_tokens * DEFAULT_IMAGE_TILES
+
+    # fit within 2048x2048, then scale the shortest side down to 768px
+    scale = min(1.0, 2048 / max(size))
+    width, height = size[0] * scale, size[1] * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return base_tokens + tile_tokens * tiles
+
+
+def count_content_tokens(model: str, content: Any) -> int:
+    """
+    Estimate the tokens of message content, a string or a list of parts.
+
+    Args:
+        model (str): The model id.
+        content (Any): The message content.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return count_text_tokens(content)
+
+    tokens = 0
+    for part in content:
+        if part.get("type") == "image_url":
+            image_url = part["image_url"]
+            tokens += count_image_tokens(
+                model, image_url["url"], image_url.get("detail", "auto")
+            )
+        elif part.get("type") == "text":
+            tokens += count_text_tokens(part["text"])
+        elif part.get("type") == "refusal":
+            tokens += count_text_tokens(part["refusal"])
+        else:
+            tokens += count_text_tokens(json.dumps(part))
+    return tokens
+
+
+def count_tools_tokens(tools: "Iterable[ChatCompletionToolParam]") -> int:
+    """
+    Estimate the tokens added by function tool definitions.
+
+    Args:
+        tools (Iterable[ChatCompletionToolParam]): The tool definitions.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    tokens = 0
+    for tool in tools:
+        function = tool["function"]
+        tokens += TOOL_FUNCTION_INIT
+        tokens += count_text_tokens(
+            f"{function['name']}:{function.get('description', '')}"
+        )
+
+        parameters = function.get("parameters", {})
+        properties = cast(dict[str, Any], parameters.get("properties", {}))
+        if properties:
+            tokens += TOOL_PROPERTY_INIT
+            for key, schema in properties.items():
+                tokens += TOOL_PROPERTY_KEY
+                schema_type = schema.get("type", "")
+                description = schema.get("description", "")
+                tokens += count_text_tokens(
+                    f"{key}:{schema_type}:{description}"
+                )
+                if "enum" in schema:
+                    tokens += TOOL_ENUM_INIT
+                    for item in schema["enum"]:
+                        tokens += TOOL_ENUM_ITEM
+                        tokens += count_text_tokens(str(item))
+
+    if tokens:
+        tokens += TOOL_FUNCTION_END
+    return tokens
+
+
+def count_message_tokens(model: str, message: Any) -> int:
+    """
+    Estimate the tokens of one message, including its overhead.
+
+    Args:
+        model (str): The model id.
+        message (Any): A message param or ChatCompletionMessage.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    tokens = TOKENS_PER_MESSAGE
+    for key, value in message_dict(message).items():
+        if key == "content":
+            tokens += count_content_tokens(model, value)
+        elif key == "tool_calls":
+            tokens += count_text_tokens(json.dumps(value))
+        elif key == "name":
+            tokens += TOKENS_PER_NAME + count_text_tokens(value)
+        elif isinstance(value, str):
+            tokens += count_text_tokens(value)
+    return tokens
+
+
+class TokenCounter:
+    """
+    An offline prompt token counter calibrated against reported usage.
+
+    The rule based estimate is multiplied by a per-model ratio that tracks
+    the `usage.prompt_tokens` values returned by the API.
+    """
+
+    def __init__(self) -> None:
+        self._ratios: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def ratio(self, model: str) -> float:
+        return self._ratios.get(model, 1.0)
+
+    def count_raw(
+        self,
+        model: str,
+        messages: Iterable[Any],
+        tools: "Iterable[ChatCompletionToolParam] | None" = None,
+    ) -> int:
+        """Estimate prompt tokens without calibration."""
+        tokens = TOKENS_PER_REPLY
+        tokens += sum(
+            count_message_tokens(model, message) for message in messages
+        )
+        if tools:
+            tokens += count_tools_tokens(tools)
+        return tokens
+
+    def count(
+        self,
+        model: str,
+        messages: Iterable[Any],
+        tools: "Iterable[ChatCompletionToolParam] | None" = None,
+    ) -> int:
+        """
+        Estimate the prompt tokens of a request.
+
+        Args:
+            model (str): The model id.
+            messages (Iterable[Any]): The messages to send.
+            tools (Iterable[ChatCompletionToolParam] | None): The tools to
+                send.
+
+        Returns:
+            int: The calibrated estimate of the prompt tokens.
+        """
+        raw_tokens = self.count_raw(model, messages, tools)
+        return round(raw_tokens * self.ratio(model))
+
+    def calibrate(
+        self,
+        model: str,
+        messages: Iterable[Any],
+        prompt_tokens: int,
+        tools: "Iterable[ChatCompletionToolParam] | None" = None,
+    ) -> None:
+        """
+        Adjust the estimate of a model with the usage of a request.
+
+        Args:
+            model (str): The model id.
+            messages (Iterable[Any]): The messages that were sent.
+            prompt_tokens (int): The `usage.prompt_tokens` reported.
+            tools (Iterable[ChatCompletionToolParam] | None): The tools
+                that were sent.
+        """
+        raw_tokens = self.count_raw(model, messages, tools)
+        if raw_tokens <= 0 or prompt_tokens <= 0:
+            return
+
+        observed = prompt_tokens / raw_tokens
+        with self._lock:
+            if model in self._ratios:
+                self._ratios[model] += CALIBRATION_WEIGHT * (
+                    observed - self._ratios[model]
+                )
+            else:
+                self._ratios[model] = observed
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,155 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Callable, Literal, cast
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+    from openai.types.chat import (
+        ChatCompletion,
+        ChatCompletionMessageParam,
+        ChatCompletionMessageToolCall,
+        ChatCompletionToolMessageParam,
+        ChatCompletionToolParam,
+    )
+
+# seconds a tool call may take before the model is told it timed out
+TOOL_TIMEOUT = 15.0
+# rounds of tool calls before the model must answer without tools
+MAX_TOOL_ROUNDS = 5
+TOOL_WORKERS = 8
+
+# a shared pool, so a tool call that never returns does not block the
+# caller from moving on after its timeout
+_executor = ThreadPoolExecutor(
+    max_workers=TOOL_WORKERS, thread_name_prefix="tool"
+)
+
+
+def _call_tool(
+    call_function: Callable[[str, dict], str],
+    tool_call: "ChatCompletionMessageToolCall",
+) -> str:
+    args = json.loads(tool_call.function.arguments)
+    return call_function(tool_call.function.name, args)
+
+
+def run_tool_calls(
+    tool_calls: "list[ChatCompletionMessageToolCall]",
+    call_function: Callable[[str, dict], str],
+    timeout: float = TOOL_TIMEOUT,
+) -> "list[ChatCompletionToolMessageParam]":
+    """
+    Run the tool calls of a completion concurrently.
+
+    Args:
+        tool_calls (list[ChatCompletionMessageToolCall]): The tool calls
+            requested by the model.
+        call_function (Callable[[str, dict], str]): Runs a tool by name
+            with its arguments and returns the result.
+        timeout (float): Seconds each tool call may take.
+
+    Returns:
+        list[ChatCompletionToolMessageParam]: One tool message per tool
+            call, in the order the model requested them.
+    """
+    deadline = time.monotonic() + timeout
+    futures = [
+        _executor.submit(_call_tool, call_function, tool_call)
+        for tool_call in tool_calls
+    ]
+
+    tool_messages: "list[ChatCompletionToolMessageParam]" = []
+    for tool_call, future in zip(tool_calls, futures):
+        name = tool_call.function.name
+        try:
+            result = future.result(
+                timeout=max(0.0, deadline - time.monotonic())
+            )
+        except FutureTimeoutError:
+            result = f"Error: {name} timed out after {timeout} seconds."
+        except Exception as e:
+            result = f"Error: {name} failed. Reason: {e}"
+
+        tool_messages.append(
+            {
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": result,
+            }
+        )
+
+    return tool_messages
+
+
+def complete_with_tools(
+    client: "OpenAI",
+    model: str,
+    messages: "list[ChatCompletionMessageParam]",
+    tools: "list[ChatCompletionToolParam]",
+    call_function: Callable[[str, dict], str],
+    max_rounds: int = MAX_TOOL_ROUNDS,
+    on_completion: "Callable[[ChatCompletion, float], None] | None" = None,
+    completion: "ChatCompletion | None" = None,
+) -> "ChatCompletion":
+    """
+    Ask the model, running the tool calls it requests until it answers.
+
+    Args:
+        client (OpenAI): The OpenAI client.
+        model (str): The model to ask.
+        messages (list[ChatCompletionMessageParam]): The conversation, the
+            replies and tool messages are appended to it.
+        tools (list[ChatCompletionToolParam]): The tools the model may call.
+        call_function (Callable[[str, dict], str]): Runs a tool by name
+            with its arguments and returns the result.
+        max_rounds (int): Rounds of tool calls before the model must answer
+            without tools.
+        on_completion (Callable[[ChatCompletion, float], None] | None):
+            Called with each completion and the seconds it took, e.g. to
+            add up its usage.
+        completion (ChatCompletion | None): A completion already received
+            for the messages, e.g. from `run_guarded_chat_completion`, the
+            loop starts from its tool calls.
+
+    Returns:
+        ChatCompletion: The completion with the answer.
+    """
+
+    def create(tool_choice: Literal["auto", "none"]) -> "ChatCompletion":
+        start = time.perf_counter()
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+        if on_completion is not None:
+            on_completion(completion, time.perf_counter() - start)
+        messages.append(
+            cast("ChatCompletionMessageParam", completion.choices[0].message)
+        )
+        return completion
+
+    if completion is None:
+        completion = create("auto")
+    else:
+        messages.append(
+            cast("ChatCompletionMessageParam", completion.choices[0].message)
+        )
+    tool_rounds = 0
+    while (
+        completion.choices[0].message.tool_calls and tool_rounds < max_rounds
+    ):
+        tool_rounds += 1
+        # results come back in the order of the calls
+        messages.extend(
+            run_tool_calls(
+                completion.choices[0].message.tool_calls, call_function
+            )
+        )
+        # after the last allowed round the model must answer without tools
+        completion = create("none" if tool_rounds == max_rounds else "auto")
+
+    return completion